@@ -1,5 +1,6 @@
 import json
 import requests
+from datetime import datetime
 
 # Example payload: {"Time": "2022-10-20T20:58:13", "em": {"power_total": 230.04 }}
 # Convert ongoing power reading payload to float (negative = export)
@@ -19,6 +20,15 @@ def parse_power_payload(payload: bytes, command_min: float, command_max: float)
 
     return None
 
+# Optional: Source timestamp of the power reading payload (unix seconds or datetime), used by the ingest stage (config.ingest)
+def parse_power_timestamp(payload: bytes) -> datetime | float | None:
+    jobj = json.loads(payload)
+    if "Time" in jobj:
+        # Tasmota sends local time without offset, config.reading.timezone tells which
+        return datetime.fromisoformat(jobj["Time"])
+
+    return None
+
 # Convert calculated new limit to mqtt payload
 def command_to_payload(command: float, command_type: int, command_min: float, command_max: float) -> str | None:
     return f"{round(command,2):.2f}"
@@ -27,6 +37,14 @@ def command_to_payload(command: float, command_type: int, command_min: float, co
 def command_to_generic(command: float, command_type: int, command_min: float, command_max: float, config:dict) -> None:
     pass
 
+# Optional: Convert ongoing inverter power production payload to float (watts)
+def parse_inverter_power_payload(payload: bytes, command_min: float, command_max: float) -> float | None:
+    return float(payload.decode())
+
+# Optional: Convert inverter "limit applied" payload to float (same unit as command)
+def parse_inverter_limit_payload(payload: bytes, command_type: int, command_min: float, command_max: float) -> float | None:
+    return float(payload.decode())
+
 # Convert ongoing inverter status update payload to bool (True = Active /False = Inactive)
 def parse_inverter_status_payload(payload: bytes, current_status: bool) -> bool | None:
     s = payload.decode().lower()
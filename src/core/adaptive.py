@@ -0,0 +1,85 @@
+import logging
+
+logger = logging.getLogger("sec.control")
+
+# Weight of a new measurement in the rolling estimate
+ESTIMATE_ALPHA = 0.3
+
+
+class ResponseTimeEstimator:
+    """Measures the time between a published command and its effect. Settled is either the inverter power
+    reaching the new limit or the meter reading coming to rest after it moved. Measurements are folded into an
+    exponentially weighted rolling estimate."""
+
+    def __init__(self, settle_band: float, timeout: float) -> None:
+        self.settle_band: float = settle_band
+        self.timeout: float = timeout
+        self.delay: float | None = None
+        self.measurements: int = 0
+        self.__start: float | None = None
+        self.__limit: float = 0.0
+        self.__last_reading: float | None = None
+        self.__last_move: float | None = None
+
+    @property
+    def measuring(self) -> bool:
+        return self.__start is not None
+
+    def command_sent(self, now: float, limit: float, reading: float | None) -> None:
+        # A newer command invalidates the running measurement
+        self.__start = now
+        self.__limit = limit
+        self.__last_reading = reading
+        self.__last_move = None
+
+    def on_inverter_power(self, now: float, power: float) -> bool:
+        if self.__start is None or self.__expired(now):
+            return False
+
+        if abs(power - self.__limit) <= self.settle_band:
+            return self.__finish(now - self.__start)
+
+        return False
+
+    def on_reading(self, now: float, reading: float) -> bool:
+        if self.__start is None or self.__expired(now):
+            return False
+
+        previous = self.__last_reading
+        self.__last_reading = reading
+
+        if previous is None:
+            return False
+
+        if abs(reading - previous) > self.settle_band:
+            self.__last_move = now
+            return False
+
+        # At rest again after the reading moved: the last move was the effect of the command
+        if self.__last_move is not None:
+            return self.__finish(self.__last_move - self.__start)
+
+        return False
+
+    def reset(self) -> None:
+        self.__start = None
+        self.__last_reading = None
+        self.__last_move = None
+
+    def __expired(self, now: float) -> bool:
+        if now - self.__start > self.timeout:
+            self.reset()
+            return True
+        return False
+
+    def __finish(self, delay: float) -> bool:
+        self.reset()
+        self.measurements += 1
+
+        if self.delay is None:
+            self.delay = delay
+        else:
+            self.delay = self.delay + ESTIMATE_ALPHA * (delay - self.delay)
+
+        logger.debug(f"Inverter response measured: {delay:.2f}s, estimate: {self.delay:.2f}s")
+        return True
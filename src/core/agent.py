@@ -1,14 +1,39 @@
 import logging
+import importlib
+import os
+import signal
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
 import config.customize as customize
 import core.appconfig as appconfig
-from core.limit import LimitCalculator
+import core.profiling as profiling
+from core.limit import LimitCalculator, FLAG_FOLDED
 from core.helper import AppMqttHelper
+from core.reload import FileWatcher
+from core.adaptive import ResponseTimeEstimator
+from core.history import HistoryStore
+from core.recording import RecordingWriter
+from core.election import LeaseElection
+from core.ingest import IngestFilter, IngestPolicy, POLICY_ALL, to_unix
+from core.aggregate import ReadingAggregator
+from core.kpi import ControlKpi
+from core.ringbuffer import DecisionRing, EVENT_ACTIVE, EVENT_CONNECTED, EVENT_DISCONNECTED, EVENT_INACTIVE, EVENT_METER_RESUMED, EVENT_METER_STALE, \
+    EVENT_LEADER, EVENT_STANDBY
 from typing import Any
 
+logger = logging.getLogger("sec.control")
+
 SETUP_MODE_DURATION = 10
+RELOAD_POLL_INTERVAL = 2
+# Automatic dumps (stale meter, disconnect) are written at most once per interval, a flapping connection would fill the disk
+DUMP_MIN_INTERVAL = 300
+# --profile: cProfile window check and stage report
+PROFILE_POLL_INTERVAL = 5
+PROFILE_REPORT_INTERVAL = 300
 
 class ExportControlAgent:
-    def __init__(self, config: appconfig.AppConfig, mqtt_log: bool = False) -> None:
+    def __init__(self, config: appconfig.AppConfig, mqtt_log: bool = False, reload_path: str | None = None) -> None:
         self.config: appconfig.AppConfig = config
         self.limitcalc: LimitCalculator = LimitCalculator(config)
         self.mqtt_log: bool = mqtt_log
@@ -17,63 +42,305 @@ class ExportControlAgent:
         self.helper.on_connect(self.__on_connect_success, self.__on_connect_error)
         self.helper.on_power_reading(self.__on_power_reading, self.__parser_power_reading)
         self.helper.on_inverter_status(self.__on_inverter_status, self.__parser_inverter_status)
-        #self.helper.on_inverter_power(self.__on_inverter_power, self.__parser_inverter_power)
+        self.helper.on_inverter_power(self.__on_inverter_power, self.__parser_inverter_power)
+        self.helper.on_inverter_limit(self.__on_inverter_limit, self.__parser_inverter_limit)
+        self.helper.on_command_ack(self.__on_command_ack)
         self.helper.on_meta_cmd_enabled(self.__on_meta_cmd_active)
+        self.helper.on_meta_cmd_dump(self.__on_meta_cmd_dump)
+        self.helper.on_disconnect(self.__on_disconnect)
         self.helper.setup_will()
 
+        # Hot standby (config.redundancy): only the holder of the lease sends commands
+        self.__election: LeaseElection | None = None
+        if config.redundancy.enabled:
+            self.__election = LeaseElection(self.helper.instance_id, config.redundancy.lease_timeout)
+            self.helper.on_meta_status_leader(self.__on_leader_lease)
+            self.helper.on_meta_tele_command(self.__on_leader_command)
+
         self.__setup_mode: bool = True
         self.__meta_status: bool = True
         self.__inverter_status: bool = True
+        # Single flag checked per reading: active and not in setup mode
+        self.__readings_open: bool = False
+        # A resumed mqtt session skips the setup mode, only after one completed
+        self.__resumable: bool = False
         self.__published_discovery = False
 
+        # Command waiting for confirmation on the inverter limit topic
+        self.__pending_command: float | None = None
+        self.__pending_payload: str | None = None
+        self.__pending_attempt: int = 0
+        self.__pending_seq: int = 0
+
+        self.__estimator: ResponseTimeEstimator | None = None
+        self.__setup_estimator()
+
+        self.__history: HistoryStore | None = None
+        self.__setup_history()
+
+        self.__recorder: RecordingWriter | None = None
+        self.__setup_recorder()
+
+        self.__ring: DecisionRing | None = None
+        self.__setup_ring()
+
+        # One filter per power reading source. Source timestamps without offset are local time of config.reading.timezone
+        self.__ingest: list[IngestFilter] = []
+        self.__source_zone: ZoneInfo | None = None
+        self.__setup_ingest()
+
+        # Readings beyond the policy only update the smoothing window (config.ingest.policy)
+        self.__policy: IngestPolicy | None = None
+        self.__setup_policy()
+
+        # Several meters (config.mqtt.topics.readPowerSources) are summed up before the limit calculation
+        self.__power_sources: list[appconfig.MqttPowerSourceConfig] = []
+        self.__aggregator: ReadingAggregator | None = None
+        self.__setup_aggregator()
+
+        # Control quality (config.kpi), published every interval
+        self.__kpi: ControlKpi | None = None
+        self.__kpi_seq: int = 0
+        self.__setup_kpi()
+        self.__last_auto_dump: float = -DUMP_MIN_INTERVAL
+
+        # Meter stale detection (config.reading.staleTimeout)
+        self.__last_reading_time: float = time.monotonic()
+        self.__meter_stale: bool = False
+        self.__stale_seq: int = 0
+
+        self.__profile_report_due: float = time.monotonic() + PROFILE_REPORT_INTERVAL
+
+        self.__reload_path: str | None = reload_path
+        self.__watcher: FileWatcher | None = None
+        if reload_path is not None:
+            self.__watcher = FileWatcher([reload_path, customize.__file__])
+            logger.info(f"Hot reload: Watching config and customize.py ({'inotify' if self.__watcher.uses_inotify else 'mtime polling'})")
+
 # region Events
 
-    def __on_connect_success(self) -> None:
-        self.__ha_discovery()
-        self.helper.subscribe_meta_cmd_enabled()
-        self.helper.publish_meta_status_online(True)
-        self.helper.subscribe_inverter_status()
-        #self.helper.subscribe_inverter_power()
-        self.__start_setup_mode()
+    def __on_connect_success(self, session_present: bool) -> None:
+        self.__add_event(EVENT_CONNECTED)
+
+        if session_present and self.__resumable:
+            # Subscriptions survived and retained messages are not sent again: no discovery and no setup mode
+            logger.info("Session resumed: Subscriptions and status kept")
+            self.helper.publish_meta_status_online(True)
+            if self.__election is not None:
+                # The retained lease is only sent on subscribe
+                self.helper.unsubscribe_meta_status_leader()
+                self.helper.subscribe_meta_status_leader()
+        else:
+            if session_present:
+                # Session of an outdated state: subscribe again to get the retained messages
+                self.helper.unsubscribe_all()
+            if self.helper.broker_changed:
+                # The retained discovery and status are published again on the new broker
+                self.__published_discovery = False
+            self.__ha_discovery()
+            self.helper.subscribe_meta_cmd_enabled()
+            self.helper.subscribe_meta_cmd_dump()
+            self.helper.publish_meta_status_online(True)
+            self.helper.subscribe_inverter_status()
+            self.helper.subscribe_inverter_power()
+            self.helper.subscribe_inverter_limit()
+            if self.config.reading.keepSubscribed:
+                self.helper.subscribe_power_reading()
+            if self.__election is not None:
+                self.helper.subscribe_meta_status_leader()
+                self.helper.subscribe_meta_tele_command()
+
+            if self.helper.broker_changed and self.__resumable:
+                # Failover: smoothing window and last limit are kept, retained messages of the new broker arrive as regular updates
+                logger.info("Broker changed: Skipping setup mode")
+                self.__set_status(meta_status=None, inverter_status=None, force=True)
+            else:
+                self.__start_setup_mode()
+
+        # Scheduled actions do not survive a reconnect
+        if self.__pending_command is not None:
+            self.__schedule_confirm_timeout()
+
+        self.__schedule_polls()
+        self.__schedule_stale_check()
+
+        if self.__election is not None:
+            self.__schedule_lease()
+
+        if self.__kpi is not None:
+            self.__schedule_kpi()
 
     def __on_connect_error(self, rc: Any) -> None:
+        self.__resumable = False
+        self.__readings_open = False
         self.__inverter_status = False
         self.__meta_status = False
         self.__setup_mode = False
 
+    def __on_disconnect(self, rc: int) -> None:
+        self.__add_event(EVENT_DISCONNECTED, rc)
+        if not self.helper.stopping:
+            self.__dump("disconnect", auto=True)
+
+        if self.__election is not None:
+            if self.__election.is_leader:
+                self.__clear_pending_command()
+                self.__add_event(EVENT_STANDBY)
+                logger.warning("Redundancy: Connection lost, the standby takes over once the lease expires")
+            self.__election.reset()
+
+        # Keep watching the config while reconnecting, a reload may fix the connection settings
+        self.__schedule_polls()
+
+    def __schedule_polls(self) -> None:
+        if self.__watcher is not None:
+            self.helper.schedule(RELOAD_POLL_INTERVAL, self.__poll_reload)
+
+        if profiling.profiler is not None:
+            self.helper.schedule(PROFILE_POLL_INTERVAL, self.__poll_profile)
+
+    def __on_meta_cmd_dump(self) -> None:
+        self.__dump("mqtt")
+
     def __on_inverter_status(self, value: bool) -> None:
         self.__set_status(inverter_status=value)
 
     def __on_meta_cmd_active(self, active: bool) -> None:
         self.__set_status(meta_status=active)
 
+    def __on_inverter_limit(self, value: float) -> None:
+        if self.__pending_command is None:
+            return
+
+        if abs(value - self.__pending_command) <= self.config.command.confirm_tolerance:
+            logger.info(f"Command confirmed by inverter: {value:.2f} (attempt {self.__pending_attempt})")
+            self.__clear_pending_command()
+
+    def __on_inverter_power(self, value: float) -> None:
+        if self.__estimator is not None and self.__estimator.on_inverter_power(time.monotonic(), value):
+            self.__update_response_time()
+
     def __on_power_reading(self, value: float) -> None:
-        # Possible buffered message in pipeline after unsubscribe
-        if not self.__inverter_status or not self.__meta_status or self.__setup_mode:
+        # Gated here: reading.keepSubscribed or a buffered message in the pipeline after unsubscribe
+        if not self.__readings_open:
+            return
+
+        now = time.monotonic()
+        self.__last_reading_time = now
+        if self.__meter_stale:
+            self.__meter_stale = False
+            self.__add_event(EVENT_METER_RESUMED)
+            logger.info("Power reading resumed")
+
+        if self.__election is not None and not self.__election.is_leader:
+            # Standby: the same readings keep the window current, commands are mirrored from the leader
+            self.limitcalc.observe_reading(value, now)
+            return
+
+        if self.__estimator is not None and self.__estimator.on_reading(now, value):
+            self.__update_response_time()
+
+        # Every reading counts, folded ones as well
+        if self.__kpi is not None:
+            self.__kpi.add_reading(value, now)
+
+        if self.__policy is not None and not self.limitcalc.is_urgent(value) and not self.__policy.due(now):
+            self.limitcalc.observe_reading(value, now)
+            if self.__recorder is not None:
+                self.__recorder.append(time.time(), value, FLAG_FOLDED)
             return
 
-        result = self.limitcalc.add_reading(value)
-        self.helper.publish_meta_teles(result.reading, result.sample, result.overshoot, result.limit)
+        with profiling.stage("add_reading"):
+            result = self.limitcalc.add_reading(value, now)
+
+        wall = time.time()
+        if self.__ring is not None:
+            self.__ring.add_result(wall, result)
+        if self.__history is not None:
+            self.__history.add(wall, result)
+        if self.__recorder is not None:
+            self.__recorder.append(wall, value, result.flags)
+
+        with profiling.stage("publish_meta_teles"):
+            self.helper.publish_meta_teles(result.reading, result.sample, result.overshoot, result.limit)
+            self.helper.publish_meta_tele_tokens(result.tokens)
 
         if result.command is not None:
             self.__send_command(result.command)
+            if self.__kpi is not None:
+                self.__kpi.add_command()
+
+            if self.__estimator is not None:
+                self.__estimator.command_sent(now, result.limit, value)
 
 # endregion
 
-    def __parser_power_reading(self, payload: bytes) -> float | None:
-        return customize.parse_power_payload(payload, self.config.command.min_power, self.config.command.max_power)
+    def __parser_power_reading(self, payload: bytes, source: int = 0, redelivered: bool = False) -> float | None:
+        aggregator = self.__aggregator
+        now = time.time()
+        timestamp: float | None = None
+        if aggregator is not None or (self.__ingest and self.__ingest[source].needs_timestamp):
+            timestamp = self.__parse_power_timestamp(payload)
+
+        if self.__ingest and not self.__ingest[source].accept(payload, timestamp, now, redelivered):
+            return None
+
+        with profiling.stage("parse_power_payload"):
+            config = self.__power_sources[source]
+            # Looked up per reading: a hot reload of customize.py replaces the functions
+            parser = getattr(customize, config.parser, None)
+            if parser is None:
+                raise ValueError(f"customize.py has no function '{config.parser}' for '{config.topic}'")
+            value = parser(payload, self.config.command.min_power, self.config.command.max_power)
+            if value is not None and config.sign < 0:
+                value = -value
+
+        if aggregator is None or value is None:
+            return value
+
+        return aggregator.add(source, value, timestamp if timestamp is not None else now)
+
+    def __parse_power_timestamp(self, payload: bytes) -> float | None:
+        # Optional in customize.py: Older customize files do not define it, only the payload hash can be checked
+        # and readings are aligned by their time of arrival then
+        parser = getattr(customize, "parse_power_timestamp", None)
+        if parser is None:
+            return None
+
+        try:
+            return to_unix(parser(payload), self.__source_zone)
+        except Exception as ex:
+            logger.debug(f"customize.parse_power_timestamp failed: {ex}")
+            return None
 
     def __parser_inverter_status(self, payload: bytes) -> bool | None:
         return customize.parse_inverter_status_payload(payload, self.__inverter_status)
 
+    def __parser_inverter_power(self, payload: bytes) -> float | None:
+        # Optional in customize.py: Older customize files do not define it
+        parser = getattr(customize, "parse_inverter_power_payload", None)
+        if parser is None:
+            return float(payload.decode())
+        return parser(payload, self.config.command.min_power, self.config.command.max_power)
+
+    def __parser_inverter_limit(self, payload: bytes) -> float | None:
+        # Optional in customize.py: Older customize files do not define it
+        parser = getattr(customize, "parse_inverter_limit_payload", None)
+        if parser is None:
+            return float(payload.decode())
+        return parser(payload, self.config.command.type, self.config.command.min_power, self.config.command.max_power)
+
     def __start_setup_mode(self) -> None:
         self.__setup_mode = True    
-        logging.info(f"Setup mode start: Waiting {SETUP_MODE_DURATION}s for potential retained messages to arrive...")
+        self.__readings_open = False
+        self.__resumable = False
+        logger.info(f"Setup mode start: Waiting {SETUP_MODE_DURATION}s for potential retained messages to arrive...")
         self.helper.schedule(SETUP_MODE_DURATION, self.__stop_setup_mode)
 
     def __stop_setup_mode(self) -> None:
         self.__setup_mode = False
-        logging.info("Setup mode end")
+        self.__resumable = True
+        logger.info("Setup mode end")
         self.__set_status(meta_status=None, inverter_status=None, force=True)
 
     def __set_status(self, meta_status: bool | None = None, inverter_status: bool | None = None, force: bool = False) -> None:
@@ -96,43 +363,407 @@ class ExportControlAgent:
             return
 
         active = meta_status and inverter_status
+        self.__readings_open = active
         self.helper.publish_meta_status_enabled(meta_status)
         self.helper.publish_meta_status_inverter(inverter_status)
         self.helper.publish_meta_status_active(active)
         reason = f"Enabled: {'on ' if meta_status else 'off'}, Inverter: {'on ' if inverter_status else 'off'}"
 
+        self.__add_event(EVENT_ACTIVE if active else EVENT_INACTIVE, int(meta_status) * 2 + int(inverter_status))
+
         if active:         
-            logging.info(f"Application status: Active -> {reason}")
+            logger.info(f"Application status: Active -> {reason}")
+            self.__last_reading_time = time.monotonic()
             
             if not force:
                 self.limitcalc.reset()
+            if self.__policy is not None:
+                self.__policy.reset()
+            if self.__kpi is not None:
+                self.__kpi.reset()
 
-            self.helper.subscribe_power_reading()         
-            #self.helper.subscribe_inverter_power()
+            self.helper.subscribe_power_reading()
         else:
-            logging.info(f"Application status: Inactive -> {reason}")
-            self.helper.unsubscribe_power_reading()
-            #self.helper.unsubscribe_inverter_power()
+            logger.info(f"Application status: Inactive -> {reason}")
+            self.limitcalc.log_stats()
+            for ingest in self.__ingest:
+                ingest.log_stats()
+            if self.__aggregator is not None:
+                self.__aggregator.log_stats()
+            if self.__policy is not None:
+                self.__policy.log_stats()
+            if self.__kpi is not None:
+                self.__kpi.log_stats()
+            if self.config.command.qos > 0:
+                logger.info(f"Commands superseded before broker ack: {self.helper.cmd_superseded}")
+            # Flapping status would otherwise unsubscribe and subscribe (and get the retained reading) each time
+            if not self.config.reading.keepSubscribed:
+                self.helper.unsubscribe_power_reading()
             if not meta_status and not meta_status_retr and self.config.meta.reset_inverter_on_inactive and self.__inverter_status:
                 self.__send_command(self.limitcalc.get_command_default())
 
     def __send_command(self, command: float) -> None:
+        if self.__election is not None and not self.__election.is_leader:
+            return
+
         try:
-            cmdpayload = customize.command_to_payload(command, self.config.command.type, self.config.command.min_power, self.config.command.max_power)
+            with profiling.stage("command_to_payload"):
+                cmdpayload = customize.command_to_payload(command, self.config.command.type, self.config.command.min_power, self.config.command.max_power)
         except Exception as ex:
-            logging.warning(f"customize.command_to_payload failed: {ex}")
+            logger.warning(f"customize.command_to_payload failed: {ex}")
             return
 
         if cmdpayload is None:
             return
 
-        self.helper.publish_command(cmdpayload)
+        published = self.helper.publish_command(cmdpayload)
         self.helper.publish_meta_tele_command(command)
+        if published:
+            self.__track_command(command, cmdpayload)
 
         try:
-            customize.command_to_generic(command, self.config.command.type, self.config.command.min_power, self.config.command.max_power, self.config.customize.command)
+            with profiling.stage("command_to_generic"):
+                customize.command_to_generic(command, self.config.command.type, self.config.command.min_power, self.config.command.max_power, self.config.customize.command)
         except Exception as ex:
-            logging.warning(f"customize.command_to_generic failed: {ex}")
+            logger.warning(f"customize.command_to_generic failed: {ex}")
+
+    def __setup_estimator(self) -> None:
+        adaptive = self.config.command.adaptive_throttle
+        if not adaptive.enabled:
+            self.__estimator = None
+            return
+
+        if self.__estimator is None:
+            self.__estimator = ResponseTimeEstimator(adaptive.settle_band, adaptive.max * 2)
+        else:
+            # LimitCalculator keeps the learned response time across apply_config
+            self.__estimator.settle_band = adaptive.settle_band
+            self.__estimator.timeout = adaptive.max * 2
+
+    def __setup_history(self) -> None:
+        if self.__history is not None:
+            self.__history.close()
+            self.__history = None
+
+        if self.config.history.enabled:
+            self.__history = HistoryStore(self.config.history)
+
+    def __setup_recorder(self) -> None:
+        if self.__recorder is not None:
+            self.__recorder.close()
+            self.__recorder = None
+
+        recording = self.config.recording
+        if recording.enabled:
+            self.__recorder = RecordingWriter(recording.path, recording.chunk_records, recording.flush_records)
+            logger.info(f"Recording: Writing readings to '{recording.path}'")
+
+    def __setup_ring(self) -> None:
+        size = self.config.diagnostics.ring_size
+        if size == 0:
+            self.__ring = None
+        elif self.__ring is None or self.__ring.size != size:
+            self.__ring = DecisionRing(size)
+
+    def __setup_ingest(self) -> None:
+        timezone = self.config.reading.timezone
+        self.__source_zone = ZoneInfo(timezone) if timezone is not None else None
+
+        ingest = self.config.ingest
+        topics = self.config.mqtt.topics.read_power_topics
+        if not ingest.enabled:
+            self.__ingest = []
+        elif [f.name for f in self.__ingest] != topics:
+            self.__ingest = [IngestFilter(ingest, topic) for topic in topics]
+        else:
+            # Latest timestamp, recent hashes and counters are kept
+            for f in self.__ingest:
+                f.config = ingest
+
+    def __setup_policy(self) -> None:
+        ingest = self.config.ingest
+        if ingest.policy == POLICY_ALL:
+            self.__policy = None
+        elif self.__policy is None:
+            self.__policy = IngestPolicy(ingest)
+        else:
+            self.__policy.config = ingest
+            self.__policy.reset()
+
+    def __setup_aggregator(self) -> None:
+        reading = self.config.reading
+        self.__power_sources = self.config.mqtt.topics.power_sources
+        for source in self.__power_sources:
+            if not hasattr(customize, source.parser):
+                logger.warning(f"Config: customize.py has no function '{source.parser}' for '{source.topic}'")
+
+        sources = len(self.__power_sources)
+        if sources == 1:
+            self.__aggregator = None
+        elif self.__aggregator is None or self.__aggregator.sources != sources:
+            self.__aggregator = ReadingAggregator(sources, reading.aggregateTolerance, reading.aggregateMaxStale)
+            logger.info(f"Aggregate: Summing up {sources} power readings")
+        else:
+            self.__aggregator.tolerance = reading.aggregateTolerance
+            self.__aggregator.max_stale = reading.aggregateMaxStale
+
+    def __setup_kpi(self) -> None:
+        if not self.config.kpi.enabled:
+            self.__kpi = None
+        elif self.__kpi is None:
+            self.__kpi = ControlKpi(self.config, time.monotonic())
+        else:
+            # Totals are kept
+            self.__kpi.apply_config(self.config)
+
+    def __add_event(self, event: int, value: float = 0.0) -> None:
+        if self.__ring is not None:
+            self.__ring.add_event(time.time(), event, value)
+
+    def __dump(self, reason: str, auto: bool = False) -> None:
+        if self.__ring is None:
+            if not auto:
+                logger.info(f"Dump ({reason}): Not available without 'diagnostics.ringSize'")
+            return
+
+        if auto:
+            now = time.monotonic()
+            if now - self.__last_auto_dump < DUMP_MIN_INTERVAL:
+                return
+            self.__last_auto_dump = now
+
+        directory = self.config.diagnostics.dump_path
+        path = os.path.join(directory, f"dump-{datetime.now():%Y%m%d-%H%M%S}-{reason}.csv")
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+            rows = self.__ring.dump(path)
+            logger.info(f"Dump ({reason}): {rows} rows written to '{path}'")
+        except OSError as ex:
+            logger.warning(f"Dump ({reason}) failed: {ex}")
+
+    def __schedule_stale_check(self) -> None:
+        timeout = self.config.reading.staleTimeout
+        if timeout <= 0:
+            return
+
+        self.__stale_seq += 1
+        seq = self.__stale_seq
+        self.helper.schedule(max(1, timeout // 2), lambda: self.__check_stale(seq))
+
+    def __check_stale(self, seq: int) -> None:
+        if seq != self.__stale_seq:
+            return
+
+        self.__schedule_stale_check()
+        timeout = self.config.reading.staleTimeout
+        # Readings are only expected while active
+        if timeout <= 0 or self.__meter_stale or self.__setup_mode or not (self.__meta_status and self.__inverter_status):
+            return
+
+        silence = time.monotonic() - self.__last_reading_time
+        if silence >= timeout:
+            self.__meter_stale = True
+            refused = [t for t in self.config.mqtt.topics.read_power_topics if not self.helper.is_subscribed(t)]
+            reason = f", not subscribed (refused or unacknowledged by broker): {', '.join(refused)}" if refused else ""
+            logger.warning(f"Power reading is stale: No reading for {silence:.0f}s{reason}")
+            self.__add_event(EVENT_METER_STALE, silence)
+            self.__dump("stale", auto=True)
+
+    def __schedule_kpi(self) -> None:
+        self.__kpi_seq += 1
+        seq = self.__kpi_seq
+        self.helper.schedule(self.config.kpi.interval, lambda: self.__publish_kpi(seq))
+
+    def __publish_kpi(self, seq: int) -> None:
+        if seq != self.__kpi_seq or self.__kpi is None:
+            return
+
+        self.__schedule_kpi()
+        # The standby does not control, its numbers would be the ones of the leader
+        if self.__election is not None and not self.__election.is_leader:
+            return
+
+        kpi = self.__kpi
+        rate = kpi.end_period(time.monotonic())
+        self.helper.publish_meta_tele_kpis(kpi.export_wh, kpi.import_wh, kpi.above_target, rate, kpi.settling_time)
+
+    def __poll_profile(self) -> None:
+        self.helper.schedule(PROFILE_POLL_INTERVAL, self.__poll_profile)
+        profiling.profiler.poll_cprofile()
+
+        if time.monotonic() >= self.__profile_report_due:
+            self.__profile_report_due = time.monotonic() + PROFILE_REPORT_INTERVAL
+            profiling.profiler.log_report()
+
+    def __update_response_time(self) -> None:
+        delay = self.__estimator.delay
+        throttle = self.limitcalc.set_response_time(delay)
+        self.helper.publish_meta_tele_delay(delay)
+        logger.info(f"Inverter response time: {delay:.2f}s -> throttle: {throttle:.2f}s")
+
+    def __track_command(self, command: float, payload: str) -> None:
+        if self.config.command.confirm_timeout <= 0 or not self.helper.has_inverter_limit:
+            return
+
+        # A newer command supersedes the pending one
+        self.__pending_command = command
+        self.__pending_payload = payload
+        self.__pending_attempt = 1
+        self.__schedule_confirm_timeout()
+
+    def __schedule_confirm_timeout(self) -> None:
+        self.__pending_seq += 1
+        seq = self.__pending_seq
+        self.helper.schedule(self.config.command.confirm_timeout, lambda: self.__on_confirm_timeout(seq))
+
+    def __on_confirm_timeout(self, seq: int) -> None:
+        if seq != self.__pending_seq or self.__pending_command is None:
+            return
+
+        if self.__election is not None and not self.__election.is_leader:
+            self.__clear_pending_command()
+            return
+
+        if self.__pending_attempt > self.config.command.confirm_retries:
+            logger.warning(f"Command '{self.__pending_payload}' was not confirmed by inverter after {self.__pending_attempt} attempts")
+            self.__clear_pending_command()
+            return
+
+        self.__pending_attempt += 1
+        missing = "acknowledged by broker" if self.helper.has_command_inflight() else "confirmed by inverter"
+        logger.info(f"Command '{self.__pending_payload}' not {missing} within {self.config.command.confirm_timeout}s, resending (attempt {self.__pending_attempt})")
+        self.helper.publish_command(self.__pending_payload)
+        self.__schedule_confirm_timeout()
+
+    def __on_command_ack(self, payload: str, elapsed: float) -> None:
+        # The inverter can only apply what the broker has: the confirm timeout starts again at the ack
+        if self.__pending_payload == payload:
+            self.__schedule_confirm_timeout()
+
+    def __clear_pending_command(self) -> None:
+        self.__pending_command = None
+        self.__pending_payload = None
+        self.__pending_attempt = 0
+        self.__pending_seq += 1
+
+    def __on_leader_lease(self, payload: str, retained: bool) -> None:
+        election = self.__election
+        was_leader = election.is_leader
+
+        if election.on_lease(payload, retained, time.monotonic()):
+            self.helper.publish_meta_status_leader()
+        elif was_leader and not election.is_leader:
+            self.__become_standby()
+        elif election.holder is None and not self.__setup_mode and election.should_claim(time.monotonic()):
+            # Released by the leader on shutdown: take over at once
+            self.__claim_lease()
+
+    def __on_leader_command(self, command: float) -> None:
+        # As leader this is our own telemetry
+        if not self.__election.is_leader:
+            self.limitcalc.mirror_command(command, time.monotonic())
+
+    def __schedule_lease(self) -> None:
+        self.helper.schedule(self.config.redundancy.lease_interval, self.__poll_lease)
+
+    def __poll_lease(self) -> None:
+        self.__schedule_lease()
+        # The retained lease arrives during the setup mode
+        if self.__setup_mode:
+            return
+
+        if self.__election.is_leader:
+            self.helper.publish_meta_status_leader()
+            # The last will of a standby that is gone set the shared status to offline
+            self.helper.publish_meta_status_online(True)
+        elif self.__election.should_claim(time.monotonic()):
+            self.__claim_lease()
+
+    def __claim_lease(self) -> None:
+        self.__election.claim()
+        self.helper.publish_meta_status_leader()
+        self.__add_event(EVENT_LEADER)
+        logger.info(f"Redundancy: '{self.__election.instance_id}' is leader")
+
+    def __become_standby(self) -> None:
+        self.__clear_pending_command()
+        self.__add_event(EVENT_STANDBY)
+        logger.info(f"Redundancy: Standby, mirroring the commands of '{self.__election.holder}'")
+
+    def __poll_reload(self) -> None:
+        self.helper.schedule(RELOAD_POLL_INTERVAL, self.__poll_reload)
+        changed = self.__watcher.poll()
+
+        if not changed:
+            return
+
+        new_config = self.config
+        if self.__reload_path in changed:
+            try:
+                new_config = appconfig.AppConfig.from_json_file(self.__reload_path)
+            except Exception as ex:
+                # The watcher reported customize.py only once: it is still reloaded below
+                logger.warning(f"Hot reload: Config is invalid, keeping current config: {ex}")
+
+        if customize.__file__ in changed:
+            try:
+                with open(customize.__file__, "r") as fs:
+                    compile(fs.read(), customize.__file__, "exec")
+                importlib.reload(customize)
+                logger.info("Hot reload: customize.py reloaded")
+            except Exception as ex:
+                logger.warning(f"Hot reload: customize.py is invalid, keeping current functions: {ex}")
+
+        if new_config is not self.config:
+            self.__apply_config(new_config)
+
+    def __apply_config(self, config: appconfig.AppConfig) -> None:
+        old = self.config
+        self.config = config
+        self.limitcalc.apply_config(config)
+        self.__setup_estimator()
+
+        if old.history.to_json() != config.history.to_json():
+            self.__setup_history()
+
+        if old.recording.to_json() != config.recording.to_json():
+            self.__setup_recorder()
+
+        self.__setup_ring()
+        self.__setup_ingest()
+        self.__setup_policy()
+        self.__setup_aggregator()
+        self.__setup_kpi()
+        if old.redundancy.to_json() != config.redundancy.to_json():
+            logger.warning("Config: Changes to 'redundancy' require a restart")
+
+        if old.reading.staleTimeout != config.reading.staleTimeout:
+            self.__schedule_stale_check()
+
+        if config.kpi.enabled and not old.kpi.enabled:
+            self.__schedule_kpi()
+
+        if config.reading.keepSubscribed and not old.reading.keepSubscribed:
+            self.helper.subscribe_power_reading()
+        elif old.reading.keepSubscribed and not config.reading.keepSubscribed and not self.__readings_open:
+            self.helper.unsubscribe_power_reading()
+
+        reconnect = self.helper.apply_config(config)
+
+        if reconnect:
+            # Discovery, status and subscriptions are published again on connect
+            self.__published_discovery = False
+            self.__resumable = False
+            logger.info("Hot reload: Config applied, mqtt settings changed")
+            self.helper.reconnect()
+            return
+
+        logger.info("Hot reload: Config applied")
+
+        if old.meta.to_json() != config.meta.to_json() or old.command.type != config.command.type or old.kpi.enabled != config.kpi.enabled:
+            self.__published_discovery = False
+            self.__ha_discovery()
 
     def __ha_discovery(self) -> None:
         if self.__published_discovery or not self.helper.has_discovery:
@@ -141,6 +772,38 @@ class ExportControlAgent:
         self.helper.publish_meta_ha_discovery()
         self.__published_discovery = True
 
+    def stop(self) -> None:
+        """Disconnects and lets run return, may be called from another thread"""
+        if self.__election is not None and self.__election.is_leader:
+            # The standby takes over at once instead of after redundancy.leaseTimeout
+            self.__election.release()
+            self.helper.publish_meta_status_release()
+        # A clean disconnect does not send the last will
+        self.helper.publish_meta_status_online(False)
+        self.helper.stop()
+
     def run(self) -> None:
-        self.helper.connect()
-        self.helper.loop_forever()
+        # kill -USR1 <pid> dumps the recent decisions (not available on windows)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.__dump("signal"))
+        # docker stop: releases the lease and reports offline before the process ends
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+
+        try:
+            try:
+                self.helper.connect()
+            except OSError as ex:
+                # Broker not reachable at startup: loop_forever goes on with mqtt.failover and the reconnect delay
+                logger.warning(f"Connect failed: {ex}")
+            self.helper.loop_forever()
+        finally:
+            # Buffered history rows and records are written on exit
+            if self.__history is not None:
+                self.__history.close()
+            if self.__recorder is not None:
+                self.__recorder.close()
+            if self.__watcher is not None:
+                self.__watcher.close()
+            if profiling.profiler is not None:
+                profiling.profiler.poll_cprofile(force=True)
+                profiling.profiler.log_report()
@@ -0,0 +1,77 @@
+import logging
+from typing import List
+
+logger = logging.getLogger("sec.control")
+
+
+class AggregatorStats:
+    __slots__ = ("emitted", "waiting", "misaligned", "stale")
+
+    def __init__(self) -> None:
+        self.emitted: int = 0
+        self.waiting: int = 0
+        self.misaligned: int = 0
+        self.stale: int = 0
+
+    def __str__(self) -> str:
+        return f"Emitted: {self.emitted}, Waiting: {self.waiting}, Misaligned: {self.misaligned}, Stale: {self.stale}"
+
+
+class ReadingAggregator:
+    """Combines the readings of several meters into one sum. A sum is emitted once every source sent a new reading
+    and the timestamps of these readings are within tolerance. With max_stale > 0 each reading of source 0 emits a
+    sum as well, using the last known readings of the other sources unless they are older than max_stale"""
+
+    def __init__(self, sources: int, tolerance: float, max_stale: float = 0) -> None:
+        self.tolerance: float = tolerance
+        self.max_stale: float = max_stale
+        self.stats: AggregatorStats = AggregatorStats()
+        self.__values: List[float | None] = [None] * sources
+        self.__times: List[float] = [0.0] * sources
+        self.__fresh: List[bool] = [False] * sources
+
+    @property
+    def sources(self) -> int:
+        return len(self.__values)
+
+    def add(self, source: int, value: float, timestamp: float) -> float | None:
+        """value: signed reading of the source, timestamp: source timestamp or time of arrival (unix).
+        Returns the sum of all sources or None if the readings are not complete"""
+        values = self.__values
+        times = self.__times
+        fresh = self.__fresh
+        stats = self.stats
+
+        values[source] = value
+        times[source] = timestamp
+        fresh[source] = True
+
+        if all(fresh):
+            if max(times) - min(times) <= self.tolerance:
+                return self.__emit()
+            if self.max_stale <= 0:
+                stats.misaligned += 1
+                return None
+
+        if source != 0 or self.max_stale <= 0:
+            stats.waiting += 1
+            return None
+
+        for i in range(1, len(values)):
+            if values[i] is None or timestamp - times[i] > self.max_stale:
+                stats.stale += 1
+                logger.debug(f"Aggregate: Reading of source {i} is missing or older than {self.max_stale}s")
+                return None
+
+        return self.__emit()
+
+    def __emit(self) -> float:
+        fresh = self.__fresh
+        for i in range(len(fresh)):
+            fresh[i] = False
+
+        self.stats.emitted += 1
+        return sum(self.__values)
+
+    def log_stats(self) -> None:
+        logger.info(f"Aggregate -> {self.stats}")
@@ -1,5 +1,6 @@
 from __future__ import annotations
 from enum import IntEnum
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import paho.mqtt.client as mqtt
 import json
 
@@ -15,12 +16,21 @@ class PowerReadingSmoothingType(IntEnum):
 
 
 class AppConfig:
-    def __init__(self, mqtt: MqttConfig, cmd: CommandConfig, reading: ReadingConfig, meta: MetaControlConfig, customize: CustomizeConfig) -> None:
+    def __init__(self, mqtt: MqttConfig, cmd: CommandConfig, reading: ReadingConfig, meta: MetaControlConfig, customize: CustomizeConfig,
+                 history: HistoryConfig | None = None, recording: RecordingConfig | None = None,
+                 diagnostics: DiagnosticsConfig | None = None, redundancy: RedundancyConfig | None = None,
+                 ingest: IngestConfig | None = None, kpi: KpiConfig | None = None) -> None:
         self.mqtt = mqtt
         self.command = cmd
         self.reading = reading
         self.meta = meta
         self.customize = customize
+        self.history = history if history is not None else HistoryConfig(False)
+        self.recording = recording if recording is not None else RecordingConfig(False)
+        self.diagnostics = diagnostics if diagnostics is not None else DiagnosticsConfig()
+        self.redundancy = redundancy if redundancy is not None else RedundancyConfig(False)
+        self.ingest = ingest if ingest is not None else IngestConfig(False)
+        self.kpi = kpi if kpi is not None else KpiConfig(False)
 
     def to_json(self) -> dict:
         return {
@@ -28,14 +38,23 @@ class AppConfig:
             "command": self.command.to_json(),
             "reading": self.reading.to_json(),
             "meta": self.meta.to_json(),
-            "customize": self.customize.to_json()
+            "customize": self.customize.to_json(),
+            "history": self.history.to_json(),
+            "recording": self.recording.to_json(),
+            "diagnostics": self.diagnostics.to_json(),
+            "redundancy": self.redundancy.to_json(),
+            "ingest": self.ingest.to_json(),
+            "kpi": self.kpi.to_json()
         }
 
     @staticmethod
     def from_json_file(path: str) -> AppConfig:
         fs = open(path, "r")
         jf = json.load(fs)
+        return AppConfig.from_json(jf)
 
+    @staticmethod
+    def from_json(jf: dict) -> AppConfig:
         j_mqtt = jf.get("mqtt")
         if type(j_mqtt) is not dict:
             raise ValueError("Missing config segment: mqtt")
@@ -66,7 +85,38 @@ class AppConfig:
 
         o_cust = CustomizeConfig.from_json(j_cust)
 
-        return AppConfig(o_mqtt, o_cmd, o_reading, o_meta,  o_cust)
+        # Optional segment
+        o_history: HistoryConfig | None = None
+        j_history = jf.get("history")
+        if type(j_history) is dict:
+            o_history = HistoryConfig.from_json(j_history)
+
+        o_recording: RecordingConfig | None = None
+        j_recording = jf.get("recording")
+        if type(j_recording) is dict:
+            o_recording = RecordingConfig.from_json(j_recording)
+
+        o_diagnostics: DiagnosticsConfig | None = None
+        j_diagnostics = jf.get("diagnostics")
+        if type(j_diagnostics) is dict:
+            o_diagnostics = DiagnosticsConfig.from_json(j_diagnostics)
+
+        o_redundancy: RedundancyConfig | None = None
+        j_redundancy = jf.get("redundancy")
+        if type(j_redundancy) is dict:
+            o_redundancy = RedundancyConfig.from_json(j_redundancy)
+
+        o_ingest: IngestConfig | None = None
+        j_ingest = jf.get("ingest")
+        if type(j_ingest) is dict:
+            o_ingest = IngestConfig.from_json(j_ingest)
+
+        o_kpi: KpiConfig | None = None
+        j_kpi = jf.get("kpi")
+        if type(j_kpi) is dict:
+            o_kpi = KpiConfig.from_json(j_kpi)
+
+        return AppConfig(o_mqtt, o_cmd, o_reading, o_meta,  o_cust, o_history, o_recording, o_diagnostics, o_redundancy, o_ingest, o_kpi)
 
 
 class MqttConfig:
@@ -75,7 +125,10 @@ class MqttConfig:
                  keepalive: int | None = None,
                  protocol: int | None = None,
                  client_id: str | None = None,
-                 auth: MqttAuthConfig | None = None) -> None:
+                 auth: MqttAuthConfig | None = None,
+                 session_expiry: int = 0,
+                 failover: list[MqttBrokerConfig] | None = None,
+                 failback_interval: int = 30) -> None:
         self.host: str = host
         self.port: int = port if port is not None else 1883
         self.keepalive: int = keepalive if keepalive is not None else 60
@@ -83,6 +136,9 @@ class MqttConfig:
         self.client_id: str = client_id if client_id is not None else "solar-export-control"
         self.topics: MqttTopicConfig = topics
         self.auth: MqttAuthConfig | None = auth
+        self.session_expiry: int = session_expiry
+        self.failover: list[MqttBrokerConfig] = failover if failover is not None else []
+        self.failback_interval: int = failback_interval
 
     def to_json(self) -> dict:
 
@@ -93,7 +149,10 @@ class MqttConfig:
             "protocol": self.protocol,
             "clientId": self.client_id,
             "topics": self.topics.to_json(),
-            "auth": self.auth.to_json() if self.auth is not None else None
+            "auth": self.auth.to_json() if self.auth is not None else None,
+            "sessionExpiry": int(self.session_expiry),
+            "failover": [b.to_json() for b in self.failover],
+            "failbackInterval": int(self.failback_interval)
         }
 
     @staticmethod
@@ -135,28 +194,73 @@ class MqttConfig:
         if type(j_auth) is dict and j_auth.get("username"):
             o_auth = MqttAuthConfig.from_json(j_auth)
 
+        j_session_expiry = json.get("sessionExpiry")
+        if j_session_expiry is None:
+            j_session_expiry = 0
+        elif type(j_session_expiry) is not int or j_session_expiry < 0:
+            raise ValueError(f"MqttConfig: Invalid sessionExpiry: '{j_session_expiry}'")
+
+        if j_session_expiry > 0 and j_protocol != mqtt.MQTTv5:
+            raise ValueError(f"MqttConfig: sessionExpiry requires protocol {mqtt.MQTTv5} (MQTTv5)")
+
+        j_failover = json.get("failover")
+        if j_failover is None:
+            j_failover = []
+        elif type(j_failover) is not list or any(type(b) is not dict for b in j_failover):
+            raise ValueError(f"MqttConfig: Invalid failover: '{j_failover}'")
+
+        o_failover = [MqttBrokerConfig.from_json(b) for b in j_failover]
+
+        j_failback_interval = json.get("failbackInterval")
+        if j_failback_interval is None:
+            j_failback_interval = 30
+        elif type(j_failback_interval) is not int or j_failback_interval < 1:
+            raise ValueError(f"MqttConfig: Invalid failbackInterval: '{j_failback_interval}'")
+
         return MqttConfig(host=j_host,
                           topics=o_topics,
                           port=j_port,
                           keepalive=j_keepalive,
                           protocol=j_protocol,
                           client_id=j_client_id,
-                          auth=o_auth)
+                          auth=o_auth,
+                          session_expiry=j_session_expiry,
+                          failover=o_failover,
+                          failback_interval=j_failback_interval)
 
 
 class MqttTopicConfig:
-    def __init__(self, read_power: str, write_command: str | None, inverter_status: str | None, inverter_power: str | None) -> None:
+    def __init__(self, read_power: str, write_command: str | None, inverter_status: str | None, inverter_power: str | None, inverter_limit: str | None = None,
+                 read_power_sources: list[MqttPowerSourceConfig] | None = None, read_power_parser: str = "parse_power_payload", read_power_sign: int = 1) -> None:
         self.read_power: str = read_power
+        self.read_power_parser: str = read_power_parser
+        self.read_power_sign: int = read_power_sign
         self.write_command: str | None = write_command
         self.inverter_status: str | None = inverter_status
         self.inverter_power: str | None = inverter_power
+        self.inverter_limit: str | None = inverter_limit
+        self.read_power_sources: list[MqttPowerSourceConfig] = read_power_sources if read_power_sources is not None else []
+
+    @property
+    def power_sources(self) -> list[MqttPowerSourceConfig]:
+        """readPower first, then the further meters"""
+        return [MqttPowerSourceConfig(self.read_power, self.read_power_parser, self.read_power_sign)] + self.read_power_sources
+
+    @property
+    def read_power_topics(self) -> list[str]:
+        """readPower first, then the further meters"""
+        return [self.read_power] + [source.topic for source in self.read_power_sources]
 
     def to_json(self) -> dict:
         return {
             "readPower": str(self.read_power),
+            "readPowerParser": str(self.read_power_parser),
+            "readPowerSign": int(self.read_power_sign),
+            "readPowerSources": [source.to_json() for source in self.read_power_sources],
             "writeCommand": self.write_command,
-            "inverterStatus": self.inverter_status
-           # "inverterPower": self.inverter_power
+            "inverterStatus": self.inverter_status,
+            "inverterPower": self.inverter_power,
+            "inverterLimit": self.inverter_limit
         }
 
     @staticmethod
@@ -165,6 +269,18 @@ class MqttTopicConfig:
         if type(j_read_power) is not str or not j_read_power:
             raise ValueError(f"MqttTopicConfig: Invalid readPower: '{j_read_power}'")
 
+        j_read_power_parser = json.get("readPowerParser")
+        if j_read_power_parser is None:
+            j_read_power_parser = "parse_power_payload"
+        elif type(j_read_power_parser) is not str or not j_read_power_parser.isidentifier():
+            raise ValueError(f"MqttTopicConfig: Invalid readPowerParser: '{j_read_power_parser}'")
+
+        j_read_power_sign = json.get("readPowerSign")
+        if j_read_power_sign is None:
+            j_read_power_sign = 1
+        elif type(j_read_power_sign) is not int or j_read_power_sign not in (1, -1):
+            raise ValueError(f"MqttTopicConfig: Invalid readPowerSign: '{j_read_power_sign}'")
+
         j_write_command = json.get("writeCommand")
         if type(j_write_command) is not str or not j_write_command:
             j_write_command = None
@@ -177,7 +293,60 @@ class MqttTopicConfig:
         if type(j_inv_power) is not str or not j_inv_power:
             j_inv_power = None
 
-        return MqttTopicConfig(read_power=j_read_power, write_command=j_write_command, inverter_status=j_inv_status, inverter_power=j_inv_power)
+        j_inv_limit = json.get("inverterLimit")
+        if type(j_inv_limit) is not str or not j_inv_limit:
+            j_inv_limit = None
+
+        j_sources = json.get("readPowerSources")
+        o_sources: list[MqttPowerSourceConfig] = []
+        if j_sources is not None:
+            if type(j_sources) is not list:
+                raise ValueError(f"MqttTopicConfig: Invalid readPowerSources: '{j_sources}'")
+            for j_source in j_sources:
+                if type(j_source) is not dict:
+                    raise ValueError(f"MqttTopicConfig: Invalid readPowerSources entry: '{j_source}'")
+                o_sources.append(MqttPowerSourceConfig.from_json(j_source))
+
+        topics = [j_read_power] + [source.topic for source in o_sources]
+        if len(set(topics)) != len(topics):
+            raise ValueError("MqttTopicConfig: Invalid readPowerSources: Topics must differ from each other and from readPower")
+
+        return MqttTopicConfig(read_power=j_read_power, write_command=j_write_command, inverter_status=j_inv_status, inverter_power=j_inv_power, inverter_limit=j_inv_limit,
+                               read_power_sources=o_sources, read_power_parser=j_read_power_parser, read_power_sign=j_read_power_sign)
+
+
+class MqttPowerSourceConfig:
+    def __init__(self, topic: str, parser: str = "parse_power_payload", sign: int = 1) -> None:
+        self.topic: str = topic
+        self.parser: str = parser
+        self.sign: int = sign
+
+    def to_json(self) -> dict:
+        return {
+            "topic": str(self.topic),
+            "parser": str(self.parser),
+            "sign": int(self.sign)
+        }
+
+    @staticmethod
+    def from_json(json: dict) -> MqttPowerSourceConfig:
+        j_topic = json.get("topic")
+        if type(j_topic) is not str or not j_topic:
+            raise ValueError(f"MqttPowerSourceConfig: Invalid topic: '{j_topic}'")
+
+        j_parser = json.get("parser")
+        if j_parser is None:
+            j_parser = "parse_power_payload"
+        elif type(j_parser) is not str or not j_parser.isidentifier():
+            raise ValueError(f"MqttPowerSourceConfig: Invalid parser: '{j_parser}'")
+
+        j_sign = json.get("sign")
+        if j_sign is None:
+            j_sign = 1
+        elif type(j_sign) is not int or j_sign not in (1, -1):
+            raise ValueError(f"MqttPowerSourceConfig: Invalid sign: '{j_sign}'")
+
+        return MqttPowerSourceConfig(j_topic, j_parser, j_sign)
 
 
 class MqttAuthConfig:
@@ -204,8 +373,38 @@ class MqttAuthConfig:
         return MqttAuthConfig(j_username, j_password)
 
 
+class MqttBrokerConfig:
+    def __init__(self, host: str, port: int = 1883) -> None:
+        self.host: str = host
+        self.port: int = port
+
+    def to_json(self) -> dict:
+        return {
+            "host": str(self.host),
+            "port": int(self.port)
+        }
+
+    @staticmethod
+    def from_json(json: dict) -> MqttBrokerConfig:
+        j_host = json.get("host")
+        if type(j_host) is not str or not j_host:
+            raise ValueError(f"MqttBrokerConfig: Invalid host: '{j_host}'")
+
+        j_port = json.get("port")
+        if j_port is None:
+            j_port = 1883
+        elif type(j_port) is not int or j_port < 1 or j_port > 65535:
+            raise ValueError(f"MqttBrokerConfig: Invalid port: '{j_port}'")
+
+        return MqttBrokerConfig(j_host, j_port)
+
+
 class CommandConfig:
-    def __init__(self, target: int, min_power: float, max_power: float, type: InverterCommandType, throttle: int, hysteresis: float, retransmit: int, default_limit: float) -> None:
+    def __init__(self, target: int, min_power: float, max_power: float, type: InverterCommandType, throttle: int, hysteresis: float, retransmit: int, default_limit: float,
+                 qos: int = 0, confirm_timeout: int = 0, confirm_retries: int = 3, confirm_tolerance: float = 1.0,
+                 burst: int = 1, urgent_threshold: float = 0.0,
+                 decrease: CommandDirectionConfig | None = None, increase: CommandDirectionConfig | None = None,
+                 adaptive_throttle: AdaptiveThrottleConfig | None = None, message_expiry: int = 0) -> None:
         self.target: int = target
         self.min_power: float = min_power
         self.max_power: float = max_power
@@ -214,6 +413,16 @@ class CommandConfig:
         self.hysteresis: float = hysteresis
         self.retransmit: int = retransmit
         self.default_limit: float = default_limit
+        self.qos: int = qos
+        self.confirm_timeout: int = confirm_timeout
+        self.confirm_retries: int = confirm_retries
+        self.confirm_tolerance: float = confirm_tolerance
+        self.message_expiry: int = message_expiry
+        self.burst: int = burst
+        self.urgent_threshold: float = urgent_threshold
+        self.decrease: CommandDirectionConfig = decrease if decrease is not None else CommandDirectionConfig(throttle, burst, hysteresis)
+        self.increase: CommandDirectionConfig = increase if increase is not None else CommandDirectionConfig(throttle, burst, hysteresis)
+        self.adaptive_throttle: AdaptiveThrottleConfig = adaptive_throttle if adaptive_throttle is not None else AdaptiveThrottleConfig(False)
       
     def to_json(self) -> dict:
         match self.type:
@@ -232,7 +441,17 @@ class CommandConfig:
             "throttle": int(self.throttle),
             "hysteresis": float(self.hysteresis),
             "retransmit": int(self.retransmit),
-            "defaultLimit": float(self.default_limit)
+            "defaultLimit": float(self.default_limit),
+            "qos": int(self.qos),
+            "confirmTimeout": int(self.confirm_timeout),
+            "confirmRetries": int(self.confirm_retries),
+            "confirmTolerance": float(self.confirm_tolerance),
+            "messageExpiry": int(self.message_expiry),
+            "burst": int(self.burst),
+            "urgentThreshold": float(self.urgent_threshold),
+            "decrease": self.decrease.to_json(),
+            "increase": self.increase.to_json(),
+            "adaptiveThrottle": self.adaptive_throttle.to_json()
         }
 
     @staticmethod
@@ -287,6 +506,62 @@ class CommandConfig:
         elif type(j_default_limit) is not float:
             j_default_limit = j_max_power
 
+        j_qos = json.get("qos")
+        if j_qos is None:
+            j_qos = 0
+        elif type(j_qos) is not int or j_qos < 0 or j_qos > 2:
+            raise ValueError(f"CommandConfig: Invalid qos: '{j_qos}'")
+
+        j_confirm_timeout = json.get("confirmTimeout")
+        if j_confirm_timeout is None:
+            j_confirm_timeout = 0
+        elif type(j_confirm_timeout) is not int or j_confirm_timeout < 0:
+            raise ValueError(f"CommandConfig: Invalid confirmTimeout: '{j_confirm_timeout}'")
+
+        j_confirm_retries = json.get("confirmRetries")
+        if j_confirm_retries is None:
+            j_confirm_retries = 3
+        elif type(j_confirm_retries) is not int or j_confirm_retries < 0:
+            raise ValueError(f"CommandConfig: Invalid confirmRetries: '{j_confirm_retries}'")
+
+        j_confirm_tolerance = json.get("confirmTolerance")
+        if j_confirm_tolerance is None:
+            j_confirm_tolerance = 1.0
+        elif type(j_confirm_tolerance) is int:
+            j_confirm_tolerance = float(j_confirm_tolerance)
+
+        if type(j_confirm_tolerance) is not float or j_confirm_tolerance < 0:
+            raise ValueError(f"CommandConfig: Invalid confirmTolerance: '{j_confirm_tolerance}'")
+
+        j_message_expiry = json.get("messageExpiry")
+        if j_message_expiry is None:
+            j_message_expiry = 0
+        elif type(j_message_expiry) is not int or j_message_expiry < 0:
+            raise ValueError(f"CommandConfig: Invalid messageExpiry: '{j_message_expiry}'")
+
+        j_burst = json.get("burst")
+        if j_burst is None:
+            j_burst = 1
+        elif type(j_burst) is not int or j_burst < 1:
+            raise ValueError(f"CommandConfig: Invalid burst: '{j_burst}'")
+
+        j_urgent_threshold = json.get("urgentThreshold")
+        if j_urgent_threshold is None:
+            j_urgent_threshold = 0.0
+        elif type(j_urgent_threshold) is int:
+            j_urgent_threshold = float(j_urgent_threshold)
+
+        if type(j_urgent_threshold) is not float or j_urgent_threshold < 0:
+            raise ValueError(f"CommandConfig: Invalid urgentThreshold: '{j_urgent_threshold}'")
+
+        o_decrease = CommandDirectionConfig.from_json(json.get("decrease"), "decrease", j_throttle, j_burst, j_hysteresis)
+        o_increase = CommandDirectionConfig.from_json(json.get("increase"), "increase", j_throttle, j_burst, j_hysteresis)
+
+        o_adaptive_throttle: AdaptiveThrottleConfig | None = None
+        j_adaptive_throttle = json.get("adaptiveThrottle")
+        if type(j_adaptive_throttle) is dict:
+            o_adaptive_throttle = AdaptiveThrottleConfig.from_json(j_adaptive_throttle)
+
         return CommandConfig(
             target=j_target,
             min_power=j_min_power,
@@ -295,15 +570,129 @@ class CommandConfig:
             throttle=j_throttle,
             hysteresis=j_hysteresis,
             retransmit=j_retransmit,
-            default_limit=j_default_limit
+            default_limit=j_default_limit,
+            qos=j_qos,
+            confirm_timeout=j_confirm_timeout,
+            confirm_retries=j_confirm_retries,
+            confirm_tolerance=j_confirm_tolerance,
+            burst=j_burst,
+            urgent_threshold=j_urgent_threshold,
+            decrease=o_decrease,
+            increase=o_increase,
+            adaptive_throttle=o_adaptive_throttle,
+            message_expiry=j_message_expiry
         )
 
 
+class CommandDirectionConfig:
+    def __init__(self, throttle: int, burst: int, hysteresis: float) -> None:
+        self.throttle: int = throttle
+        self.burst: int = burst
+        self.hysteresis: float = hysteresis
+
+    def to_json(self) -> dict:
+        return {
+            "throttle": int(self.throttle),
+            "burst": int(self.burst),
+            "hysteresis": float(self.hysteresis)
+        }
+
+    @staticmethod
+    def from_json(json: dict | None, name: str, throttle: int, burst: int, hysteresis: float) -> CommandDirectionConfig:
+        # Every property falls back to the value of the command segment
+        if json is None:
+            return CommandDirectionConfig(throttle, burst, hysteresis)
+
+        if type(json) is not dict:
+            raise ValueError(f"CommandConfig: Invalid {name}: '{json}'")
+
+        j_throttle = json.get("throttle")
+        if j_throttle is None:
+            j_throttle = throttle
+        elif type(j_throttle) is not int or j_throttle < 0:
+            raise ValueError(f"CommandConfig: Invalid {name}.throttle: '{j_throttle}'")
+
+        j_burst = json.get("burst")
+        if j_burst is None:
+            j_burst = burst
+        elif type(j_burst) is not int or j_burst < 1:
+            raise ValueError(f"CommandConfig: Invalid {name}.burst: '{j_burst}'")
+
+        j_hysteresis = json.get("hysteresis")
+        if j_hysteresis is None:
+            j_hysteresis = hysteresis
+        elif type(j_hysteresis) is int:
+            j_hysteresis = float(j_hysteresis)
+
+        if type(j_hysteresis) is not float or j_hysteresis < 0:
+            raise ValueError(f"CommandConfig: Invalid {name}.hysteresis: '{j_hysteresis}'")
+
+        return CommandDirectionConfig(j_throttle, j_burst, j_hysteresis)
+
+
+class AdaptiveThrottleConfig:
+    def __init__(self, enabled: bool, min: int = 2, max: int = 30, settle_band: float = 20.0) -> None:
+        self.enabled: bool = enabled
+        self.min: int = min
+        self.max: int = max
+        self.settle_band: float = settle_band
+
+    def to_json(self) -> dict:
+        return {
+            "enabled": bool(self.enabled),
+            "min": int(self.min),
+            "max": int(self.max),
+            "settleBand": float(self.settle_band)
+        }
+
+    @staticmethod
+    def from_json(json: dict) -> AdaptiveThrottleConfig:
+        j_enabled = json.get("enabled")
+        if type(j_enabled) is not bool:
+            raise ValueError(f"AdaptiveThrottleConfig: Invalid enabled: '{j_enabled}'")
+
+        j_min = json.get("min")
+        if j_min is None:
+            j_min = 2
+        elif type(j_min) is not int or j_min < 1:
+            raise ValueError(f"AdaptiveThrottleConfig: Invalid min: '{j_min}'")
+
+        j_max = json.get("max")
+        if j_max is None:
+            j_max = 30
+        elif type(j_max) is not int or j_max < j_min:
+            raise ValueError(f"AdaptiveThrottleConfig: Invalid max: '{j_max}'")
+
+        j_settle_band = json.get("settleBand")
+        if j_settle_band is None:
+            j_settle_band = 20.0
+        elif type(j_settle_band) is int:
+            j_settle_band = float(j_settle_band)
+
+        if type(j_settle_band) is not float or j_settle_band <= 0:
+            raise ValueError(f"AdaptiveThrottleConfig: Invalid settleBand: '{j_settle_band}'")
+
+        return AdaptiveThrottleConfig(j_enabled, j_min, j_max, j_settle_band)
+
+
 class ReadingConfig:
-    def __init__(self, smoothing: PowerReadingSmoothingType, smoothingSampleSize: int, offset: float) -> None:
+    def __init__(self, smoothing: PowerReadingSmoothingType, smoothingSampleSize: int, offset: float,
+                 smoothingSampleSizeDecrease: int | None = None, smoothingSampleSizeIncrease: int | None = None,
+                 predictionHorizon: float = 0.0, predictionSampleSize: int = 8, staleTimeout: int = 0,
+                 keepSubscribed: bool = False, aggregateTolerance: float = 1.0, aggregateMaxStale: int = 0,
+                 timezone: str | None = None) -> None:
         self.smoothing = smoothing
         self.smoothingSampleSize = smoothingSampleSize
         self.offset = offset
+        self.smoothingSampleSizeDecrease = smoothingSampleSizeDecrease if smoothingSampleSizeDecrease is not None else smoothingSampleSize
+        self.smoothingSampleSizeIncrease = smoothingSampleSizeIncrease if smoothingSampleSizeIncrease is not None else smoothingSampleSize
+        self.predictionHorizon = predictionHorizon
+        self.predictionSampleSize = predictionSampleSize
+        self.staleTimeout = staleTimeout
+        self.keepSubscribed = keepSubscribed
+        self.aggregateTolerance = aggregateTolerance
+        self.aggregateMaxStale = aggregateMaxStale
+        self.timezone = timezone
 
     def to_json(self) -> dict:
         sm = "avg" if self.smoothing == PowerReadingSmoothingType.AVG else None
@@ -311,7 +700,16 @@ class ReadingConfig:
         return {
             "offset": int(self.offset),
             "smoothing": sm,
-            "smoothingSampleSize": int(self.smoothingSampleSize)
+            "smoothingSampleSize": int(self.smoothingSampleSize),
+            "smoothingSampleSizeDecrease": int(self.smoothingSampleSizeDecrease),
+            "smoothingSampleSizeIncrease": int(self.smoothingSampleSizeIncrease),
+            "predictionHorizon": float(self.predictionHorizon),
+            "predictionSampleSize": int(self.predictionSampleSize),
+            "staleTimeout": int(self.staleTimeout),
+            "keepSubscribed": bool(self.keepSubscribed),
+            "aggregateTolerance": float(self.aggregateTolerance),
+            "aggregateMaxStale": int(self.aggregateMaxStale),
+            "timezone": self.timezone
         }
 
     @staticmethod
@@ -333,7 +731,373 @@ class ReadingConfig:
         if type(j_offset) is not float:
             j_offset = float(0)
 
-        return ReadingConfig(smoothing=e_smoothing, smoothingSampleSize=j_smoothing_sample_size, offset=j_offset)
+        j_sample_size_decrease = json.get("smoothingSampleSizeDecrease")
+        if type(j_sample_size_decrease) is not int or j_sample_size_decrease < 0:
+            j_sample_size_decrease = None
+
+        j_sample_size_increase = json.get("smoothingSampleSizeIncrease")
+        if type(j_sample_size_increase) is not int or j_sample_size_increase < 0:
+            j_sample_size_increase = None
+
+        j_prediction_horizon = json.get("predictionHorizon")
+        if type(j_prediction_horizon) is int:
+            j_prediction_horizon = float(j_prediction_horizon)
+
+        if type(j_prediction_horizon) is not float or j_prediction_horizon < 0:
+            j_prediction_horizon = float(0)
+
+        j_prediction_sample_size = json.get("predictionSampleSize")
+        if type(j_prediction_sample_size) is not int or j_prediction_sample_size < 2:
+            j_prediction_sample_size = 8
+
+        j_stale_timeout = json.get("staleTimeout")
+        if j_stale_timeout is None:
+            j_stale_timeout = 0
+        elif type(j_stale_timeout) is not int or j_stale_timeout < 0:
+            raise ValueError(f"ReadingConfig: Invalid staleTimeout: '{j_stale_timeout}'")
+
+        j_keep_subscribed = json.get("keepSubscribed")
+        if j_keep_subscribed is None:
+            j_keep_subscribed = False
+        elif type(j_keep_subscribed) is not bool:
+            raise ValueError(f"ReadingConfig: Invalid keepSubscribed: '{j_keep_subscribed}'")
+
+        j_aggregate_tolerance = json.get("aggregateTolerance")
+        if j_aggregate_tolerance is None:
+            j_aggregate_tolerance = 1.0
+        elif type(j_aggregate_tolerance) not in (int, float) or j_aggregate_tolerance < 0:
+            raise ValueError(f"ReadingConfig: Invalid aggregateTolerance: '{j_aggregate_tolerance}'")
+
+        j_aggregate_max_stale = json.get("aggregateMaxStale")
+        if j_aggregate_max_stale is None:
+            j_aggregate_max_stale = 0
+        elif type(j_aggregate_max_stale) is not int or j_aggregate_max_stale < 0:
+            raise ValueError(f"ReadingConfig: Invalid aggregateMaxStale: '{j_aggregate_max_stale}'")
+
+        j_timezone = json.get("timezone")
+        if j_timezone is not None:
+            try:
+                ZoneInfo(j_timezone)
+            except (TypeError, ValueError, ZoneInfoNotFoundError):
+                raise ValueError(f"ReadingConfig: Invalid timezone: '{j_timezone}'")
+
+        return ReadingConfig(smoothing=e_smoothing, smoothingSampleSize=j_smoothing_sample_size, offset=j_offset,
+                             smoothingSampleSizeDecrease=j_sample_size_decrease, smoothingSampleSizeIncrease=j_sample_size_increase,
+                             predictionHorizon=j_prediction_horizon, predictionSampleSize=j_prediction_sample_size,
+                             staleTimeout=j_stale_timeout, keepSubscribed=j_keep_subscribed,
+                             aggregateTolerance=float(j_aggregate_tolerance), aggregateMaxStale=j_aggregate_max_stale,
+                             timezone=j_timezone)
+
+
+class HistoryConfig:
+    def __init__(self, enabled: bool, path: str = "history.db", flush_interval: int = 60, max_buffer: int = 10000,
+                 raw_retention: int = 48, downsample_interval: int = 300, retention: int = 365) -> None:
+        self.enabled: bool = enabled
+        self.path: str = path
+        self.flush_interval: int = flush_interval
+        self.max_buffer: int = max_buffer
+        self.raw_retention: int = raw_retention
+        self.downsample_interval: int = downsample_interval
+        self.retention: int = retention
+
+    def to_json(self) -> dict:
+        return {
+            "enabled": bool(self.enabled),
+            "path": str(self.path),
+            "flushInterval": int(self.flush_interval),
+            "maxBuffer": int(self.max_buffer),
+            "rawRetention": int(self.raw_retention),
+            "downsampleInterval": int(self.downsample_interval),
+            "retention": int(self.retention)
+        }
+
+    @staticmethod
+    def from_json(json: dict) -> HistoryConfig:
+        j_enabled = json.get("enabled")
+        if type(j_enabled) is not bool:
+            raise ValueError(f"HistoryConfig: Invalid enabled: '{j_enabled}'")
+
+        j_path = json.get("path")
+        if j_path is None:
+            j_path = "history.db"
+        elif type(j_path) is not str or not j_path:
+            raise ValueError(f"HistoryConfig: Invalid path: '{j_path}'")
+
+        j_flush_interval = json.get("flushInterval")
+        if j_flush_interval is None:
+            j_flush_interval = 60
+        elif type(j_flush_interval) is not int or j_flush_interval < 1:
+            raise ValueError(f"HistoryConfig: Invalid flushInterval: '{j_flush_interval}'")
+
+        j_max_buffer = json.get("maxBuffer")
+        if j_max_buffer is None:
+            j_max_buffer = 10000
+        elif type(j_max_buffer) is not int or j_max_buffer < 1:
+            raise ValueError(f"HistoryConfig: Invalid maxBuffer: '{j_max_buffer}'")
+
+        j_raw_retention = json.get("rawRetention")
+        if j_raw_retention is None:
+            j_raw_retention = 48
+        elif type(j_raw_retention) is not int or j_raw_retention < 1:
+            raise ValueError(f"HistoryConfig: Invalid rawRetention: '{j_raw_retention}'")
+
+        j_downsample_interval = json.get("downsampleInterval")
+        if j_downsample_interval is None:
+            j_downsample_interval = 300
+        elif type(j_downsample_interval) is not int or j_downsample_interval < 1:
+            raise ValueError(f"HistoryConfig: Invalid downsampleInterval: '{j_downsample_interval}'")
+
+        j_retention = json.get("retention")
+        if j_retention is None:
+            j_retention = 365
+        elif type(j_retention) is not int or j_retention < 0:
+            raise ValueError(f"HistoryConfig: Invalid retention: '{j_retention}'")
+
+        return HistoryConfig(j_enabled, j_path, j_flush_interval, j_max_buffer, j_raw_retention, j_downsample_interval, j_retention)
+
+
+class RecordingConfig:
+    def __init__(self, enabled: bool, path: str = "recordings", chunk_records: int = 1048576, flush_records: int = 60) -> None:
+        self.enabled: bool = enabled
+        self.path: str = path
+        self.chunk_records: int = chunk_records
+        self.flush_records: int = flush_records
+
+    def to_json(self) -> dict:
+        return {
+            "enabled": bool(self.enabled),
+            "path": str(self.path),
+            "chunkRecords": int(self.chunk_records),
+            "flushRecords": int(self.flush_records)
+        }
+
+    @staticmethod
+    def from_json(json: dict) -> RecordingConfig:
+        j_enabled = json.get("enabled")
+        if type(j_enabled) is not bool:
+            raise ValueError(f"RecordingConfig: Invalid enabled: '{j_enabled}'")
+
+        j_path = json.get("path")
+        if j_path is None:
+            j_path = "recordings"
+        elif type(j_path) is not str or not j_path:
+            raise ValueError(f"RecordingConfig: Invalid path: '{j_path}'")
+
+        j_chunk_records = json.get("chunkRecords")
+        if j_chunk_records is None:
+            j_chunk_records = 1048576
+        elif type(j_chunk_records) is not int or j_chunk_records < 1:
+            raise ValueError(f"RecordingConfig: Invalid chunkRecords: '{j_chunk_records}'")
+
+        j_flush_records = json.get("flushRecords")
+        if j_flush_records is None:
+            j_flush_records = 60
+        elif type(j_flush_records) is not int or j_flush_records < 1:
+            raise ValueError(f"RecordingConfig: Invalid flushRecords: '{j_flush_records}'")
+
+        return RecordingConfig(j_enabled, j_path, j_chunk_records, j_flush_records)
+
+
+class DiagnosticsConfig:
+    # Without a diagnostics segment nothing is kept or dumped
+    def __init__(self, ring_size: int = 0, dump_path: str = "dumps") -> None:
+        self.ring_size: int = ring_size
+        self.dump_path: str = dump_path
+
+    def to_json(self) -> dict:
+        return {
+            "ringSize": int(self.ring_size),
+            "dumpPath": str(self.dump_path)
+        }
+
+    @staticmethod
+    def from_json(json: dict) -> DiagnosticsConfig:
+        j_ring_size = json.get("ringSize")
+        if j_ring_size is None:
+            j_ring_size = 2000
+        elif type(j_ring_size) is not int or j_ring_size < 0:
+            raise ValueError(f"DiagnosticsConfig: Invalid ringSize: '{j_ring_size}'")
+
+        j_dump_path = json.get("dumpPath")
+        if j_dump_path is None:
+            j_dump_path = "dumps"
+        elif type(j_dump_path) is not str or not j_dump_path:
+            raise ValueError(f"DiagnosticsConfig: Invalid dumpPath: '{j_dump_path}'")
+
+        return DiagnosticsConfig(j_ring_size, j_dump_path)
+
+
+class RedundancyConfig:
+    def __init__(self, enabled: bool, instance_id: str | None = None, lease_interval: int = 5, lease_timeout: int = 15) -> None:
+        self.enabled: bool = enabled
+        self.instance_id: str | None = instance_id
+        self.lease_interval: int = lease_interval
+        self.lease_timeout: int = lease_timeout
+
+    def to_json(self) -> dict:
+        return {
+            "enabled": bool(self.enabled),
+            "instanceId": self.instance_id,
+            "leaseInterval": int(self.lease_interval),
+            "leaseTimeout": int(self.lease_timeout)
+        }
+
+    @staticmethod
+    def from_json(json: dict) -> RedundancyConfig:
+        j_enabled = json.get("enabled")
+        if type(j_enabled) is not bool:
+            raise ValueError(f"RedundancyConfig: Invalid enabled: '{j_enabled}'")
+
+        j_instance_id = json.get("instanceId")
+        if j_instance_id is not None and (type(j_instance_id) is not str or not j_instance_id or j_instance_id.startswith("-")):
+            raise ValueError(f"RedundancyConfig: Invalid instanceId: '{j_instance_id}'")
+
+        j_lease_interval = json.get("leaseInterval")
+        if j_lease_interval is None:
+            j_lease_interval = 5
+        elif type(j_lease_interval) is not int or j_lease_interval < 1:
+            raise ValueError(f"RedundancyConfig: Invalid leaseInterval: '{j_lease_interval}'")
+
+        j_lease_timeout = json.get("leaseTimeout")
+        if j_lease_timeout is None:
+            j_lease_timeout = 3 * j_lease_interval
+        elif type(j_lease_timeout) is not int or j_lease_timeout <= j_lease_interval:
+            raise ValueError(f"RedundancyConfig: Invalid leaseTimeout: '{j_lease_timeout}', must be greater than leaseInterval")
+
+        return RedundancyConfig(j_enabled, j_instance_id, j_lease_interval, j_lease_timeout)
+
+
+class IngestConfig:
+    def __init__(self, enabled: bool, dedupe: str | None = "timestamp", hash_window: int = 16, max_age: int = 0,
+                 reject_out_of_order: bool = True, policy: str = "all", interval: float = 1.0, decimate: int = 1) -> None:
+        self.enabled: bool = enabled
+        self.dedupe: str | None = dedupe
+        self.hash_window: int = hash_window
+        self.max_age: int = max_age
+        self.reject_out_of_order: bool = reject_out_of_order
+        self.policy: str = policy
+        self.interval: float = interval
+        self.decimate: int = decimate
+
+    def to_json(self) -> dict:
+        return {
+            "enabled": bool(self.enabled),
+            "dedupe": self.dedupe,
+            "hashWindow": int(self.hash_window),
+            "maxAge": int(self.max_age),
+            "rejectOutOfOrder": bool(self.reject_out_of_order),
+            "policy": str(self.policy),
+            "interval": float(self.interval),
+            "decimate": int(self.decimate)
+        }
+
+    @staticmethod
+    def from_json(json: dict) -> IngestConfig:
+        j_enabled = json.get("enabled")
+        if type(j_enabled) is not bool:
+            raise ValueError(f"IngestConfig: Invalid enabled: '{j_enabled}'")
+
+        # Missing key: timestamp, explicit null: no dedupe
+        j_dedupe = json.get("dedupe", "timestamp")
+        if j_dedupe is not None and j_dedupe not in ("timestamp", "hash"):
+            raise ValueError(f"IngestConfig: Invalid dedupe: '{j_dedupe}'")
+
+        j_hash_window = json.get("hashWindow")
+        if j_hash_window is None:
+            j_hash_window = 16
+        elif type(j_hash_window) is not int or j_hash_window < 1:
+            raise ValueError(f"IngestConfig: Invalid hashWindow: '{j_hash_window}'")
+
+        j_max_age = json.get("maxAge")
+        if j_max_age is None:
+            j_max_age = 0
+        elif type(j_max_age) is not int or j_max_age < 0:
+            raise ValueError(f"IngestConfig: Invalid maxAge: '{j_max_age}'")
+
+        j_reject_out_of_order = json.get("rejectOutOfOrder")
+        if j_reject_out_of_order is None:
+            j_reject_out_of_order = True
+        elif type(j_reject_out_of_order) is not bool:
+            raise ValueError(f"IngestConfig: Invalid rejectOutOfOrder: '{j_reject_out_of_order}'")
+
+        j_policy = json.get("policy")
+        if j_policy is None:
+            j_policy = "all"
+        elif j_policy not in ("all", "latest", "decimate"):
+            raise ValueError(f"IngestConfig: Invalid policy: '{j_policy}'")
+
+        j_interval = json.get("interval")
+        if j_interval is None:
+            j_interval = 1.0
+        elif type(j_interval) not in (int, float) or j_interval <= 0:
+            raise ValueError(f"IngestConfig: Invalid interval: '{j_interval}'")
+
+        j_decimate = json.get("decimate")
+        if j_decimate is None:
+            j_decimate = 1
+        elif type(j_decimate) is not int or j_decimate < 1:
+            raise ValueError(f"IngestConfig: Invalid decimate: '{j_decimate}'")
+
+        return IngestConfig(j_enabled, j_dedupe, j_hash_window, j_max_age, j_reject_out_of_order, j_policy, float(j_interval), j_decimate)
+
+
+class KpiConfig:
+    def __init__(self, enabled: bool, interval: int = 60, step_threshold: float = 200.0, settle_band: float = 20.0,
+                 settle_timeout: int = 120, max_gap: int = 30) -> None:
+        self.enabled: bool = enabled
+        self.interval: int = interval
+        self.step_threshold: float = step_threshold
+        self.settle_band: float = settle_band
+        self.settle_timeout: int = settle_timeout
+        self.max_gap: int = max_gap
+
+    def to_json(self) -> dict:
+        return {
+            "enabled": bool(self.enabled),
+            "interval": int(self.interval),
+            "stepThreshold": float(self.step_threshold),
+            "settleBand": float(self.settle_band),
+            "settleTimeout": int(self.settle_timeout),
+            "maxGap": int(self.max_gap)
+        }
+
+    @staticmethod
+    def from_json(json: dict) -> KpiConfig:
+        j_enabled = json.get("enabled")
+        if type(j_enabled) is not bool:
+            raise ValueError(f"KpiConfig: Invalid enabled: '{j_enabled}'")
+
+        j_interval = json.get("interval")
+        if j_interval is None:
+            j_interval = 60
+        elif type(j_interval) is not int or j_interval < 1:
+            raise ValueError(f"KpiConfig: Invalid interval: '{j_interval}'")
+
+        j_step_threshold = json.get("stepThreshold")
+        if j_step_threshold is None:
+            j_step_threshold = 200.0
+        elif type(j_step_threshold) not in (int, float) or j_step_threshold <= 0:
+            raise ValueError(f"KpiConfig: Invalid stepThreshold: '{j_step_threshold}'")
+
+        j_settle_band = json.get("settleBand")
+        if j_settle_band is None:
+            j_settle_band = 20.0
+        elif type(j_settle_band) not in (int, float) or j_settle_band <= 0:
+            raise ValueError(f"KpiConfig: Invalid settleBand: '{j_settle_band}'")
+
+        j_settle_timeout = json.get("settleTimeout")
+        if j_settle_timeout is None:
+            j_settle_timeout = 120
+        elif type(j_settle_timeout) is not int or j_settle_timeout < 1:
+            raise ValueError(f"KpiConfig: Invalid settleTimeout: '{j_settle_timeout}'")
+
+        j_max_gap = json.get("maxGap")
+        if j_max_gap is None:
+            j_max_gap = 30
+        elif type(j_max_gap) is not int or j_max_gap < 1:
+            raise ValueError(f"KpiConfig: Invalid maxGap: '{j_max_gap}'")
+
+        return KpiConfig(j_enabled, j_interval, float(j_step_threshold), float(j_settle_band), j_settle_timeout, j_max_gap)
 
 
 class CustomizeConfig:
@@ -396,12 +1160,14 @@ class MetaControlConfig:
 
 
 class MetaTelemetryConfig:
-    def __init__(self, power: bool, sample: bool, overshoot: bool, limit: bool, command: bool) -> None:
+    def __init__(self, power: bool, sample: bool, overshoot: bool, limit: bool, command: bool, tokens: bool = False, delay: bool = False) -> None:
         self.power = power
         self.sample = sample
         self.overshoot = overshoot
         self.limit = limit
         self.command = command
+        self.tokens = tokens
+        self.delay = delay
 
     def to_json(self) -> dict:
         return {
@@ -409,7 +1175,9 @@ class MetaTelemetryConfig:
             "sample": bool(self.sample),
             "overshoot": bool(self.overshoot),
             "limit": bool(self.limit),
-            "command": bool(self.command)
+            "command": bool(self.command),
+            "tokens": bool(self.tokens),
+            "delay": bool(self.delay)
         }
 
     @staticmethod
@@ -434,7 +1202,19 @@ class MetaTelemetryConfig:
         if type(j_command) is not bool:
             raise ValueError(f"MetaTelemetryConfig: Invalid command: '{j_command}'")
 
-        return MetaTelemetryConfig(power=j_power, sample=j_sample, overshoot=j_overshoot, limit=j_limit, command=j_command)
+        j_tokens = json.get("tokens")
+        if j_tokens is None:
+            j_tokens = False
+        elif type(j_tokens) is not bool:
+            raise ValueError(f"MetaTelemetryConfig: Invalid tokens: '{j_tokens}'")
+
+        j_delay = json.get("delay")
+        if j_delay is None:
+            j_delay = False
+        elif type(j_delay) is not bool:
+            raise ValueError(f"MetaTelemetryConfig: Invalid delay: '{j_delay}'")
+
+        return MetaTelemetryConfig(power=j_power, sample=j_sample, overshoot=j_overshoot, limit=j_limit, command=j_command, tokens=j_tokens, delay=j_delay)
 
 
 class HA_DiscoveryConfig:
@@ -0,0 +1,76 @@
+import logging
+import math
+
+logger = logging.getLogger("sec.control")
+
+# Lease payloads: the instance id of the holder, or the id with this prefix when the leader gives the lease up (shutdown)
+RELEASE_PREFIX = "-"
+
+
+class LeaseElection:
+    """Leader election over a retained lease topic. The leader renews the lease every lease interval and releases it
+    on shutdown, a standby claims it once it is released or was not renewed for lease_timeout. If two instances claim at the same time
+    the lower instance id keeps the lease."""
+
+    def __init__(self, instance_id: str, lease_timeout: float) -> None:
+        self.instance_id: str = instance_id
+        self.lease_timeout: float = lease_timeout
+        self.is_leader: bool = False
+        self.holder: str | None = None
+        self.released: bool = False
+        self.__renewed: float = -math.inf
+
+    def on_lease(self, payload: str, retained: bool, now: float) -> bool:
+        """Processes a lease message. Returns True if the leader must publish its lease again at once"""
+        if self.released:
+            # Shutting down: the echo of our release must not be answered with a new claim
+            return False
+
+        if payload.startswith(RELEASE_PREFIX) or not payload:
+            if self.is_leader:
+                # A release of an earlier run replaced our retained lease
+                return True
+            released = payload[len(RELEASE_PREFIX):]
+            if not released or released == self.holder:
+                self.holder = None
+            return False
+
+        if payload == self.instance_id:
+            if retained and not self.is_leader:
+                # Lease of our previous connection, which is gone
+                self.holder = None
+            # Otherwise the echo of our own claim
+            return False
+
+        self.holder = payload
+        self.__renewed = now
+
+        if self.is_leader:
+            if payload < self.instance_id:
+                self.is_leader = False
+                logger.warning(f"Redundancy: Instance '{payload}' holds the lease as well, standing by")
+                return False
+            return True
+
+        return False
+
+    def should_claim(self, now: float) -> bool:
+        return not self.is_leader and not self.released and (self.holder is None or now - self.__renewed >= self.lease_timeout)
+
+    def claim(self) -> None:
+        if self.holder is not None:
+            logger.warning(f"Redundancy: Lease of '{self.holder}' expired, taking over")
+        self.is_leader = True
+        self.holder = self.instance_id
+
+    def release(self) -> None:
+        """Shutdown: gives the lease up for good"""
+        self.is_leader = False
+        self.holder = None
+        self.released = True
+
+    def reset(self) -> None:
+        """Connection lost: the lease expires or was taken over meanwhile"""
+        self.is_leader = False
+        self.holder = None
+        self.__renewed = -math.inf
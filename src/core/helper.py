@@ -1,41 +1,88 @@
 import logging
 import datetime
+import random
+import socket
+import threading
 import time
 import core.appconfig as appconfig
+import core.profiling as profiling
+from core.election import RELEASE_PREFIX
 from paho.mqtt import client as mqtt
 from paho.mqtt.properties import Properties
 from paho.mqtt.packettypes import PacketTypes 
-from typing import Callable, Any, List, Tuple
+from typing import Callable, Any, Dict, List, Set, Tuple
+
+logger = logging.getLogger("sec.mqtt")
+# --mqttdiag: received messages and paho client log
+logger_diag = logging.getLogger("sec.mqtt.diag")
 
 
 MQTT_TOPIC_META_CMD_ENABLED = "/cmd/enabled"
+MQTT_TOPIC_META_CMD_DUMP = "/cmd/dump"
 
 MQTT_TOPIC_META_TELE_READING = "tele/power"
 MQTT_TOPIC_META_TELE_SAMPLE = "tele/sample"
 MQTT_TOPIC_META_TELE_OVERSHOOT = "tele/overshoot"
 MQTT_TOPIC_META_TELE_LIMIT = "tele/limit"
 MQTT_TOPIC_META_TELE_CMD = "tele/command"
+MQTT_TOPIC_META_TELE_TOKENS = "tele/tokens"
+MQTT_TOPIC_META_TELE_DELAY = "tele/delay"
+MQTT_TOPIC_META_TELE_KPI_EXPORT = "tele/kpi/export"
+MQTT_TOPIC_META_TELE_KPI_IMPORT = "tele/kpi/import"
+MQTT_TOPIC_META_TELE_KPI_ABOVE = "tele/kpi/above"
+MQTT_TOPIC_META_TELE_KPI_COMMANDS = "tele/kpi/commands"
+MQTT_TOPIC_META_TELE_KPI_SETTLING = "tele/kpi/settling"
 
 MQTT_TOPIC_META_CORE_INVERTER_STATUS = "status/inverter"
 MQTT_TOPIC_META_CORE_ENABLED = "status/enabled"
 MQTT_TOPIC_META_CORE_ACTIVE = "status/active"
 MQTT_TOPIC_META_CORE_ONLINE = "status/online"
+MQTT_TOPIC_META_CORE_LEADER = "status/leader"
 
 MQTT_PL_TRUE = "1"
 MQTT_PL_FALSE = "0"
 
+# Reconnect backoff in seconds: doubles per failed attempt up to the maximum, randomized to 50-100%
+# so clients restarted together do not hit the broker at the same time
+RECONNECT_DELAY_MIN = 1
+RECONNECT_DELAY_MAX = 60
+# Actions scheduled after the disconnect keep running while waiting for the next attempt
+RECONNECT_POLL_INTERVAL = 0.5
+# Seconds a preferred broker may take to accept a tcp connection to count as recovered
+FAILBACK_PROBE_TIMEOUT = 1.0
+# Seconds until a subscription refused by the broker (e.g. ACL) is tried again
+SUBSCRIBE_RETRY_INTERVAL = 30
+
 
 class MqttHelper:
     def __init__(self, config: appconfig.AppConfig, loglvl=logging.root.level, mqttDiag: bool = False) -> None:
         self.config = config
         self.debug = loglvl == logging.DEBUG
         self.scheduler = ActionScheduler()
-        self.subs: List[str] = []
+        # Topics subscribed since the last connect, acknowledged or not. Pending maps the M-ID to the topic until the SUBACK
+        self.subs: Set[str] = set()
+        self.subs_acked: Set[str] = set()
+        self.subs_pending: Dict[int, str] = {}
         self.mqttDiag = mqttDiag
 
         self.__on_connect_success = None
         self.__on_connect_error = None
         self.__on_disconnect = None
+        self.__on_publish = None
+        # Clean start only on the first connect of a persistent session, see connect
+        self.__session_started: bool = False
+        # Brokers in priority order: mqtt.host, then mqtt.failover
+        self.broker_index: int = 0
+        self.broker_changed: bool = False
+        self.__connected_index: int | None = None
+        self.__switch_index: int | None = None
+        self.__failback_thread: threading.Thread | None = None
+        self.__failback_index: int | None = None
+        # Set by stop: loop_forever returns instead of reconnecting
+        self.stopping: bool = False
+        # MQTTv5 topic aliases of this connection, up to the maximum announced by the broker
+        self.__alias_max: int = 0
+        self.__aliases: Dict[str, int] = {}
 
         vers_clean_session = True
 
@@ -52,12 +99,13 @@ class MqttHelper:
             client.username_pw_set(config.mqtt.auth.username, config.mqtt.auth.password)
 
         if mqttDiag:
-            client.enable_logger(logging.root)
+            client.enable_logger(logger_diag)
 
         client.on_connect = self.__proxy_on_connect
         client.on_disconnect = self.__proxy_on_disconnect
         client.on_subscribe = self.__proxy_on_subscribe
         client.on_unsubscribe = self.__proxy_on_unsubscribe
+        client.on_publish = self.__proxy_on_publish
 
         self.client = client
 
@@ -70,7 +118,7 @@ class MqttHelper:
 
     def received_message(self, msg: mqtt.MQTTMessage, type: str, parsed) -> None:
         if self.mqttDiag:
-            logging.debug(f"Received '{type}' message: '{msg.payload}' on topic: '{msg.topic}' with QoS '{msg.qos}' was retained '{msg.retain}' -> {parsed}")
+            logger_diag.debug(f"Received '{type}' message: '{msg.payload}' on topic: '{msg.topic}' with QoS '{msg.qos}' was retained '{msg.retain}' -> {parsed}")
 
     def schedule(self, seconds: int, action: Callable) -> None:
         self.scheduler.schedule(seconds, action)
@@ -79,17 +127,28 @@ class MqttHelper:
         if topic in self.subs:
             return
 
+        self.subs.add(topic)
+        self.__send_subscribe(topic)
+
+    def __send_subscribe(self, topic: str) -> None:
         r = self.client.subscribe(topic)
-        self.subs.append(topic)
-        logging.debug(f"Subscribed to '{topic}' -> M-ID: {r[1]}, Code: {r[0]} - \"{mqtt.error_string(r[0])}\"")
+        if r[0] == mqtt.MQTT_ERR_SUCCESS:
+            self.subs_pending[r[1]] = topic
+        logger.debug(f"Subscribed to '{topic}' -> M-ID: {r[1]}, Code: {r[0]} - \"{mqtt.error_string(r[0])}\"")
+
+    def __retry_subscribe(self, topic: str) -> None:
+        # Unsubscribed or reconnected meanwhile: nothing to retry
+        if topic in self.subs and topic not in self.subs_acked and topic not in self.subs_pending.values():
+            self.__send_subscribe(topic)
 
     def unsubscribe(self, topic: str) -> None:
         if topic not in self.subs:
             return
 
         r = self.client.unsubscribe(topic)
-        self.subs.remove(topic)
-        logging.debug(f"Unsubscribed from '{topic}' -> M-ID: {r[1]}, Code: {r[0]} - \"{mqtt.error_string(r[0])}\"")
+        self.subs.discard(topic)
+        self.subs_acked.discard(topic)
+        logger.debug(f"Unsubscribed from '{topic}' -> M-ID: {r[1]}, Code: {r[0]} - \"{mqtt.error_string(r[0])}\"")
 
     def unsubscribe_many(self, topics: List[str]) -> None:
         if len(topics) == 0:
@@ -97,16 +156,52 @@ class MqttHelper:
 
         r = self.client.unsubscribe(topics)
         for topic in topics:
-            logging.debug(f"Unsubscribed from '{topic}' -> M-ID: {r[1]}, Code: {r[0]} - \"{mqtt.error_string(r[0])}\"")
-            self.subs.remove(topic)
+            logger.debug(f"Unsubscribed from '{topic}' -> M-ID: {r[1]}, Code: {r[0]} - \"{mqtt.error_string(r[0])}\"")
+            self.subs.discard(topic)
+            self.subs_acked.discard(topic)
 
     def unsubscribe_all(self) -> None:
         if not len(self.subs):
             return
-        self.unsubscribe_many([x for x in self.subs])
+        self.unsubscribe_many(list(self.subs))
+
+    def is_subscribed(self, topic: str) -> bool:
+        """True once the broker acknowledged the subscription"""
+        return topic in self.subs_acked
 
     def publish(self, topic: str, payload: str | None, qos: int = 0, retain: bool = False, props=None) -> mqtt.MQTTMessageInfo:
-        return self.client.publish(topic, payload, qos, retain, props)
+        # Only non retained QoS 0 messages (tele, commands) use aliases: paho resends unacknowledged messages
+        # after a reconnect, where the alias is unknown to the broker
+        if not self.__alias_max or retain or qos > 0:
+            return self.client.publish(topic, payload, qos, retain, props)
+
+        alias = self.__aliases.get(topic)
+        if alias is None and len(self.__aliases) >= self.__alias_max:
+            return self.client.publish(topic, payload, qos, retain, props)
+
+        if props is None:
+            props = Properties(PacketTypes.PUBLISH)
+
+        if alias is not None:
+            # The broker knows the alias: the topic is sent empty
+            props.TopicAlias = alias
+            return self.client.publish("", payload, qos, retain, props)
+
+        # The first message sends topic and alias
+        alias = len(self.__aliases) + 1
+        props.TopicAlias = alias
+        r = self.client.publish(topic, payload, qos, retain, props)
+        if r.rc == mqtt.MQTT_ERR_SUCCESS:
+            self.__aliases[topic] = alias
+        return r
+
+    @property
+    def brokers(self) -> List[Tuple[str, int]]:
+        return [(self.config.mqtt.host, self.config.mqtt.port)] + [(b.host, b.port) for b in self.config.mqtt.failover]
+
+    @property
+    def persistent_session(self) -> bool:
+        return self.config.mqtt.protocol == mqtt.MQTTv5 and self.config.mqtt.session_expiry > 0
 
     def connect(self) -> None:
         vers_clean_start = mqtt.MQTT_CLEAN_START_FIRST_ONLY
@@ -117,29 +212,85 @@ class MqttHelper:
             properties=Properties(PacketTypes.CONNECT)
             properties.SessionExpiryInterval=0
 
-        self.client.connect(host=self.config.mqtt.host,
-                            port=self.config.mqtt.port,
+            if self.persistent_session:
+                # The broker keeps the subscriptions for sessionExpiry seconds after a disconnect
+                vers_clean_start = not self.__session_started
+                properties.SessionExpiryInterval=self.config.mqtt.session_expiry
+
+        brokers = self.brokers
+        self.broker_index = min(self.broker_index, len(brokers) - 1)
+        host, port = brokers[self.broker_index]
+
+        logger.info(f"Connecting to {host}:{port} ...")
+        self.client.connect(host=host,
+                            port=port,
                             keepalive=self.config.mqtt.keepalive,
                             clean_start=vers_clean_start,
                             properties=properties)
 
-        logging.info("Connecting ...")
+        # The command follows the telemetry of the same reading: without this it waits for the ack of the telemetry
+        sock = self.client.socket()
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def apply_config(self, config: appconfig.AppConfig) -> bool:
+        old = self.config.mqtt
+        new = config.mqtt
+        self.config = config
+
+        if old.client_id != new.client_id or old.protocol != new.protocol:
+            logger.warning("Config: Changes to 'mqtt.clientId' or 'mqtt.protocol' require a restart")
+
+        if new.auth:
+            self.client.username_pw_set(new.auth.username, new.auth.password)
+        else:
+            self.client.username_pw_set(None, None)
+
+        return old.to_json() != new.to_json()
+
+    def stop(self) -> None:
+        """Ends loop_forever after a clean disconnect, may be called from another thread"""
+        self.stopping = True
+        self.client.disconnect()
 
-    def on_connect(self, callback_success: Callable[[], None] | None, callback_error: Callable[[int], None] | None) -> None:
+    def reconnect(self) -> None:
+        logger.info("Reconnecting with new connection settings ...")
+        # Start over with the primary broker
+        self.__switch_index = 0
+        self.client.disconnect()
+
+    def on_connect(self, callback_success: Callable[[bool], None] | None, callback_error: Callable[[int], None] | None) -> None:
         self.__on_connect_success = callback_success
         self.__on_connect_error = callback_error
 
     def on_disconnect(self, callback: Callable[[int], None] | None) -> None:
         self.__on_disconnect = callback
 
-    def reset(self) -> None:
-        self.subs.clear()
+    def on_publish(self, callback: Callable[[int], None] | None) -> None:
+        self.__on_publish = callback
+
+    def reset(self, keep_subscriptions: bool = False) -> None:
+        if not keep_subscriptions:
+            self.subs.clear()
+            self.subs_acked.clear()
+        self.subs_pending.clear()
         self.scheduler.clear()
+        self.__aliases.clear()
+        self.__alias_max = 0
+
+    def run_due_actions(self) -> None:
+        due_actions = self.scheduler.get_due()
+        if due_actions is None:
+            return
+
+        for action in due_actions:
+            try:
+                action()
+            except Exception as ex:
+                logger.warning(f"Failed to execute scheduled action: {ex}")
 
     def loop_forever(self):
         attempt = 0
-        delay_interval = 2
-        delay_max = 60
 
         while True:
             while True:
@@ -149,48 +300,137 @@ class MqttHelper:
                     break
 
                 attempt = 0
-                due_actions = self.scheduler.get_due()
-                if due_actions is not None:
-                    for action in due_actions:
-                        try:
-                            action()
-                        except Exception as ex:
-                            logging.warning(f"Failed to execute scheduled action: {ex}")
+                self.run_due_actions()
+
+            if self.stopping:
+                return
 
             attempt += 1
-            delay = delay_interval * attempt
-            delay = delay_max if delay > delay_max else delay
-            time.sleep(delay)
-            logging.info(f"[{attempt}]: Reconnecting ...")
-            self.client.reconnect()
+            count = len(self.brokers)
+
+            if self.__switch_index is not None:
+                self.broker_index = self.__switch_index
+                self.__switch_index = None
+                attempt = 0
+                delay = 0.0
+            elif count > 1 and attempt % count != 0:
+                # Fail over to the next broker at once, the backoff applies after a round over all brokers
+                self.broker_index = (self.broker_index + 1) % count
+                delay = 0.0
+            else:
+                self.broker_index = (self.broker_index + 1) % count
+                delay = min(RECONNECT_DELAY_MIN * 2 ** (attempt // count - 1), RECONNECT_DELAY_MAX)
+                delay = random.uniform(delay / 2, delay)
+
+            logger.info(f"[{attempt}]: Reconnecting in {delay:.1f}s ...")
+
+            reconnect_at = time.monotonic() + delay
+            while time.monotonic() < reconnect_at:
+                self.run_due_actions()
+                time.sleep(max(0.0, min(reconnect_at - time.monotonic(), RECONNECT_POLL_INTERVAL)))
+
+            try:
+                self.connect()
+            except OSError as ex:
+                # Broker not reachable: try again after the next delay
+                logger.warning(f"[{attempt}]: Connect failed: {ex}")
+
+
+    def __probe_failback(self) -> None:
+        """Probes the preferred brokers on a worker thread: a tcp connect blocks up to FAILBACK_PROBE_TIMEOUT per
+        broker, the network loop must not wait for it"""
+        if self.broker_index == 0 or (self.__failback_thread is not None and self.__failback_thread.is_alive()):
+            return
+
+        self.__failback_index = None
+        self.__failback_thread = threading.Thread(target=self.__run_failback_probe, args=(self.brokers[:self.broker_index],),
+                                                  name="failback", daemon=True)
+        self.__failback_thread.start()
+        self.schedule(1, self.__collect_failback)
+
+    def __run_failback_probe(self, brokers: List[Tuple[str, int]]) -> None:
+        # Worker thread: only stores the result, the network loop acts on it
+        for index, (host, port) in enumerate(brokers):
+            try:
+                socket.create_connection((host, port), timeout=FAILBACK_PROBE_TIMEOUT).close()
+            except OSError:
+                continue
+
+            self.__failback_index = index
+            return
+
+    def __collect_failback(self) -> None:
+        """Returns to the first preferred broker that accepted a tcp connection again"""
+        if self.__failback_thread.is_alive():
+            self.schedule(1, self.__collect_failback)
+            return
+
+        index = self.__failback_index
+        if index is None or index >= self.broker_index:
+            self.schedule(self.config.mqtt.failback_interval, self.__probe_failback)
+            return
+
+        host, port = self.brokers[index]
+        logger.info(f"Broker {host}:{port} is reachable again, switching back")
+        self.__switch_index = index
+        self.client.disconnect()
 
 
 # region Event proxys
 
 
     def __proxy_on_connect(self, client: mqtt.Client, ud, flags, rc, props=None) -> None:
-        logging.info(f"Connection response -> {rc} - \"{mqtt.connack_string(rc)}\", flags: {flags}")
-        self.reset()
+        logger.info(f"Connection response -> {rc} - \"{mqtt.connack_string(rc)}\", flags: {flags}")
+        # Session present: the broker resumed the previous session with its subscriptions
+        session_present = rc == mqtt.CONNACK_ACCEPTED and self.persistent_session and bool(flags.get("session present"))
+        self.reset(keep_subscriptions=session_present)
 
         if rc == mqtt.CONNACK_ACCEPTED:
+            self.__session_started = True
+            self.broker_changed = self.__connected_index is not None and self.__connected_index != self.broker_index
+            self.__connected_index = self.broker_index
+            if self.broker_index > 0:
+                logger.warning(f"Connected to failover broker {self.broker_index}: {self.brokers[self.broker_index]}")
+                self.schedule(self.config.mqtt.failback_interval, self.__probe_failback)
+            if self.config.mqtt.protocol == mqtt.MQTTv5 and props is not None:
+                # Without TopicAliasMaximum in the CONNACK the broker accepts no aliases
+                self.__alias_max = getattr(props, "TopicAliasMaximum", 0)
             if self.__on_connect_success is not None:
-                self.__on_connect_success()
+                self.__on_connect_success(session_present)
         else:
             if self.__on_connect_error is not None:
                 self.__on_connect_error(rc)
 
     def __proxy_on_disconnect(self, client: mqtt.Client, userdata, rc, props=None) -> None:
-        logging.warning(f"Disconnected: {rc} - \"{mqtt.error_string(rc)}\"")
-        self.reset()
+        logger.warning(f"Disconnected: {rc} - \"{mqtt.error_string(rc)}\"")
+        self.reset(keep_subscriptions=self.persistent_session)
 
         if self.__on_disconnect is not None:
             self.__on_disconnect(rc)
 
     def __proxy_on_subscribe(self, client, userdata, mid, granted_qos_or_rcs, props=None) -> None:
-        logging.debug(f"Subscribe acknowledged -> M-ID: {mid}")
+        topic = self.subs_pending.pop(mid, None)
+        if topic is None:
+            logger.debug(f"Subscribe acknowledged -> M-ID: {mid}")
+            return
+
+        # MQTTv5 passes reason codes, 3.1.1 the granted qos. Both use 0x80 and above for a refused subscription
+        code = getattr(granted_qos_or_rcs[0], "value", granted_qos_or_rcs[0]) if granted_qos_or_rcs else 0x80
+        if code >= 0x80:
+            logger.warning(f"Subscribe to '{topic}' refused by broker -> M-ID: {mid}, Code: {code}, retrying in {SUBSCRIBE_RETRY_INTERVAL}s")
+            self.schedule(SUBSCRIBE_RETRY_INTERVAL, lambda: self.__retry_subscribe(topic))
+            return
+
+        if topic in self.subs:
+            self.subs_acked.add(topic)
+        logger.debug(f"Subscribe to '{topic}' acknowledged -> M-ID: {mid}")
 
     def __proxy_on_unsubscribe(self, client, userdata, mid, props=None, rc=None) -> None:
-        logging.debug(f"Unsubscribe acknowledged -> M-ID: {mid}")
+        logger.debug(f"Unsubscribe acknowledged -> M-ID: {mid}")
+
+    def __proxy_on_publish(self, client, userdata, mid) -> None:
+        if self.__on_publish is not None:
+            self.__on_publish(mid)
 
 # endregion
 
@@ -198,17 +438,33 @@ class MqttHelper:
 class MetaControlHelper(MqttHelper):
     def __init__(self, config: appconfig.AppConfig, loglvl=logging.root.level, mqttLogging: bool = False) -> None:
         super().__init__(config, loglvl, mqttLogging)
+        self.__on_cmd_enabled: Callable[[bool], None] | None = None
+        self.__on_cmd_dump: Callable[[], None] | None = None
+        self.__on_leader: Callable[[str, bool], None] | None = None
+        self.__on_tele_cmd: Callable[[float], None] | None = None
+        self.__setup_meta()
+
+    def __setup_meta(self) -> None:
+        config = self.config
         self.topic_meta_cmd_enabled = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_CMD_ENABLED)
+        self.topic_meta_cmd_dump = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_CMD_DUMP)
         self.topic_meta_core_enabled = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_CORE_ENABLED)
         self.topic_meta_core_active = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_CORE_ACTIVE)
         self.topic_meta_core_online = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_CORE_ONLINE)
+        self.topic_meta_core_leader = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_CORE_LEADER)
         self.topic_meta_core_inverter_status = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_CORE_INVERTER_STATUS)
         self.topic_meta_tele_limit = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_TELE_LIMIT)
         self.topic_meta_tele_cmd = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_TELE_CMD)
         self.topic_meta_tele_reading = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_TELE_READING)
         self.topic_meta_tele_sample = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_TELE_SAMPLE)
         self.topic_meta_tele_overshoot = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_TELE_OVERSHOOT)
-        self.__on_cmd_enabled: Callable[[bool], None] | None = None
+        self.topic_meta_tele_tokens = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_TELE_TOKENS)
+        self.topic_meta_tele_delay = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_TELE_DELAY)
+        self.topic_meta_tele_kpi_export = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_TELE_KPI_EXPORT)
+        self.topic_meta_tele_kpi_import = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_TELE_KPI_IMPORT)
+        self.topic_meta_tele_kpi_above = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_TELE_KPI_ABOVE)
+        self.topic_meta_tele_kpi_commands = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_TELE_KPI_COMMANDS)
+        self.topic_meta_tele_kpi_settling = MqttHelper.combine_topic_path(config.meta.prefix, MQTT_TOPIC_META_TELE_KPI_SETTLING)
         self.has_discovery = False
         self.has_inverter_status = bool(config.mqtt.topics.inverter_status)
         self.has_inverter_power = bool(config.mqtt.topics.inverter_power)
@@ -221,14 +477,52 @@ class MetaControlHelper(MqttHelper):
             self.__discovery_overshoot = self.__create_discovery_overshoot()
             self.__discovery_limit = self.__create_discovery_limit()
             self.__discovery_cmd = self.__create_discovery_command()
+            self.__discovery_tokens = self.__create_discovery_tokens()
+            self.__discovery_delay = self.__create_discovery_delay()
+            self.__discovery_kpis = self.__create_discovery_kpis()
             self.__discovery_status_enabled = self.__create_discovery_status_enabled()
             self.__discovery_status_inverter = self.__create_discovery_status_inverter()
             self.__discovery_status_active = self.__create_discovery_status_active()
             self.__discovery_switch_status_enabled = self.__create_discovery_switch_enabled()
 
+    def apply_config(self, config: appconfig.AppConfig) -> bool:
+        old_prefix = self.config.meta.prefix
+        reconnect = super().apply_config(config)
+
+        if old_prefix != config.meta.prefix:
+            # Topics and last will move, the broker must learn about them with a new session
+            self.client.message_callback_remove(self.topic_meta_cmd_enabled)
+            self.client.message_callback_remove(self.topic_meta_cmd_dump)
+            self.client.message_callback_remove(self.topic_meta_core_leader)
+            self.client.message_callback_remove(self.topic_meta_tele_cmd)
+            self.__setup_meta()
+            self.setup_will()
+            if self.__on_cmd_enabled is not None:
+                self.client.message_callback_add(self.topic_meta_cmd_enabled, self.__proxy_on_meta_cmd_enabled)
+            if self.__on_cmd_dump is not None:
+                self.client.message_callback_add(self.topic_meta_cmd_dump, self.__proxy_on_meta_cmd_dump)
+            if self.__on_leader is not None:
+                self.client.message_callback_add(self.topic_meta_core_leader, self.__proxy_on_meta_status_leader)
+            if self.__on_tele_cmd is not None:
+                self.client.message_callback_add(self.topic_meta_tele_cmd, self.__proxy_on_meta_tele_command)
+            return True
+
+        self.__setup_meta()
+        return reconnect
+
+    @property
+    def instance_id(self) -> str:
+        return self.config.redundancy.instance_id or self.config.mqtt.client_id
+
     def setup_will(self) -> None:
         self.client.will_set(self.topic_meta_core_online, MQTT_PL_FALSE, 0, True)
 
+    def publish_meta_status_leader(self) -> None:
+        self.publish(self.topic_meta_core_leader, self.instance_id, 1, True)
+
+    def publish_meta_status_release(self) -> None:
+        self.publish(self.topic_meta_core_leader, RELEASE_PREFIX + self.instance_id, 1, True)
+
     def publish_meta_status_enabled(self, enabled: bool) -> None:
         payload = MQTT_PL_TRUE if enabled else MQTT_PL_FALSE
         self.publish(self.topic_meta_core_enabled, payload, 0, True)
@@ -262,9 +556,29 @@ class MetaControlHelper(MqttHelper):
             self.publish(self.topic_meta_tele_limit, f"{limit:.2f}", 0, False)
 
     def publish_meta_tele_command(self, cmd: float) -> None:
-        if self.config.meta.telemetry.command:
+        # The standby of a redundant setup mirrors the commands
+        if self.config.meta.telemetry.command or self.config.redundancy.enabled:
             self.publish(self.topic_meta_tele_cmd, f"{cmd:.2f}", 0, False)
 
+    def publish_meta_tele_tokens(self, tokens: float) -> None:
+        if self.config.meta.telemetry.tokens:
+            self.publish(self.topic_meta_tele_tokens, f"{tokens:.2f}", 0, False)
+
+    def publish_meta_tele_delay(self, delay: float) -> None:
+        if self.config.meta.telemetry.delay:
+            self.publish(self.topic_meta_tele_delay, f"{delay:.2f}", 0, False)
+
+    def publish_meta_tele_kpis(self, export_wh: float, import_wh: float, above_target: float, commands_per_hour: float, settling_time: float | None) -> None:
+        if not self.config.kpi.enabled:
+            return
+
+        self.publish(self.topic_meta_tele_kpi_export, f"{export_wh:.2f}", 0, False)
+        self.publish(self.topic_meta_tele_kpi_import, f"{import_wh:.2f}", 0, False)
+        self.publish(self.topic_meta_tele_kpi_above, f"{above_target:.0f}", 0, False)
+        self.publish(self.topic_meta_tele_kpi_commands, f"{commands_per_hour:.1f}", 0, False)
+        if settling_time is not None:
+            self.publish(self.topic_meta_tele_kpi_settling, f"{settling_time:.2f}", 0, False)
+
     def publish_meta_teles(self, reading: float, sample: float, overshoot: float | None, limit: float | None) -> None:
         self.publish_meta_tele_reading(reading)
         self.publish_meta_tele_sample(sample)
@@ -313,6 +627,19 @@ class MetaControlHelper(MqttHelper):
         else:
             self.publish(self.__discovery_cmd[0], "", 0, True)
 
+        if self.config.meta.telemetry.tokens:
+            self.publish(self.__discovery_tokens[0], self.__discovery_tokens[1], 0, True)
+        else:
+            self.publish(self.__discovery_tokens[0], "", 0, True)
+
+        if self.config.meta.telemetry.delay:
+            self.publish(self.__discovery_delay[0], self.__discovery_delay[1], 0, True)
+        else:
+            self.publish(self.__discovery_delay[0], "", 0, True)
+
+        for topic, payload in self.__discovery_kpis:
+            self.publish(topic, payload if self.config.kpi.enabled else "", 0, True)
+
     def subscribe_meta_cmd_enabled(self) -> None:
         self.subscribe(self.topic_meta_cmd_enabled)
 
@@ -323,6 +650,64 @@ class MetaControlHelper(MqttHelper):
         else:
             self.client.message_callback_add(self.topic_meta_cmd_enabled, self.__proxy_on_meta_cmd_enabled)
 
+    def subscribe_meta_cmd_dump(self) -> None:
+        self.subscribe(self.topic_meta_cmd_dump)
+
+    def on_meta_cmd_dump(self, callback: Callable[[], None] | None) -> None:
+        self.__on_cmd_dump = callback
+        if callback is None:
+            self.client.message_callback_remove(self.topic_meta_cmd_dump)
+        else:
+            self.client.message_callback_add(self.topic_meta_cmd_dump, self.__proxy_on_meta_cmd_dump)
+
+    def subscribe_meta_status_leader(self) -> None:
+        self.subscribe(self.topic_meta_core_leader)
+
+    def unsubscribe_meta_status_leader(self) -> None:
+        self.unsubscribe(self.topic_meta_core_leader)
+
+    def on_meta_status_leader(self, callback: Callable[[str, bool], None] | None) -> None:
+        self.__on_leader = callback
+        if callback is None:
+            self.client.message_callback_remove(self.topic_meta_core_leader)
+        else:
+            self.client.message_callback_add(self.topic_meta_core_leader, self.__proxy_on_meta_status_leader)
+
+    def subscribe_meta_tele_command(self) -> None:
+        self.subscribe(self.topic_meta_tele_cmd)
+
+    def on_meta_tele_command(self, callback: Callable[[float], None] | None) -> None:
+        self.__on_tele_cmd = callback
+        if callback is None:
+            self.client.message_callback_remove(self.topic_meta_tele_cmd)
+        else:
+            self.client.message_callback_add(self.topic_meta_tele_cmd, self.__proxy_on_meta_tele_command)
+
+    def __proxy_on_meta_status_leader(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage, props=None) -> None:
+        payload = msg.payload.decode()
+        self.received_message(msg, "meta-leader", payload)
+
+        if self.__on_leader is not None:
+            self.__on_leader(payload, bool(msg.retain))
+
+    def __proxy_on_meta_tele_command(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage, props=None) -> None:
+        try:
+            parsed = float(msg.payload.decode())
+        except ValueError:
+            parsed = None
+
+        self.received_message(msg, "meta-tele-command", parsed)
+
+        if self.__on_tele_cmd is not None and parsed is not None:
+            self.__on_tele_cmd(parsed)
+
+    def __proxy_on_meta_cmd_dump(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage, props=None) -> None:
+        # A retained message would dump on every connect
+        self.received_message(msg, "meta-dump", not msg.retain)
+
+        if self.__on_cmd_dump is not None and not msg.retain:
+            self.__on_cmd_dump()
+
     def __proxy_on_meta_cmd_enabled(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage, props=None) -> None:
         if self.__on_cmd_enabled is None:
             return
@@ -386,6 +771,44 @@ class MetaControlHelper(MqttHelper):
         payload = self.__create_discovery_payload_tele_sensor(name, uniq_id, self.topic_meta_tele_cmd, unit, uniq_id, None, None, "mdi:cube-send")
         return (topic, payload)
 
+    def __create_discovery_tokens(self) -> Tuple[str, str]:
+        config = self.config.meta.discovery
+        uniq_id = f"sec_{config.id}_state_tele_tokens"
+        name = f"Command Tokens"
+        node_id = f"sec_{config.id}"
+        topic = self.__create_discovery_topic("sensor", node_id, "tokens")
+        payload = self.__create_discovery_payload_tele_sensor(name, uniq_id, self.topic_meta_tele_tokens, "tokens", uniq_id, None, "measurement", "mdi:bucket-outline")
+        return (topic, payload)
+
+    def __create_discovery_delay(self) -> Tuple[str, str]:
+        config = self.config.meta.discovery
+        uniq_id = f"sec_{config.id}_state_tele_delay"
+        name = f"Inverter Delay"
+        node_id = f"sec_{config.id}"
+        topic = self.__create_discovery_topic("sensor", node_id, "delay")
+        payload = self.__create_discovery_payload_tele_sensor(name, uniq_id, self.topic_meta_tele_delay, "s", uniq_id, "duration", "measurement", "mdi:timer-sand")
+        return (topic, payload)
+
+    def __create_discovery_kpis(self) -> List[Tuple[str, str]]:
+        config = self.config.meta.discovery
+        node_id = f"sec_{config.id}"
+        # Object id, name, state topic, unit, device class, state class, icon
+        sensors = [
+            ("kpi_export", "Exported Energy", self.topic_meta_tele_kpi_export, "Wh", "energy", "total_increasing", "mdi:transmission-tower-export"),
+            ("kpi_import", "Imported Energy", self.topic_meta_tele_kpi_import, "Wh", "energy", "total_increasing", "mdi:transmission-tower-import"),
+            ("kpi_above", "Time Above Target", self.topic_meta_tele_kpi_above, "s", "duration", "total_increasing", "mdi:timer-alert-outline"),
+            ("kpi_commands", "Commands per Hour", self.topic_meta_tele_kpi_commands, "commands/h", None, "measurement", "mdi:cube-send"),
+            ("kpi_settling", "Settling Time", self.topic_meta_tele_kpi_settling, "s", "duration", "measurement", "mdi:timer-check-outline"),
+        ]
+
+        result = []
+        for obj_id, name, state_topic, unit, dev_class, state_class, icon in sensors:
+            uniq_id = f"sec_{config.id}_state_tele_{obj_id}"
+            topic = self.__create_discovery_topic("sensor", node_id, obj_id)
+            payload = self.__create_discovery_payload_tele_sensor(name, uniq_id, state_topic, unit, uniq_id, dev_class, state_class, icon)
+            result.append((topic, payload))
+        return result
+
     def __create_discovery_status_enabled(self) -> Tuple[str, str]:
         config = self.config.meta.discovery
         uniq_id = f"sec_{config.id}_state_status_enabled"
@@ -450,48 +873,107 @@ class AppMqttHelper(MetaControlHelper):
         self.__on_power_reading: Callable[[float], None] | None = None
         self.__on_inverter_status: Callable[[bool], None] | None = None
         self.__on_inverter_power: Callable[[float], None] | None = None
-
-    def on_power_reading(self, callback: Callable[[float], None] | None, parser: Callable[[bytes], float | None]) -> None:
+        self.__on_inverter_limit: Callable[[float], None] | None = None
+        self.__on_command_ack: Callable[[str, float], None] | None = None
+        self.has_inverter_limit = bool(config.mqtt.topics.inverter_limit)
+
+        # Message callbacks, timed with --profile
+        self.__dispatch_power_reading = profiling.timed("dispatch.power_reading", self.__proxy_on_power_reading)
+        self.__dispatch_inverter_status = profiling.timed("dispatch.inverter_status", self.__proxy_on_inverter_status)
+        self.__dispatch_inverter_power = profiling.timed("dispatch.inverter_power", self.__proxy_on_inverter_power)
+        self.__dispatch_inverter_limit = profiling.timed("dispatch.inverter_limit", self.__proxy_on_inverter_limit)
+
+        # Latest command waiting for its PUBACK/PUBCOMP: (mid, payload, publish time)
+        self.__cmd_inflight: Tuple[int, str, float] | None = None
+        self.cmd_superseded: int = 0
+        self.on_publish(self.__on_publish_ack)
+
+    def on_power_reading(self, callback: Callable[[float], None] | None, parser: Callable[[bytes, int, bool], float | None]) -> None:
+        """parser gets the payload, the index of the source in config.mqtt.topics.read_power_topics and whether the
+        broker sent the message again (retained on subscribe, or redelivered)"""
         self.__on_power_reading = callback
         self.__parser_power_reading = parser
 
-        if callback is None:
-            self.client.message_callback_remove(self.config.mqtt.topics.read_power)
-        else:
-            self.client.message_callback_add(self.config.mqtt.topics.read_power, self.__proxy_on_power_reading)
+        for topic in self.config.mqtt.topics.read_power_topics:
+            if callback is None:
+                self.client.message_callback_remove(topic)
+            else:
+                self.client.message_callback_add(topic, self.__dispatch_power_reading)
 
     def on_inverter_status(self, callback: Callable[[bool], None] | None, parser: Callable[[bytes], bool | None]) -> None:
-        if not bool(self.config.mqtt.topics.inverter_status):
-            return
-
         self.__on_inverter_status = callback
         self.__parser_inverter_status = parser
 
+        if not bool(self.config.mqtt.topics.inverter_status):
+            return
+
         if callback is None:
             self.client.message_callback_remove(self.config.mqtt.topics.inverter_status)
         else:
-            self.client.message_callback_add(self.config.mqtt.topics.inverter_status, self.__proxy_on_inverter_status)
+            self.client.message_callback_add(self.config.mqtt.topics.inverter_status, self.__dispatch_inverter_status)
 
     def on_inverter_power(self, callback: Callable[[float], None] | None, parser: Callable[[bytes], float | None]) -> None:
-        if not bool(self.config.mqtt.topics.inverter_power):
-            return
-
         self.__on_inverter_power = callback
         self.__parser_inverter_power = parser
 
+        if not bool(self.config.mqtt.topics.inverter_power):
+            return
+
         if callback is None:
             self.client.message_callback_remove(self.config.mqtt.topics.inverter_power)
         else:
-            self.client.message_callback_add(self.config.mqtt.topics.inverter_power, self.__proxy_on_inverter_power)
+            self.client.message_callback_add(self.config.mqtt.topics.inverter_power, self.__dispatch_inverter_power)
+
+    def on_inverter_limit(self, callback: Callable[[float], None] | None, parser: Callable[[bytes], float | None]) -> None:
+        self.__on_inverter_limit = callback
+        self.__parser_inverter_limit = parser
+
+        if not bool(self.config.mqtt.topics.inverter_limit):
+            return
+
+        if callback is None:
+            self.client.message_callback_remove(self.config.mqtt.topics.inverter_limit)
+        else:
+            self.client.message_callback_add(self.config.mqtt.topics.inverter_limit, self.__dispatch_inverter_limit)
+
+    def on_command_ack(self, callback: Callable[[str, float], None] | None) -> None:
+        self.__on_command_ack = callback
+
+    def apply_config(self, config: appconfig.AppConfig) -> bool:
+        old = self.config.mqtt.topics
+        new = config.mqtt.topics
+
+        for topic in (*old.read_power_topics, old.inverter_status, old.inverter_power, old.inverter_limit):
+            if topic:
+                self.client.message_callback_remove(topic)
+
+        reconnect = super().apply_config(config)
+        self.has_inverter_limit = bool(new.inverter_limit)
+
+        # Re-register the callbacks on the (possibly) new topics
+        if self.__on_power_reading is not None:
+            for topic in new.read_power_topics:
+                self.client.message_callback_add(topic, self.__dispatch_power_reading)
+
+        if self.__on_inverter_status is not None and new.inverter_status:
+            self.client.message_callback_add(new.inverter_status, self.__dispatch_inverter_status)
+
+        if self.__on_inverter_power is not None and new.inverter_power:
+            self.client.message_callback_add(new.inverter_power, self.__dispatch_inverter_power)
+
+        if self.__on_inverter_limit is not None and new.inverter_limit:
+            self.client.message_callback_add(new.inverter_limit, self.__dispatch_inverter_limit)
+
+        return reconnect
 
     def __proxy_on_power_reading(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage, props=None) -> None:
         if self.__on_power_reading is None:
             return
 
         try:
-            value = self.__parser_power_reading(msg.payload)
+            value = self.__parser_power_reading(msg.payload, self.__power_source(msg.topic), bool(msg.retain or msg.dup))
         except Exception as ex:
-            logging.warning(f"customize.parse_power_payload failed: {ex}")
+            logger.warning(f"customize.parse_power_payload failed: {ex}")
             return
 
         self.received_message(msg, "power-reading", value)
@@ -499,6 +981,16 @@ class AppMqttHelper(MetaControlHelper):
         if value is not None:
             self.__on_power_reading(value)
 
+    def __power_source(self, topic: str) -> int:
+        topics = self.config.mqtt.topics
+        if topic == topics.read_power or not topics.read_power_sources:
+            return 0
+
+        for i, source in enumerate(topics.read_power_sources, 1):
+            if topic == source.topic or mqtt.topic_matches_sub(source.topic, topic):
+                return i
+        return 0
+
     def __proxy_on_inverter_status(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage, props=None) -> None:
         if self.__on_inverter_status is None or not self.has_inverter_status:
             return
@@ -506,7 +998,7 @@ class AppMqttHelper(MetaControlHelper):
         try:
             value = self.__parser_inverter_status(msg.payload)
         except Exception as ex:
-            logging.warning(f"Failed to parse inverter status: {ex}")
+            logger.warning(f"Failed to parse inverter status: {ex}")
             return
 
         self.received_message(msg, "inverter-status", value)
@@ -521,7 +1013,7 @@ class AppMqttHelper(MetaControlHelper):
         try:
             value = self.__parser_inverter_power(msg.payload)
         except Exception as ex:
-            logging.warning(f"Failed to parse inverter power: {ex}")
+            logger.warning(f"Failed to parse inverter power: {ex}")
             return
 
         self.received_message(msg, "inverter-power", value)
@@ -529,16 +1021,72 @@ class AppMqttHelper(MetaControlHelper):
         if value is not None:
             self.__on_inverter_power(value)
 
-    def publish_command(self, command: str) -> None:
-        if self.config.mqtt.topics.write_command:
-            r = self.publish(self.config.mqtt.topics.write_command, command, 0, False)
-            logging.info(f"Published command: '{command}', Result: '{r}'")
+    def __proxy_on_inverter_limit(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage, props=None) -> None:
+        if self.__on_inverter_limit is None or not self.has_inverter_limit:
+            return
+
+        try:
+            value = self.__parser_inverter_limit(msg.payload)
+        except Exception as ex:
+            logger.warning(f"Failed to parse inverter limit: {ex}")
+            return
+
+        self.received_message(msg, "inverter-limit", value)
+
+        if value is not None:
+            self.__on_inverter_limit(value)
+
+    def publish_command(self, command: str) -> bool:
+        if not self.config.mqtt.topics.write_command:
+            return False
+
+        qos = self.config.command.qos
+        inflight = self.__cmd_inflight
+
+        # The broker keeps the order of our messages: a newer limit always arrives last. Stop tracking the older one
+        if inflight is not None:
+            self.cmd_superseded += 1
+            logger.info(f"Command '{inflight[1]}' superseded by '{command}' before it was acknowledged")
+            self.__cmd_inflight = None
+
+        props = None
+        if self.config.mqtt.protocol == mqtt.MQTTv5 and self.config.command.message_expiry > 0:
+            props = Properties(PacketTypes.PUBLISH)
+            props.MessageExpiryInterval = self.config.command.message_expiry
+
+        r = self.publish(self.config.mqtt.topics.write_command, command, qos, False, props)
+        logger.info(f"Published command: '{command}', QoS: {qos}, Result: '{r}'")
+
+        if r.rc != mqtt.MQTT_ERR_SUCCESS:
+            return False
+
+        if qos > 0 and not r.is_published():
+            self.__cmd_inflight = (r.mid, command, time.monotonic())
+
+        return True
+
+    def has_command_inflight(self) -> bool:
+        return self.__cmd_inflight is not None
+
+    def __on_publish_ack(self, mid: int) -> None:
+        inflight = self.__cmd_inflight
+        if inflight is None or inflight[0] != mid:
+            return
+
+        self.__cmd_inflight = None
+        elapsed = time.monotonic() - inflight[2]
+        logger.debug(f"Command '{inflight[1]}' acknowledged by broker after {elapsed:.3f}s")
+
+        if self.__on_command_ack is not None:
+            self.__on_command_ack(inflight[1], elapsed)
 
     def subscribe_power_reading(self) -> None:
-        self.subscribe(self.config.mqtt.topics.read_power, 0)
+        for topic in self.config.mqtt.topics.read_power_topics:
+            self.subscribe(topic, 0)
 
     def unsubscribe_power_reading(self) -> None:
-        self.unsubscribe(self.config.mqtt.topics.read_power)
+        for topic in self.config.mqtt.topics.read_power_topics:
+            self.unsubscribe(topic)
 
     def subscribe_inverter_status(self) -> None:
         if self.has_inverter_status and self.config.mqtt.topics.inverter_status:
@@ -556,6 +1104,10 @@ class AppMqttHelper(MetaControlHelper):
         if self.has_inverter_power and self.config.mqtt.topics.inverter_power:
             self.unsubscribe(self.config.mqtt.topics.inverter_power)
 
+    def subscribe_inverter_limit(self) -> None:
+        if self.has_inverter_limit and self.config.mqtt.topics.inverter_limit:
+            self.subscribe(self.config.mqtt.topics.inverter_limit, 0)
+
 class ActionScheduler:
     def __init__(self) -> None:
         self.items = []
@@ -0,0 +1,127 @@
+import logging
+import math
+import sqlite3
+import threading
+import time
+import core.appconfig as appconfig
+from core.limit import LimitCalculatorResult
+from typing import Deque, List, Tuple
+from collections import deque
+
+logger = logging.getLogger("sec.storage")
+
+# Downsampling and retention run at most once per interval
+MAINTENANCE_INTERVAL = 3600
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS readings (ts REAL NOT NULL, reading REAL, sample REAL, overshoot REAL, power_limit REAL, command REAL, flags INTEGER)",
+    "CREATE INDEX IF NOT EXISTS readings_ts ON readings (ts)",
+    "CREATE TABLE IF NOT EXISTS readings_downsampled (ts REAL PRIMARY KEY, count INTEGER, reading_avg REAL, reading_min REAL, reading_max REAL, "
+    "sample_avg REAL, power_limit_avg REAL, commands INTEGER)"
+)
+
+COLUMNS_RAW = ("timestamp", "reading", "sample", "overshoot", "limit", "command", "flags")
+COLUMNS_DOWNSAMPLED = ("timestamp", "count", "reading_avg", "reading_min", "reading_max", "sample_avg", "limit_avg", "commands")
+
+Row = Tuple[float, float, float, float, float, float | None, int]
+
+
+class HistoryStore:
+    """Writes limit results to sqlite. add() only appends to a bounded in memory buffer, a background thread
+    flushes the buffer every flushInterval in one transaction. Raw rows older than rawRetention are folded
+    into downsampleInterval averages, which are deleted after retention"""
+
+    def __init__(self, config: appconfig.HistoryConfig) -> None:
+        self.config: appconfig.HistoryConfig = config
+        self.dropped: int = 0
+        self.__rows: Deque[Row] = deque(maxlen=config.max_buffer)
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name="history", daemon=True)
+        self.__thread.start()
+        logger.info(f"History: Writing to '{config.path}' every {config.flush_interval}s")
+
+    def add(self, timestamp: float, result: LimitCalculatorResult) -> None:
+        row = (timestamp, result.reading, result.sample, result.overshoot, result.limit, result.command, result.flags)
+        with self.__lock:
+            # A full buffer drops the oldest row, the writer fell behind
+            if len(self.__rows) == self.__rows.maxlen:
+                self.dropped += 1
+            self.__rows.append(row)
+
+    def close(self) -> None:
+        self.__stop.set()
+        self.__thread.join()
+
+    def __run(self) -> None:
+        try:
+            conn = connect(self.config.path)
+        except sqlite3.Error as ex:
+            logger.warning(f"History: Failed to open '{self.config.path}': {ex}")
+            return
+
+        next_maintenance = 0.0
+
+        while True:
+            stopping = self.__stop.wait(self.config.flush_interval)
+            self.__flush(conn)
+
+            if stopping:
+                break
+
+            if time.monotonic() >= next_maintenance:
+                self.__maintain(conn)
+                next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL
+
+        conn.close()
+
+    def __flush(self, conn: sqlite3.Connection) -> None:
+        with self.__lock:
+            if not self.__rows:
+                return
+            rows = list(self.__rows)
+            self.__rows.clear()
+
+        try:
+            with conn:
+                conn.executemany("INSERT INTO readings VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error as ex:
+            logger.warning(f"History: Failed to write {len(rows)} rows: {ex}")
+
+    def __maintain(self, conn: sqlite3.Connection) -> None:
+        interval = self.config.downsample_interval
+        # Cut at an interval boundary so no downsampled row is written twice
+        cutoff = math.floor((time.time() - self.config.raw_retention * 3600) / interval) * interval
+
+        try:
+            with conn:
+                conn.execute("INSERT OR IGNORE INTO readings_downsampled "
+                             "SELECT CAST(ts / :i AS INTEGER) * :i AS bucket, COUNT(*), AVG(reading), MIN(reading), MAX(reading), AVG(sample), "
+                             "AVG(power_limit), COUNT(command) FROM readings WHERE ts < :cutoff GROUP BY bucket", {"i": interval, "cutoff": cutoff})
+                conn.execute("DELETE FROM readings WHERE ts < ?", (cutoff,))
+
+                if self.config.retention > 0:
+                    conn.execute("DELETE FROM readings_downsampled WHERE ts < ?", (time.time() - self.config.retention * 86400,))
+        except sqlite3.Error as ex:
+            logger.warning(f"History: Downsampling failed: {ex}")
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    # WAL and relaxed sync: one sequential append per flush instead of rewriting pages (SD cards)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+def query(path: str, start: float, end: float, downsampled: bool = False) -> List[tuple]:
+    """Rows between start and end (unix timestamps), oldest first"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        table = "readings_downsampled" if downsampled else "readings"
+        return conn.execute(f"SELECT * FROM {table} WHERE ts >= ? AND ts < ? ORDER BY ts", (start, end)).fetchall()
+    finally:
+        conn.close()
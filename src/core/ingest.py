@@ -0,0 +1,160 @@
+import logging
+import math
+import core.appconfig as appconfig
+from datetime import datetime, tzinfo
+from typing import Deque, Set
+from collections import deque
+
+logger = logging.getLogger("sec.control")
+
+DEDUPE_TIMESTAMP = "timestamp"
+DEDUPE_HASH = "hash"
+
+POLICY_ALL = "all"
+POLICY_LATEST = "latest"
+POLICY_DECIMATE = "decimate"
+
+
+def to_unix(timestamp: datetime | float | None, zone: tzinfo | None) -> float | None:
+    """Source timestamp as returned by customize.parse_power_timestamp: a datetime without offset is local time of
+    zone (config.reading.timezone), of this host if zone is None"""
+    if isinstance(timestamp, datetime):
+        if timestamp.tzinfo is None and zone is not None:
+            timestamp = timestamp.replace(tzinfo=zone)
+        return timestamp.timestamp()
+
+    return None if timestamp is None else float(timestamp)
+
+
+class IngestStats:
+    __slots__ = ("accepted", "duplicate", "out_of_order", "too_old", "no_timestamp")
+
+    def __init__(self) -> None:
+        self.accepted: int = 0
+        self.duplicate: int = 0
+        self.out_of_order: int = 0
+        self.too_old: int = 0
+        self.no_timestamp: int = 0
+
+    def __str__(self) -> str:
+        return f"Accepted: {self.accepted}, Duplicate: {self.duplicate}, Out of order: {self.out_of_order}, Too old: {self.too_old}, Without timestamp: {self.no_timestamp}"
+
+
+class IngestFilter:
+    """Rejects power readings before they reach the limit calculation: redelivered messages (same source timestamp
+    and payload, or a redelivered payload seen before), readings older than the latest one and readings older than maxAge"""
+
+    def __init__(self, config: appconfig.IngestConfig, name: str = "") -> None:
+        self.config: appconfig.IngestConfig = config
+        self.name: str = name
+        self.stats: IngestStats = IngestStats()
+        self.latest: float | None = None
+        # dedupe hash: the recent payloads. dedupe timestamp: the payloads with the latest timestamp
+        self.__hashes: Deque[int] = deque()
+        self.__hash_set: Set[int] = set()
+
+    @property
+    def needs_timestamp(self) -> bool:
+        return self.config.dedupe == DEDUPE_TIMESTAMP or self.config.max_age > 0 or self.config.reject_out_of_order
+
+    def accept(self, payload: bytes, timestamp: float | None, now: float, redelivered: bool = False) -> bool:
+        """timestamp: source timestamp of the reading (unix), now: wall clock, redelivered: the message is retained or
+        sent again by the broker (mqtt retain or dup flag)"""
+        config = self.config
+        stats = self.stats
+
+        # A steady meter sends the same payload again and again: only a redelivered message can be a duplicate
+        if config.dedupe == DEDUPE_HASH:
+            value = hash(payload)
+            if redelivered and value in self.__hash_set:
+                stats.duplicate += 1
+                logger.debug(f"Ingest '{self.name}': Duplicate payload rejected")
+                return False
+            self.__add_hash(value)
+
+        if timestamp is None:
+            if self.needs_timestamp:
+                stats.no_timestamp += 1
+            stats.accepted += 1
+            return True
+
+        if config.max_age > 0 and now - timestamp > config.max_age:
+            stats.too_old += 1
+            logger.debug(f"Ingest '{self.name}': Reading from {timestamp:.3f} is {now - timestamp:.1f}s old, rejected")
+            return False
+
+        latest = self.latest
+        if latest is not None:
+            # Timestamps of one second resolution repeat with faster meters: a duplicate has the same payload as well
+            if timestamp == latest and config.dedupe == DEDUPE_TIMESTAMP and not self.__add_hash(hash(payload)):
+                stats.duplicate += 1
+                logger.debug(f"Ingest '{self.name}': Duplicate reading from {timestamp:.3f} rejected")
+                return False
+
+            if timestamp < latest and config.reject_out_of_order:
+                stats.out_of_order += 1
+                logger.debug(f"Ingest '{self.name}': Reading from {timestamp:.3f} is older than the latest ({latest:.3f}), rejected")
+                return False
+
+        if latest is None or timestamp > latest:
+            self.latest = timestamp
+            if config.dedupe == DEDUPE_TIMESTAMP:
+                self.__hashes.clear()
+                self.__hash_set.clear()
+                self.__add_hash(hash(payload))
+
+        stats.accepted += 1
+        return True
+
+    def __add_hash(self, value: int) -> bool:
+        """False if the value is one of the last hashWindow values"""
+        if value in self.__hash_set:
+            return False
+
+        self.__hashes.append(value)
+        self.__hash_set.add(value)
+        if len(self.__hashes) > self.config.hash_window:
+            self.__hash_set.discard(self.__hashes.popleft())
+        return True
+
+    def log_stats(self) -> None:
+        logger.info(f"Ingest '{self.name}' -> {self.stats}")
+
+
+class IngestPolicy:
+    """Decides which readings run the full path (limit, telemetry, command). The others are only folded into the
+    smoothing window. latest: the first reading after interval elapsed, i.e. the latest one at that time.
+    decimate: every n-th reading, starting with the first"""
+
+    def __init__(self, config: appconfig.IngestConfig) -> None:
+        self.config: appconfig.IngestConfig = config
+        self.processed: int = 0
+        self.folded: int = 0
+        self.__next: float = -math.inf
+        self.__count: int = 0
+
+    def due(self, now: float) -> bool:
+        config = self.config
+        if config.policy == POLICY_LATEST:
+            due = now >= self.__next
+            if due:
+                self.__next = now + config.interval
+        elif config.policy == POLICY_DECIMATE:
+            due = self.__count == 0
+            self.__count = (self.__count + 1) % config.decimate
+        else:
+            due = True
+
+        if due:
+            self.processed += 1
+        else:
+            self.folded += 1
+        return due
+
+    def reset(self) -> None:
+        """The next reading is processed"""
+        self.__next = -math.inf
+        self.__count = 0
+
+    def log_stats(self) -> None:
+        logger.info(f"Ingest policy '{self.config.policy}' -> Processed: {self.processed}, Folded: {self.folded}")
@@ -0,0 +1,124 @@
+import logging
+import core.appconfig as appconfig
+
+logger = logging.getLogger("sec.control")
+
+SECONDS_PER_HOUR = 3600
+
+
+class ControlKpi:
+    """Control quality, updated in constant time per reading. Between two readings the grid power is taken as a
+    straight line over their receive times:
+    - export / import: trapezoidal energy in Wh, split where the line crosses zero
+    - above target: seconds with the grid power (reading + reading.offset) above command.target
+    - commands per hour: commands of the current publish interval
+    - settling time: from a load step (the distance to target grows by stepThreshold from one reading to the next)
+      until the grid power is within settleBand of target again. Steps not settled within settleTimeout are dropped.
+    Gaps longer than maxGap (inactive, meter silent) are not integrated"""
+
+    def __init__(self, config: appconfig.AppConfig, now: float) -> None:
+        self.export_wh: float = 0.0
+        self.import_wh: float = 0.0
+        self.above_target: float = 0.0
+        self.commands: int = 0
+        self.settled: int = 0
+        self.unsettled: int = 0
+        self.settle_total: float = 0.0
+        self.__period_start: float = now
+        self.__period_commands: int = 0
+        self.__last_time: float | None = None
+        self.__last_reading: float = 0.0
+        self.__last_error: float = 0.0
+        self.__step_start: float | None = None
+        self.apply_config(config)
+
+    def apply_config(self, config: appconfig.AppConfig) -> None:
+        kpi = config.kpi
+        self.__target: float = config.command.target
+        self.__offset: float = config.reading.offset
+        self.__step_threshold: float = kpi.step_threshold
+        self.__settle_band: float = kpi.settle_band
+        self.__settle_timeout: float = kpi.settle_timeout
+        self.__max_gap: float = kpi.max_gap
+
+    @property
+    def settling_time(self) -> float | None:
+        """Average settling time in seconds, None before the first settled step"""
+        return self.settle_total / self.settled if self.settled else None
+
+    def add_reading(self, reading: float, now: float) -> None:
+        """reading: grid power as parsed (negative = export), now: receive time (monotonic)"""
+        error = self.__offset + reading - self.__target
+        last_time = self.__last_time
+
+        if last_time is not None and 0 < now - last_time <= self.__max_gap:
+            dt = now - last_time
+            a = self.__last_reading
+            e = self.__last_error
+
+            if a >= 0 and reading >= 0:
+                self.import_wh += (a + reading) * dt / (2 * SECONDS_PER_HOUR)
+            elif a <= 0 and reading <= 0:
+                self.export_wh -= (a + reading) * dt / (2 * SECONDS_PER_HOUR)
+            else:
+                # Sign change: two triangles on both sides of the zero crossing
+                t0 = dt * a / (a - reading)
+                if a > 0:
+                    self.import_wh += a * t0 / (2 * SECONDS_PER_HOUR)
+                    self.export_wh -= reading * (dt - t0) / (2 * SECONDS_PER_HOUR)
+                else:
+                    self.export_wh -= a * t0 / (2 * SECONDS_PER_HOUR)
+                    self.import_wh += reading * (dt - t0) / (2 * SECONDS_PER_HOUR)
+
+            if e > 0 and error > 0:
+                self.above_target += dt
+            elif e > 0 or error > 0:
+                # The share of the interval on the positive side of the crossing
+                self.above_target += dt * max(e, error) / abs(error - e)
+
+            self.__track_step(abs(e), abs(error), now)
+
+        self.__last_time = now
+        self.__last_reading = reading
+        self.__last_error = error
+
+    def add_command(self) -> None:
+        self.commands += 1
+        self.__period_commands += 1
+
+    def end_period(self, now: float) -> float:
+        """Commands per hour since the last call, starts the next publish interval"""
+        elapsed = now - self.__period_start
+        rate = self.__period_commands * SECONDS_PER_HOUR / elapsed if elapsed > 0 else 0.0
+        self.__period_start = now
+        self.__period_commands = 0
+        return rate
+
+    def reset(self) -> None:
+        """Inactive until now: the next reading starts a new line, a running step is dropped"""
+        self.__last_time = None
+        self.__step_start = None
+
+    def __track_step(self, last_distance: float, distance: float, now: float) -> None:
+        step_start = self.__step_start
+
+        if step_start is None:
+            # Commands move the grid power towards the target, a load step moves it away
+            if distance - last_distance >= self.__step_threshold and distance > self.__settle_band:
+                self.__step_start = now
+        elif distance <= self.__settle_band:
+            self.settled += 1
+            self.settle_total += now - step_start
+            self.__step_start = None
+        elif now - step_start > self.__settle_timeout:
+            # Beyond the inverter range (limit at min or max power) the target is out of reach
+            self.unsettled += 1
+            self.__step_start = None
+
+    def __str__(self) -> str:
+        settling = self.settling_time
+        return (f"Export: {self.export_wh:.1f} Wh, Import: {self.import_wh:.1f} Wh, Above target: {self.above_target:.0f}s, "
+                f"Commands: {self.commands}, Settled: {self.settled} (avg {settling if settling is not None else 0:.1f}s), Unsettled: {self.unsettled}")
+
+    def log_stats(self) -> None:
+        logger.info(f"KPI -> {self}")
@@ -1,21 +1,39 @@
+import copy
 import logging
-import statistics
+import math
+import time
+import itertools
 import core.appconfig as appconfig
-import config.customize as customize
-from typing import Deque, Callable, Tuple
+from core.ratelimit import TOKEN_TOLERANCE, TokenBucket
+from core.predict import TrendPredictor
+from typing import Deque, Sequence
 from collections import deque
-from datetime import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger("sec.control")
 
 # target: configured power target (config.command.target)
 # reading: parsed value from mqtt read power topic
-# sample: reading with applied smoothing if turned on
+# sample: reading with applied smoothing if turned on, projected by config.reading.predictionHorizon if turned on
 # overshoot: absolute difference between target and sample
 # limit: overshoot + previous limit, capped to command_min and command_max
 # command: value of limit in watts or percent, decided by config.command.type
+# tokens: commands left in the throttle token bucket of the direction (config.command.decrease / config.command.increase),
+#         one bucket serves both directions if their throttle and burst are equal
+# decrease: the limit goes down (export), decided on the decrease smoothing window. Otherwise the increase window is used
 
 class LimitCalculatorResult:
+    # One instance per reading: slots avoid the per instance __dict__
+    __slots__ = ("reading", "sample", "overshoot", "limit", "command", "is_calibration", "is_throttled",
+                 "is_hysteresis_suppressed", "is_retransmit", "elapsed", "is_urgent", "tokens", "is_decrease")
+
     def __init__(self, reading: float, sample: float, overshoot: float, limit: float, command: float | None,
-                 is_calibration: bool, is_throttled: bool, is_hysteresis_suppressed: bool, is_retransmit: bool, elapsed: float) -> None:
+                 is_calibration: bool, is_throttled: bool, is_hysteresis_suppressed: bool, is_retransmit: bool, elapsed: float,
+                 is_urgent: bool = False, tokens: float = 0.0, is_decrease: bool = False) -> None:
         self.reading: float = reading
         self.sample: float = sample
         self.overshoot: float = overshoot
@@ -26,132 +44,588 @@ class LimitCalculatorResult:
         self.is_hysteresis_suppressed: bool = is_hysteresis_suppressed
         self.is_retransmit: bool = is_retransmit
         self.elapsed: float = elapsed
-       
+        self.is_urgent: bool = is_urgent
+        self.tokens: float = tokens
+        self.is_decrease: bool = is_decrease
+
+    @property
+    def flags(self) -> int:
+        """The is_* fields as FLAG_* bits, like LimitCalculatorBatch.flags"""
+        return ((FLAG_CALIBRATION if self.is_calibration else 0) | (FLAG_THROTTLED if self.is_throttled else 0) |
+                (FLAG_HYSTERESIS_SUPPRESSED if self.is_hysteresis_suppressed else 0) | (FLAG_RETRANSMIT if self.is_retransmit else 0) |
+                (FLAG_URGENT if self.is_urgent else 0) | (FLAG_DECREASE if self.is_decrease else 0))
+
+
+# Bits of LimitCalculatorBatch.flags
+FLAG_CALIBRATION = 1
+FLAG_THROTTLED = 2
+FLAG_HYSTERESIS_SUPPRESSED = 4
+FLAG_RETRANSMIT = 8
+FLAG_URGENT = 16
+FLAG_DECREASE = 32
+# Recording only: folded into the window without a decision (config.ingest.policy)
+FLAG_FOLDED = 64
+
+
+class LimitCalculatorBatch:
+    """Columnar results of LimitCalculator.add_readings, one row per reading. Columns are numpy arrays if numpy
+    is installed, lists otherwise. Rows without command have NaN as command"""
+    __slots__ = ("timestamps", "reading", "sample", "overshoot", "limit", "command", "flags", "tokens", "elapsed")
+
+    def __init__(self, timestamps, reading, sample, overshoot, limit, command, flags, tokens, elapsed) -> None:
+        self.timestamps = timestamps
+        self.reading = reading
+        self.sample = sample
+        self.overshoot = overshoot
+        self.limit = limit
+        self.command = command
+        self.flags = flags
+        self.tokens = tokens
+        self.elapsed = elapsed
+
+    def __len__(self) -> int:
+        return len(self.reading)
+
+
+class LimitDirectionStats:
+    def __init__(self) -> None:
+        self.readings: int = 0
+        self.commands: int = 0
+        self.throttled: int = 0
+        self.suppressed: int = 0
+        self.urgent: int = 0
+
+    def __str__(self) -> str:
+        return f"Readings: {self.readings}, Commands: {self.commands}, Throttled: {self.throttled}, Suppressed: {self.suppressed}, Urgent: {self.urgent}"
+
 
 class LimitCalculator:
     def __init__(self, config: appconfig.AppConfig) -> None:
         self.config: appconfig.AppConfig = config
-        self.last_command_time: datetime = datetime.min
+        self.last_command_time: float = -math.inf
         self.last_limit_value: float = config.command.min_power
         self.last_limit_has: bool = False
         self.is_calibrated: bool = False
+        self.__samples: Deque[float] = deque([], maxlen=1)
+        self.__sums: Deque[float] = deque([0.0], maxlen=2)
+        now = time.monotonic()
+        self.bucket_decrease: TokenBucket = TokenBucket(0, config.command.decrease.burst, now)
+        self.bucket_increase: TokenBucket = TokenBucket(0, config.command.increase.burst, now)
+        self.stats_decrease: LimitDirectionStats = LimitDirectionStats()
+        self.stats_increase: LimitDirectionStats = LimitDirectionStats()
+        self.predictor: TrendPredictor = TrendPredictor(config.reading.predictionSampleSize)
+        self.__response_time: float | None = None
+        self.__load_config(config)
+
+    def __load_config(self, config: appconfig.AppConfig) -> None:
+        self.config = config
         self.limit_max: float = config.command.max_power
         self.limit_min: float = config.command.min_power
         self.limit_default: float = config.command.default_limit
 
-        deqSize: int = self.config.reading.smoothingSampleSize if self.config.reading.smoothingSampleSize > 0 else 1
+        # Hoisted for add_reading: avoids attribute chains on every reading
+        self.__target: float = config.command.target
+        self.__retransmit: int = config.command.retransmit
+        self.__urgent_threshold: float = config.command.urgent_threshold
+        self.__hysteresis_decrease: float = config.command.decrease.hysteresis
+        self.__hysteresis_increase: float = config.command.increase.hysteresis
+        self.__relative: bool = config.command.type == appconfig.InverterCommandType.RELATIVE
 
-        sampleFunc: Callable[[float], float]
-        if self.config.reading.smoothing == appconfig.PowerReadingSmoothingType.AVG:
-            sampleFunc = self.__get_smoothing_avg
+        # A learned response time outlives a reload, unless the adaptive throttle was turned off
+        if not config.command.adaptive_throttle.enabled:
+            self.__response_time = None
+        self.__configure_throttle()
+
+        self.__offset: float = config.reading.offset
+        self.predictor.resize(config.reading.predictionSampleSize)
+
+        self.__smoothing: bool = config.reading.smoothing == appconfig.PowerReadingSmoothingType.AVG
+        if self.__smoothing:
+            self.__size_decrease: int = max(1, config.reading.smoothingSampleSizeDecrease)
+            self.__size_increase: int = max(1, config.reading.smoothingSampleSizeIncrease)
+            self.__get_sample = self.__get_smoothing_avg
         else:
-            sampleFunc = self.__get_smoothing_none
-            deqSize = 1
+            self.__size_decrease = 1
+            self.__size_increase = 1
+            self.__get_sample = self.__get_smoothing_none
+
+        # One window serves both directions. Keep the most recent samples if the window shrinks
+        self.__samples = deque(self.__samples, maxlen=max(self.__size_decrease, self.__size_increase))
+        self.__rebuild_sums()
+
+    def apply_config(self, config: appconfig.AppConfig) -> None:
+        old = self.config
+        offset_delta = config.reading.offset - old.reading.offset
+        self.__load_config(config)
 
-        if self.config.reading.offset != 0:
-            self.__sampleReading = lambda x: sampleFunc(self.config.reading.offset + x)
+        # Samples already contain the old offset
+        if offset_delta != 0:
+            self.__samples = deque((x + offset_delta for x in self.__samples), maxlen=self.__samples.maxlen)
+            self.__rebuild_sums()
+            self.predictor.clear()
+
+        if self.last_limit_has:
+            self.last_limit_value = self.__cap_limit(self.last_limit_value)
+
+        # The inverter must receive a fresh command if the meaning of a command has changed
+        if old.command.type != config.command.type or old.command.min_power != config.command.min_power or old.command.max_power != config.command.max_power:
+            self.is_calibrated = False
+
+        logger.debug("Limit context was reconfigured")
+
+    def set_response_time(self, delay: float) -> float | None:
+        """Scales the throttles to the measured inverter response time and uses it as prediction horizon.
+        Returns the throttle of the faster direction, None if the adaptive throttle is turned off"""
+        self.__response_time = delay
+        return self.__configure_throttle()
+
+    def __configure_throttle(self) -> float | None:
+        command = self.config.command
+        adaptive = command.adaptive_throttle
+        decrease, increase = command.decrease, command.increase
+        throttle_decrease = decrease.throttle
+        throttle_increase = increase.throttle
+        horizon = self.config.reading.predictionHorizon
+        learned = None
+
+        if self.__response_time is not None and adaptive.enabled:
+            learned = max(adaptive.min, min(adaptive.max, self.__response_time))
+            base = min((t for t in (throttle_decrease, throttle_increase) if t > 0), default=0)
+
+            if base > 0:
+                # The faster direction follows the response time, the other one keeps its ratio. Unthrottled stays unthrottled
+                throttle_decrease, throttle_increase = (max(adaptive.min, min(adaptive.max, t * learned / base)) if t > 0 else 0
+                                                        for t in (throttle_decrease, throttle_increase))
+            else:
+                throttle_decrease = throttle_increase = learned
+
+            if horizon > 0:
+                horizon = learned
+
+        # Sustained rate: one command per throttle interval
+        now = time.monotonic()
+        self.bucket_decrease.configure(1 / throttle_decrease if throttle_decrease > 0 else 0, decrease.burst, now)
+
+        # Without differing command.decrease / command.increase both directions take from one bucket: the throttle stays
+        # the minimum interval between any two commands
+        if (decrease.throttle, decrease.burst) == (increase.throttle, increase.burst):
+            self.bucket_increase = self.bucket_decrease
         else:
-            self.__sampleReading = sampleFunc
+            if self.bucket_increase is self.bucket_decrease:
+                self.bucket_increase = copy.copy(self.bucket_decrease)
+            self.bucket_increase.configure(1 / throttle_increase if throttle_increase > 0 else 0, increase.burst, now)
 
-        self.__samples: Deque[float] = deque([], maxlen=deqSize)
+        self.__prediction_horizon: float = horizon
+        return learned
 
     def set_last_limit(self, limit: float) -> None:
         self.last_limit_value = float(limit)
         self.last_limit_has = True
 
-    def add_reading(self, reading: float) -> LimitCalculatorResult:
-        r = self.__add_reading(reading)
-        self.__log_result(r)
+    def observe_reading(self, reading: float, now: float) -> None:
+        """Standby and readings folded by the ingest policy: keeps the smoothing window and the trend current without
+        deciding a limit"""
+        value = self.__offset + reading
+        self.__samples.append(value)
+        self.__sums.append(self.__sums[-1] + value)
+
+        if self.__prediction_horizon > 0:
+            if now < self.last_command_time + self.__prediction_horizon:
+                self.predictor.clear()
+            else:
+                self.predictor.add(now, value)
+
+    def is_urgent(self, reading: float) -> bool:
+        """The reading alone exceeds the urgent threshold, it must not wait for the ingest policy"""
+        return self.__urgent_threshold > 0 and self.__target - (self.__offset + reading) >= self.__urgent_threshold
+
+    def mirror_command(self, command: float, now: float) -> None:
+        """Standby: takes over a command of the leader as if it was decided here (last limit, throttle, calibration)"""
+        limit = self.__cap_limit(command * self.limit_max / 100 if self.__relative else command)
+        bucket = self.bucket_decrease if self.last_limit_has and limit < self.last_limit_value else self.bucket_increase
+        bucket.take(now)
+        self.last_command_time = now
+        self.set_last_limit(limit)
+        self.is_calibrated = True
+
+    def add_reading(self, reading: float, now: float | None = None) -> LimitCalculatorResult:
+        r = self.__add_reading(reading, time.monotonic() if now is None else now)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            self.__log_result(r)
+
         return r
 
-    def __add_reading(self, reading: float) -> LimitCalculatorResult:
+    def __add_reading(self, reading: float, now: float) -> LimitCalculatorResult:
         is_calibration = not self.is_calibrated
         is_throttled = False
         is_hysteresis_suppressed = False
         is_retransmit = False
+        is_urgent = False
+
+        value = self.__offset + reading
+        self.__samples.append(value)
+        self.__sums.append(self.__sums[-1] + value)
+
+        # Feed forward: project the sample by the trend over the time the inverter needs to react.
+        # Readings before the last command took effect contain our own step response, not the load trend
+        shift = 0.0
+        if self.__prediction_horizon > 0:
+            if now < self.last_command_time + self.__prediction_horizon:
+                self.predictor.clear()
+            else:
+                self.predictor.add(now, value)
+                shift = self.predictor.slope() * self.__prediction_horizon
 
-        sample = self.__sampleReading(reading)
-        
         if not self.last_limit_has:     
             self.set_last_limit(self.limit_max)    
-                
-        elapsed = round((datetime.now() - self.last_command_time).total_seconds(), 2)
-        overshoot = self.__convert_reading_to_relative_overshoot(sample)
-        limit = self.__convert_overshoot_to_limit(self.last_limit_value, overshoot)
+
+        last_limit = self.last_limit_value
+        limit_min = self.limit_min
+        limit_max = self.limit_max
+
+        # Fast path first: a decrease (export) is decided on the decrease window
+        sample = self.__get_sample(self.__size_decrease) + shift
+        overshoot = sample - self.__target
+        limit = max(limit_min, min(limit_max, last_limit + overshoot))
+        is_decrease = limit < last_limit
+
+        if not is_decrease and self.__size_increase != self.__size_decrease:
+            sample = self.__get_sample(self.__size_increase) + shift
+            overshoot = sample - self.__target
+            limit = max(last_limit, limit_min, min(limit_max, last_limit + overshoot))
+
+        if is_decrease:
+            hysteresis = self.__hysteresis_decrease
+            bucket = self.bucket_decrease
+            stats = self.stats_decrease
+        else:
+            hysteresis = self.__hysteresis_increase
+            bucket = self.bucket_increase
+            stats = self.stats_increase
+
+        stats.readings += 1
+        elapsed = round(now - self.last_command_time, 2)
         
         # Ignore conditions on calibration
         if not is_calibration:
 
+            # Export above target exceeds the urgent threshold: skip the token bucket
+            if is_decrease and self.__urgent_threshold > 0 and -overshoot >= self.__urgent_threshold:
+                is_urgent = True
+                stats.urgent += 1
+
             # Check if command must be throttled
-            if elapsed < self.config.command.throttle:
+            if not is_urgent and not bucket.available(now):
                 is_throttled = True
+                stats.throttled += 1
 
             # Ignore hysteresis when retransmit > elapsed
-            elif self.config.command.retransmit > 0 and elapsed >= self.config.command.retransmit:
+            elif self.__retransmit > 0 and elapsed >= self.__retransmit:
                 is_retransmit = True
 
             # Check for hysteresis
-            elif not self.__hysteresis_threshold_breached(limit):
+            elif not self.__hysteresis_threshold_breached(limit, hysteresis):
                 is_hysteresis_suppressed = True
+                stats.suppressed += 1
 
         command: float | None = None
 
         if not (is_throttled or is_hysteresis_suppressed):
-            command = self.__convert_to_command(limit)
-            self.last_command_time = datetime.now()           
-            self.set_last_limit(limit)
+            command = (limit / limit_max) * 100 if self.__relative else limit
+            self.last_command_time = now
+            bucket.take(now)
+            stats.commands += 1
+            self.last_limit_value = limit
+            self.last_limit_has = True
 
             if is_calibration:
                 self.is_calibrated = True
 
-        return LimitCalculatorResult(reading=reading,
-                                     sample=sample,
-                                     overshoot=overshoot,
-                                     limit=limit,
-                                     command=command,
-                                     is_calibration=is_calibration,
-                                     is_throttled=is_throttled,
-                                     is_hysteresis_suppressed=is_hysteresis_suppressed,
-                                     is_retransmit=is_retransmit,
-                                     elapsed=elapsed)
+        return LimitCalculatorResult(reading, sample, overshoot, limit, command, is_calibration, is_throttled,
+                                     is_hysteresis_suppressed, is_retransmit, elapsed, is_urgent, bucket.tokens, is_decrease)
+
+    def add_readings(self, timestamps: Sequence[float], values: Sequence[float]) -> LimitCalculatorBatch:
+        """Batch variant of add_reading for backtesting and tuning: same state, same results.
+        Offset, window means, overshoot and the limit column are computed over the whole array with numpy. Only the
+        decisions run as a loop: throttle, retransmit and hysteresis depend on the previous command, and so does the
+        prediction. Without numpy the readings are added one by one"""
+        if len(timestamps) != len(values):
+            raise ValueError(f"LimitCalculator: timestamps and values differ in length: {len(timestamps)} != {len(values)}")
+
+        if numpy is None:
+            return self.__add_readings_scalar(timestamps, values)
+
+        if not self.last_limit_has:
+            self.set_last_limit(self.limit_max)
+
+        times = numpy.asarray(timestamps, dtype=float)
+        readings = numpy.asarray(values, dtype=float)
+        count = len(readings)
+        first = len(self.__samples)
+        shifted = self.__offset + readings
+
+        # Continues the prefix sums of the window, cumsum adds left to right like __add_reading
+        prefix = numpy.concatenate((numpy.fromiter(self.__sums, dtype=float, count=first + 1),
+                                    numpy.cumsum(numpy.concatenate(([self.__sums[-1]], shifted)))[1:]))
+        split = self.__size_increase != self.__size_decrease
+        if self.__smoothing:
+            means_decrease = self.__window_means(prefix, first, count, self.__size_decrease)
+            means_increase = self.__window_means(prefix, first, count, self.__size_increase) if split else means_decrease
+        else:
+            means_decrease = means_increase = shifted
+
+        # Without prediction the shift is 0.0, added anyway like in __add_reading
+        target = self.__target
+        shifts = numpy.zeros(count)
+        samples_decrease = means_decrease + shifts
+        samples_increase = means_increase + shifts if split else samples_decrease
+        over_decrease = samples_decrease - target
+        over_increase = samples_increase - target
+
+        limit_min = self.limit_min
+        limit_max = self.limit_max
+        first_limit = last_limit = self.last_limit_value
+        first_command_time = last_command_time = self.last_command_time
+        is_calibrated = self.is_calibrated
+        retransmit = self.__retransmit
+        urgent_threshold = self.__urgent_threshold
+        hysteresis_decrease = self.__hysteresis_decrease
+        hysteresis_increase = self.__hysteresis_increase
+        horizon = self.__prediction_horizon
+        predictor = self.predictor
+
+        # The buckets live in locals during the loop. Every reading refills the bucket of its direction: throttle
+        # check, or take for calibration and urgent commands. A shared bucket is kept alike in both
+        shared = self.bucket_increase is self.bucket_decrease
+        ready = 1 - TOKEN_TOLERANCE
+        rate_decrease, burst_decrease = self.bucket_decrease.rate, float(self.bucket_decrease.burst)
+        tokens_decrease, stamp_decrease = self.bucket_decrease.tokens, self.bucket_decrease.stamp
+        rate_increase, burst_increase = self.bucket_increase.rate, float(self.bucket_increase.burst)
+        tokens_increase, stamp_increase = self.bucket_increase.tokens, self.bucket_increase.stamp
+
+        times_list = times.tolist()
+        if horizon > 0:
+            shifted_list = shifted.tolist()
+            means_decrease_list = means_decrease.tolist()
+            means_increase_list = means_increase.tolist()
+        over_decrease_list = over_decrease.tolist()
+        over_increase_list = over_increase.tolist() if split else over_decrease_list
+        out_flags = [0] * count
+        out_tokens = [0.0] * count
+        out_shifts = [0.0] * count if horizon > 0 else None
+        command_limits = []
+
+        # Mirrors __add_reading and TokenBucket, keep all three in sync
+        for i in range(count):
+            now = times_list[i]
+
+            if horizon > 0:
+                shift = 0.0
+                if now < last_command_time + horizon:
+                    predictor.clear()
+                else:
+                    predictor.add(now, shifted_list[i])
+                    shift = predictor.slope() * horizon
+                out_shifts[i] = shift
+                overshoot = (means_decrease_list[i] + shift) - target
+            else:
+                overshoot = over_decrease_list[i]
+
+            # Capped without the min/max builtins, same values
+            limit = last_limit + overshoot
+            if limit > limit_max:
+                limit = limit_max
+            if limit < limit_min:
+                limit = limit_min
+
+            if limit < last_limit:
+                flags = FLAG_DECREASE
+                hysteresis = hysteresis_decrease
+                if rate_decrease <= 0:
+                    tokens_decrease = burst_decrease
+                elif now > stamp_decrease:
+                    tokens = tokens_decrease + (now - stamp_decrease) * rate_decrease
+                    tokens_decrease = tokens if tokens < burst_decrease else burst_decrease
+                stamp_decrease = now
+                tokens = tokens_decrease
+                if shared:
+                    tokens_increase, stamp_increase = tokens, now
+                is_urgent = urgent_threshold > 0 and -overshoot >= urgent_threshold
+            else:
+                flags = 0
+                hysteresis = hysteresis_increase
+                if rate_increase <= 0:
+                    tokens_increase = burst_increase
+                elif now > stamp_increase:
+                    tokens = tokens_increase + (now - stamp_increase) * rate_increase
+                    tokens_increase = tokens if tokens < burst_increase else burst_increase
+                stamp_increase = now
+                tokens = tokens_increase
+                if shared:
+                    tokens_decrease, stamp_decrease = tokens, now
+                is_urgent = False
+
+                if split:
+                    if horizon > 0:
+                        overshoot = (means_increase_list[i] + shift) - target
+                    else:
+                        overshoot = over_increase_list[i]
+                    limit = last_limit + overshoot
+                    if limit > limit_max:
+                        limit = limit_max
+                    if limit < limit_min:
+                        limit = limit_min
+                    if limit < last_limit:
+                        limit = last_limit
+
+            if not is_calibrated:
+                flags |= FLAG_CALIBRATION
+            elif is_urgent:
+                flags |= FLAG_URGENT
+            elif tokens < ready:
+                out_flags[i] = flags | FLAG_THROTTLED
+                out_tokens[i] = tokens
+                continue
+            elif retransmit > 0 and round(now - last_command_time, 2) >= retransmit:
+                flags |= FLAG_RETRANSMIT
+            elif not (hysteresis == 0 or (limit == limit_max and last_limit != limit) or abs(last_limit - limit) >= hysteresis):
+                out_flags[i] = flags | FLAG_HYSTERESIS_SUPPRESSED
+                out_tokens[i] = tokens
+                continue
+
+            tokens = tokens - 1 if tokens > 1 else 0.0
+            if shared:
+                tokens_decrease = tokens_increase = tokens
+            elif flags & FLAG_DECREASE:
+                tokens_decrease = tokens
+            else:
+                tokens_increase = tokens
+            last_command_time = now
+            last_limit = limit
+            is_calibrated = True
+            command_limits.append(limit)
+            out_flags[i] = flags
+            out_tokens[i] = tokens
+
+        self.bucket_decrease.tokens, self.bucket_decrease.stamp = tokens_decrease, stamp_decrease
+        self.bucket_increase.tokens, self.bucket_increase.stamp = tokens_increase, stamp_increase
+        self.last_limit_value = last_limit
+        self.last_command_time = last_command_time
+        self.is_calibrated = is_calibrated
+        # Only the last window is kept
+        window = self.__samples.maxlen
+        self.__samples.extend(shifted[-window:].tolist())
+        self.__sums.extend(prefix[first + 1:][-window:].tolist())
+
+        flags = numpy.array(out_flags, dtype=numpy.uint8)
+        decrease = (flags & FLAG_DECREASE) != 0
+        commanded = (flags & (FLAG_THROTTLED | FLAG_HYSTERESIS_SUPPRESSED)) == 0
+
+        if horizon > 0:
+            shifts = numpy.array(out_shifts)
+            samples_decrease = means_decrease + shifts
+            samples_increase = means_increase + shifts if split else samples_decrease
+            over_decrease = samples_decrease - target
+            over_increase = samples_increase - target
+
+        # Limit and time of the last command before each reading
+        before = numpy.cumsum(commanded) - commanded
+        last_limits = numpy.concatenate(([first_limit], command_limits))[before]
+        last_times = numpy.concatenate(([first_command_time], times[commanded]))[before]
+
+        limits = numpy.maximum(limit_min, numpy.minimum(limit_max, last_limits + over_decrease))
+        samples = samples_decrease
+        overshoots = over_decrease
+        if split:
+            limits_increase = numpy.maximum(last_limits, numpy.maximum(limit_min, numpy.minimum(limit_max, last_limits + over_increase)))
+            limits = numpy.where(decrease, limits, limits_increase)
+            samples = numpy.where(decrease, samples_decrease, samples_increase)
+            overshoots = numpy.where(decrease, over_decrease, over_increase)
+
+        commands = numpy.full(count, math.nan)
+        commands[commanded] = (limits[commanded] / limit_max) * 100 if self.__relative else limits[commanded]
+        # numpy.round rounds the value times 100, round() the exact binary value: both only differ next to a tie
+        elapsed_raw = times - last_times
+        elapsed = numpy.round(elapsed_raw, 2)
+        with numpy.errstate(invalid="ignore"):
+            ties = numpy.flatnonzero(numpy.abs(numpy.abs(elapsed_raw * 100) % 1 - 0.5) < 1e-6)
+        elapsed[ties] = [round(x, 2) for x in elapsed_raw[ties].tolist()]
+
+        for stats, mask in ((self.stats_decrease, decrease), (self.stats_increase, ~decrease)):
+            stats.readings += int(numpy.count_nonzero(mask))
+            stats.commands += int(numpy.count_nonzero(mask & commanded))
+            stats.throttled += int(numpy.count_nonzero(mask & ((flags & FLAG_THROTTLED) != 0)))
+            stats.suppressed += int(numpy.count_nonzero(mask & ((flags & FLAG_HYSTERESIS_SUPPRESSED) != 0)))
+            stats.urgent += int(numpy.count_nonzero(mask & ((flags & FLAG_URGENT) != 0)))
+
+        return LimitCalculatorBatch(times, readings, samples, overshoots, limits, commands, flags,
+                                    numpy.array(out_tokens), elapsed)
+
+    def __add_readings_scalar(self, timestamps: Sequence[float], values: Sequence[float]) -> LimitCalculatorBatch:
+        columns = ([], [], [], [], [], [], [], [], [])
+
+        for t, v in zip(timestamps, values):
+            r = self.__add_reading(float(v), float(t))
+            for column, value in zip(columns, (float(t), r.reading, r.sample, r.overshoot, r.limit,
+                                               math.nan if r.command is None else r.command, r.flags, r.tokens, r.elapsed)):
+                column.append(value)
+
+        return LimitCalculatorBatch(*columns)
+
+    @staticmethod
+    def __window_means(prefix, first: int, count: int, size: int):
+        """Window averages of the new samples: the same prefix sum differences as __get_smoothing_avg"""
+        ends = numpy.arange(first + 1, first + 1 + count)
+        # Window not yet filled: averaged over the available samples
+        sizes = numpy.minimum(ends, size)
+        return (prefix[ends] - prefix[ends - sizes]) / sizes
 
     def get_command_default(self) -> float:
         return self.__convert_to_command(self.limit_default)
 
     def reset(self) -> None:
         self.__samples.clear()
-        self.last_command_time: datetime = datetime.min
+        self.__rebuild_sums()
+        self.predictor.clear()
+        self.last_command_time = -math.inf
+        self.bucket_decrease.reset(time.monotonic())
+        self.bucket_increase.reset(time.monotonic())
         self.last_limit_value: float = self.config.command.min_power
         self.last_limit_has: bool = False
         self.is_calibrated: bool = False
-        logging.debug("Limit context was reseted")
+        logger.debug("Limit context was reseted")
 
-    def __get_smoothing_avg(self, reading: float) -> float:
-        self.__samples.append(reading)
-        return statistics.mean(self.__samples)
+    def __get_smoothing_avg(self, size: int) -> float:
+        # O(1) for any window: difference of two prefix sums, add_readings computes the same differences
+        sums = self.__sums
+        size = min(size, len(sums) - 1)
+        return (sums[-1] - sums[-1 - size]) / size
 
-    def __get_smoothing_none(self, reading: float) -> float:
-        self.__samples.append(reading)
-        return self.__samples[0]
+    def __get_smoothing_none(self, size: int) -> float:
+        return self.__samples[-1]
 
-    def __convert_reading_to_relative_overshoot(self, reading: float) -> float:
-        return (self.config.command.target - reading) * -1
+    def __rebuild_sums(self) -> None:
+        # sums[k] - sums[j] is the sum of samples j..k-1. The values grow with the time since the last rebuild (reset,
+        # config change), their rounding error stays far below a watt
+        self.__sums = deque(itertools.accumulate(self.__samples, initial=0.0), maxlen=self.__samples.maxlen + 1)
 
-    def __convert_overshoot_to_limit(self, base: float, overshoot: float) -> float:
-        return self.__cap_limit(base + overshoot)
+    def log_stats(self) -> None:
+        logger.info(f"Decrease -> {self.stats_decrease}")
+        logger.info(f"Increase -> {self.stats_increase}")
 
-    def __hysteresis_threshold_breached(self, limit: float) -> bool:
-        if self.config.command.hysteresis == 0:
+    def __hysteresis_threshold_breached(self, limit: float, hysteresis: float) -> bool:
+        if hysteresis == 0:
             # Hysteresis disabled, always use new limit
             return True
         elif limit == self.limit_max and self.last_limit_value != limit:
             # Ignore hysteresis threshold value if limit is max and the last limit is not max. Otherwise a limit of 99% may never returns to 100%.
             return True
         else:
-            return abs(self.last_limit_value - limit) >= self.config.command.hysteresis
+            return abs(self.last_limit_value - limit) >= hysteresis
 
     def __convert_to_command(self, limit: float) -> float:
-        if self.config.command.type == appconfig.InverterCommandType.RELATIVE:
+        if self.__relative:
             return (limit / self.limit_max) * 100
         else:
             return limit
@@ -161,9 +635,6 @@ class LimitCalculator:
 
     @staticmethod
     def __log_result(result: LimitCalculatorResult) -> None:
-        if logging.root.level is not logging.DEBUG:
-            return
-
         seg = []
         seg.append(f"Reading: {result.reading:>8.2f}")
         seg.append(f"Sample: {result.sample:>8.2f}")
@@ -179,6 +650,9 @@ class LimitCalculator:
         seg.append(f"Thr: {int(result.is_throttled)}")
         seg.append(f"Hys: {int(result.is_hysteresis_suppressed)}")
         seg.append(f"Ret: {int(result.is_retransmit)}")
+        seg.append(f"Dir: {'-' if result.is_decrease else '+'}")
+        seg.append(f"Urg: {int(result.is_urgent)}")
+        seg.append(f"Tok: {result.tokens:.2f}")
         seg.append(f"El: {result.elapsed:.2f}")
 
-        logging.debug(" | ".join(seg))
+        logger.debug(" | ".join(seg))
@@ -0,0 +1,96 @@
+import atexit
+import json
+import logging
+import queue
+import sys
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, TextIO
+
+LOG_FORMAT = "%(asctime)s | %(levelname).3s | %(message)s"
+LOG_DATEFMT = "%Y-%m-%d %H:%M:%S"
+
+# Subsystem names for --log-level and their loggers
+SUBSYSTEMS: Dict[str, str] = {
+    "mqtt": "sec.mqtt",
+    "mqtt.diag": "sec.mqtt.diag",
+    "control": "sec.control",
+    "storage": "sec.storage",
+    "profile": "sec.profile"
+}
+
+# Records waiting for a slow sink. If full, new records are dropped instead of blocking the caller
+QUEUE_SIZE = 10000
+
+
+class JsonFormatter(logging.Formatter):
+    """One json object per line for log collectors"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry)
+
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, q: queue.Queue) -> None:
+        super().__init__(q)
+        self.dropped: int = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_levels(values: list[str] | None) -> Dict[str, int]:
+    """Parses 'subsystem=LEVEL' arguments"""
+    levels: Dict[str, int] = {}
+
+    for value in values or []:
+        name, sep, level = value.partition("=")
+        if not sep or name not in SUBSYSTEMS:
+            raise ValueError(f"Invalid log level '{value}', expected <subsystem>=<level> with subsystem one of: {', '.join(SUBSYSTEMS)}")
+
+        number = logging.getLevelName(level.upper())
+        if type(number) is not int:
+            raise ValueError(f"Invalid log level '{value}': unknown level '{level}'")
+
+        levels[name] = number
+
+    return levels
+
+
+def setup_logging(level: int, use_queue: bool = False, use_json: bool = False, levels: Dict[str, int] | None = None,
+                  stream: TextIO = sys.stdout) -> QueueListener | None:
+    """Configures the root logger. With use_queue the calling thread only enqueues records, a listener thread
+    formats and writes them, so a slow stdout (pipe, docker log driver) does not stall the mqtt loop"""
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter() if use_json else logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+
+    for name, subsystem_level in (levels or {}).items():
+        logging.getLogger(SUBSYSTEMS[name]).setLevel(subsystem_level)
+
+    if not use_queue:
+        root.addHandler(handler)
+        return None
+
+    q: queue.Queue = queue.Queue(QUEUE_SIZE)
+    root.addHandler(DroppingQueueHandler(q))
+    listener = QueueListener(q, handler)
+    listener.start()
+    # Writes the remaining records on exit
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,82 @@
+from typing import Deque, Tuple
+from collections import deque
+
+# Running sums drift when values are added and removed for a long time: rebuild them periodically
+RESUM_INTERVAL = 1024
+
+
+class TrendPredictor:
+    """Least squares line over the last 'size' (time, value) points. Updates are O(1): the sums of the fit
+    are maintained incrementally while points enter and leave the window."""
+
+    def __init__(self, size: int) -> None:
+        self.size: int = max(2, size)
+        self.__points: Deque[Tuple[float, float]] = deque()
+        self.__t0: float = 0.0
+        self.__updates: int = 0
+        self.__st: float = 0.0
+        self.__sv: float = 0.0
+        self.__stt: float = 0.0
+        self.__stv: float = 0.0
+
+    def __len__(self) -> int:
+        return len(self.__points)
+
+    def add(self, t: float, v: float) -> None:
+        if not self.__points:
+            self.__t0 = t
+
+        x = t - self.__t0
+        self.__points.append((x, v))
+        self.__st += x
+        self.__sv += v
+        self.__stt += x * x
+        self.__stv += x * v
+
+        if len(self.__points) > self.size:
+            ox, ov = self.__points.popleft()
+            self.__st -= ox
+            self.__sv -= ov
+            self.__stt -= ox * ox
+            self.__stv -= ox * ov
+
+        self.__updates += 1
+        if self.__updates >= RESUM_INTERVAL:
+            self.__resum()
+
+    def slope(self) -> float:
+        n = len(self.__points)
+        if n < 2:
+            return 0.0
+
+        denom = n * self.__stt - self.__st * self.__st
+        if denom <= 1e-9:
+            return 0.0
+
+        return (n * self.__stv - self.__st * self.__sv) / denom
+
+    def resize(self, size: int) -> None:
+        self.size = max(2, size)
+        while len(self.__points) > self.size:
+            self.__points.popleft()
+        self.__resum()
+
+    def clear(self) -> None:
+        self.__points.clear()
+        self.__updates = 0
+        self.__st = self.__sv = self.__stt = self.__stv = 0.0
+
+    def __resum(self) -> None:
+        # Rebase time on the oldest point to keep the sums small
+        self.__updates = 0
+        if not self.__points:
+            self.clear()
+            return
+
+        base = self.__points[0][0]
+        self.__t0 += base
+        self.__points = deque((x - base, v) for x, v in self.__points)
+        self.__st = sum(x for x, _ in self.__points)
+        self.__sv = sum(v for _, v in self.__points)
+        self.__stt = sum(x * x for x, _ in self.__points)
+        self.__stv = sum(x * v for x, v in self.__points)
@@ -0,0 +1,110 @@
+import cProfile
+import contextlib
+import logging
+import time
+from typing import Callable, Dict, List
+
+logger = logging.getLogger("sec.profile")
+
+# Shared by all disabled stages: entering and leaving costs next to nothing
+NULL_STAGE = contextlib.nullcontext()
+
+
+class Stage:
+    """Accumulates the duration of a code section. Not reentrant: a stage must not be nested in itself"""
+    __slots__ = ("name", "count", "total", "max", "start")
+
+    def __init__(self, name: str) -> None:
+        self.name: str = name
+        self.count: int = 0
+        self.total: int = 0
+        self.max: int = 0
+        self.start: int = 0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc) -> None:
+        elapsed = time.perf_counter_ns() - self.start
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+
+class Profiler:
+    def __init__(self) -> None:
+        self.stages: Dict[str, Stage] = {}
+        self.started: float = time.monotonic()
+        self.__cprofile: cProfile.Profile | None = None
+        self.__cprofile_until: float = 0.0
+        self.__cprofile_path: str = ""
+
+    def stage(self, name: str) -> Stage:
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage(name)
+        return stage
+
+    def report(self) -> List[str]:
+        runtime = max(time.monotonic() - self.started, 1e-9)
+        lines = [f"{'Stage':<28} | {'Count':>9} | {'Total ms':>10} | {'Avg us':>9} | {'Max us':>9} | {'CPU %':>6}"]
+        for s in sorted(self.stages.values(), key=lambda x: x.total, reverse=True):
+            if s.count == 0:
+                continue
+            avg = s.total / s.count / 1000
+            lines.append(f"{s.name:<28} | {s.count:>9} | {s.total / 1e6:>10.1f} | {avg:>9.1f} | {s.max / 1000:>9.1f} | {s.total / 1e9 / runtime * 100:>6.2f}")
+        return lines
+
+    def log_report(self) -> None:
+        for line in self.report():
+            logger.info(line)
+
+    def start_cprofile(self, seconds: int, path: str) -> None:
+        """Profiles the calling thread (the mqtt loop) for a bounded time, see poll_cprofile"""
+        self.__cprofile = cProfile.Profile()
+        self.__cprofile_until = time.monotonic() + seconds
+        self.__cprofile_path = path
+        self.__cprofile.enable()
+        logger.info(f"cProfile: Profiling for {seconds}s")
+
+    def poll_cprofile(self, force: bool = False) -> None:
+        """Stops cProfile and writes the pstats file once the window is over. Must run on the profiled thread"""
+        if self.__cprofile is None or (not force and time.monotonic() < self.__cprofile_until):
+            return
+
+        self.__cprofile.disable()
+        self.__cprofile.dump_stats(self.__cprofile_path)
+        self.__cprofile = None
+        logger.info(f"cProfile: Written to '{self.__cprofile_path}', view with: python -m pstats {self.__cprofile_path}")
+
+
+# Set by enable() before the agent is created
+profiler: Profiler | None = None
+
+
+def enable() -> Profiler:
+    global profiler
+    profiler = Profiler()
+    return profiler
+
+
+def stage(name: str):
+    """Context manager timing a section if profiling is enabled"""
+    if profiler is None:
+        return NULL_STAGE
+    return profiler.stage(name)
+
+
+def timed(name: str, func: Callable) -> Callable:
+    """Wraps func in a stage if profiling is enabled, returns func unchanged otherwise"""
+    if profiler is None:
+        return func
+
+    s = profiler.stage(name)
+
+    def wrapper(*args, **kwargs):
+        with s:
+            return func(*args, **kwargs)
+
+    return wrapper
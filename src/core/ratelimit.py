@@ -0,0 +1,44 @@
+# Refills add up in float steps: ten refills of 0.1 tokens stay just below one token
+TOKEN_TOLERANCE = 1e-9
+
+
+class TokenBucket:
+    """Token bucket on a monotonic clock: holds up to 'burst' tokens and refills 'rate' tokens per second.
+    A rate of 0 disables limiting."""
+
+    def __init__(self, rate: float, burst: int, now: float) -> None:
+        self.rate: float = rate
+        self.burst: int = burst
+        self.tokens: float = float(burst)
+        self.stamp: float = now
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def configure(self, rate: float, burst: int, now: float) -> None:
+        self.refill(now)
+        self.rate = rate
+        self.burst = burst
+        self.tokens = min(self.tokens, float(burst))
+
+    def refill(self, now: float) -> float:
+        if self.rate <= 0:
+            self.tokens = float(self.burst)
+        elif now > self.stamp:
+            self.tokens = min(float(self.burst), self.tokens + (now - self.stamp) * self.rate)
+
+        self.stamp = now
+        return self.tokens
+
+    def available(self, now: float) -> bool:
+        return self.refill(now) >= 1 - TOKEN_TOLERANCE
+
+    def take(self, now: float) -> None:
+        # Always succeeds: forced takes (calibration, urgent) drain the bucket but never below zero
+        self.refill(now)
+        self.tokens = max(0.0, self.tokens - 1)
+
+    def reset(self, now: float) -> None:
+        self.tokens = float(self.burst)
+        self.stamp = now
@@ -0,0 +1,163 @@
+import bisect
+import logging
+import mmap
+import os
+import struct
+from typing import Iterator, List, Tuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger("sec.storage")
+
+# Chunk file: header, then fixed width little endian records. The record count follows from the file size,
+# so appending never rewrites the header. A partial record at the end (power cut) is ignored
+MAGIC = b"SECREC\x00\x01"
+HEADER = struct.Struct("<8sIId")            # magic, header size, record size, timestamp of the first record
+RECORD = struct.Struct("<dfI")              # timestamp (unix, float64), value (float32), flags (FLAG_* of core.limit)
+TIMESTAMP = struct.Struct("<d")
+CHUNK_SUFFIX = ".rec"
+
+if numpy is not None:
+    RECORD_DTYPE = numpy.dtype([("timestamp", "<f8"), ("value", "<f4"), ("flags", "<u4")])
+
+
+class RecordingWriter:
+    """Appends records to chunk files in a directory. Records are buffered and written every flush_records,
+    a new chunk file is started every chunk_records"""
+
+    def __init__(self, directory: str, chunk_records: int, flush_records: int) -> None:
+        self.directory: str = directory
+        self.chunk_records: int = chunk_records
+        self.flush_records: int = flush_records
+        self.__buffer = bytearray()
+        self.__buffered: int = 0
+        self.__file = None
+        self.__chunk_count: int = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, timestamp: float, value: float, flags: int) -> None:
+        self.__buffer += RECORD.pack(timestamp, value, flags)
+        self.__buffered += 1
+
+        if self.__buffered >= self.flush_records:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.__buffered:
+            return
+
+        try:
+            if self.__file is None:
+                self.__open_chunk(RECORD.unpack_from(self.__buffer)[0])
+
+            self.__file.write(self.__buffer)
+            self.__file.flush()
+            self.__chunk_count += self.__buffered
+
+            if self.__chunk_count >= self.chunk_records:
+                self.__file.close()
+                self.__file = None
+        except OSError as ex:
+            logger.warning(f"Recording: Failed to write {self.__buffered} records: {ex}")
+
+        self.__buffer.clear()
+        self.__buffered = 0
+
+    def close(self) -> None:
+        self.flush()
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def __open_chunk(self, timestamp: float) -> None:
+        path = os.path.join(self.directory, f"{int(timestamp * 1000):014d}{CHUNK_SUFFIX}")
+        self.__file = open(path, "ab")
+        if self.__file.tell() == 0:
+            self.__file.write(HEADER.pack(MAGIC, HEADER.size, RECORD.size, timestamp))
+        self.__chunk_count = 0
+        logger.debug(f"Recording: New chunk '{path}'")
+
+
+def list_chunks(path: str) -> List[str]:
+    """Chunk files of a recording directory in time order, or the file itself"""
+    if os.path.isfile(path):
+        return [path]
+    return [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(CHUNK_SUFFIX)]
+
+
+def read_header(fs) -> Tuple[int, float]:
+    """Validates the header and returns the header size and the timestamp of the first record"""
+    data = fs.read(HEADER.size)
+    if len(data) < HEADER.size:
+        raise ValueError("Recording: Truncated header")
+
+    magic, header_size, record_size, start = HEADER.unpack(data)
+    if magic != MAGIC or record_size != RECORD.size:
+        raise ValueError(f"Recording: Unsupported chunk: magic '{magic}', record size {record_size}")
+
+    return header_size, start
+
+
+def open_chunk(path: str):
+    """Maps a chunk without copying: a numpy record array (timestamp, value, flags) if numpy is installed,
+    a memoryview of the records otherwise (see iter_records)"""
+    with open(path, "rb") as fs:
+        header_size, _ = read_header(fs)
+        count = (os.fstat(fs.fileno()).st_size - header_size) // RECORD.size
+
+        if numpy is not None:
+            if count == 0:
+                return numpy.empty(0, dtype=RECORD_DTYPE)
+            return numpy.memmap(fs, dtype=RECORD_DTYPE, mode="r", offset=header_size, shape=(count,))
+
+        if count == 0:
+            return memoryview(b"")
+        mapped = mmap.mmap(fs.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped)[header_size:header_size + count * RECORD.size]
+
+
+def iter_records(view: memoryview):
+    return RECORD.iter_unpack(view)
+
+
+class RecordTimestamps:
+    """Timestamp column of a memoryview chunk as sequence for bisect, unpacks only the records it is asked for"""
+
+    def __init__(self, view: memoryview) -> None:
+        self.view: memoryview = view
+
+    def __len__(self) -> int:
+        return len(self.view) // RECORD.size
+
+    def __getitem__(self, index: int) -> float:
+        return TIMESTAMP.unpack_from(self.view, index * RECORD.size)[0]
+
+
+def read_recording(path: str, start: float | None = None, end: float | None = None) -> Iterator[Tuple]:
+    """Timestamps and values between start and end, one pair per chunk. Records are appended in arrival order:
+    start and end are found by bisection and the chunks after end are not opened. With numpy the pairs are views
+    of the mapped chunk (no copy), lists of the selected records otherwise"""
+    for chunk in list_chunks(path):
+        records = open_chunk(chunk)
+
+        if numpy is not None:
+            timestamps = records["timestamp"]
+            count = len(timestamps)
+            lo = 0 if start is None else int(numpy.searchsorted(timestamps, start, "left"))
+            hi = count if end is None else int(numpy.searchsorted(timestamps, end, "left"))
+            if lo < hi:
+                yield timestamps[lo:hi], records["value"][lo:hi]
+        else:
+            column = RecordTimestamps(records)
+            count = len(column)
+            lo = 0 if start is None else bisect.bisect_left(column, start)
+            hi = count if end is None else bisect.bisect_left(column, end)
+            if lo < hi:
+                selected = list(iter_records(records[lo * RECORD.size:hi * RECORD.size]))
+                yield [t for t, _, _ in selected], [v for _, v, _ in selected]
+
+        if hi < count:
+            return
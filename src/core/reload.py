@@ -0,0 +1,111 @@
+import os
+import sys
+import struct
+import logging
+import ctypes
+import ctypes.util
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger("sec.control")
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+INOTIFY_EVENT_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+
+
+class FileWatcher:
+    """Detects modifications of a set of files. Uses inotify if available, mtime polling otherwise.
+    Never blocks: call poll() periodically from the main loop."""
+
+    def __init__(self, paths: List[str]) -> None:
+        self.paths: List[str] = [os.path.abspath(x) for x in paths]
+        self.__stats: Dict[str, Tuple[int, int] | None] = {x: self.__stat(x) for x in self.paths}
+        self.__inotify_fd: int | None = None
+        self.__inotify_wds: Dict[int, str] = {}
+        self.__inotify_init()
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self.__inotify_fd is not None
+
+    def poll(self) -> List[str]:
+        if self.__inotify_fd is not None:
+            candidates = self.__inotify_read()
+        else:
+            candidates = self.paths
+
+        changed = []
+        for path in candidates:
+            stat = self.__stat(path)
+            if stat is not None and stat != self.__stats[path]:
+                changed.append(path)
+            self.__stats[path] = stat
+
+        return changed
+
+    def close(self) -> None:
+        if self.__inotify_fd is not None:
+            os.close(self.__inotify_fd)
+            self.__inotify_fd = None
+
+    def __inotify_init(self) -> None:
+        if not sys.platform.startswith("linux"):
+            return
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+            # Watch the directories: editors usually replace files instead of writing them in place
+            for directory in set(os.path.dirname(x) for x in self.paths):
+                wd = libc.inotify_add_watch(fd, directory.encode(), INOTIFY_EVENT_MASK)
+                if wd < 0:
+                    os.close(fd)
+                    raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for '{directory}'")
+                self.__inotify_wds[wd] = directory
+
+            self.__inotify_fd = fd
+        except (OSError, AttributeError) as ex:
+            logger.debug(f"inotify unavailable, falling back to mtime polling: {ex}")
+            self.__inotify_wds.clear()
+
+    def __inotify_read(self) -> List[str]:
+        hits = set()
+
+        while True:
+            try:
+                buf = os.read(self.__inotify_fd, 4096)
+            except BlockingIOError:
+                break
+
+            if not buf:
+                break
+
+            offset = 0
+            while offset + INOTIFY_EVENT_HEADER.size <= len(buf):
+                wd, _, _, length = INOTIFY_EVENT_HEADER.unpack_from(buf, offset)
+                offset += INOTIFY_EVENT_HEADER.size
+                name = buf[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+                offset += length
+
+                directory = self.__inotify_wds.get(wd)
+                if directory is not None and name:
+                    hits.add(os.path.join(directory, name))
+
+        return [x for x in self.paths if x in hits]
+
+    @staticmethod
+    def __stat(path: str) -> Tuple[int, int] | None:
+        try:
+            st = os.stat(path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
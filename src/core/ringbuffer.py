@@ -0,0 +1,101 @@
+import csv
+import math
+from array import array
+from datetime import datetime
+from core.limit import LimitCalculatorResult
+
+EVENT_CONNECTED = 0
+EVENT_DISCONNECTED = 1
+EVENT_ACTIVE = 2
+EVENT_INACTIVE = 3
+EVENT_METER_STALE = 4
+EVENT_METER_RESUMED = 5
+EVENT_LEADER = 6
+EVENT_STANDBY = 7
+EVENT_NAMES = ("connected", "disconnected", "active", "inactive", "meter stale", "meter resumed", "leader", "standby")
+
+# Status transitions are rare compared to readings
+EVENT_SIZE = 256
+
+COLUMNS = ("time", "type", "reading", "sample", "overshoot", "limit", "command", "flags", "tokens", "elapsed", "event", "value")
+
+
+class DecisionRing:
+    """Keeps the last 'size' limit results and EVENT_SIZE status transitions for a post mortem dump.
+    Backed by preallocated arrays, adding overwrites the oldest entry in place and allocates nothing"""
+
+    def __init__(self, size: int) -> None:
+        self.size: int = size
+        self.__index: int = 0
+        self.__count: int = 0
+        self.__time = array("d", [0.0]) * size
+        self.__reading = array("d", [0.0]) * size
+        self.__sample = array("d", [0.0]) * size
+        self.__overshoot = array("d", [0.0]) * size
+        self.__limit = array("d", [0.0]) * size
+        self.__command = array("d", [0.0]) * size
+        self.__flags = array("B", [0]) * size
+        self.__tokens = array("d", [0.0]) * size
+        self.__elapsed = array("d", [0.0]) * size
+
+        self.__event_index: int = 0
+        self.__event_count: int = 0
+        self.__event_time = array("d", [0.0]) * EVENT_SIZE
+        self.__event_code = array("B", [0]) * EVENT_SIZE
+        self.__event_value = array("d", [0.0]) * EVENT_SIZE
+
+    def add_result(self, timestamp: float, result: LimitCalculatorResult) -> None:
+        i = self.__index
+        self.__time[i] = timestamp
+        self.__reading[i] = result.reading
+        self.__sample[i] = result.sample
+        self.__overshoot[i] = result.overshoot
+        self.__limit[i] = result.limit
+        self.__command[i] = math.nan if result.command is None else result.command
+        self.__flags[i] = result.flags
+        self.__tokens[i] = result.tokens
+        self.__elapsed[i] = result.elapsed
+
+        i += 1
+        self.__index = i if i < self.size else 0
+        if self.__count < self.size:
+            self.__count += 1
+
+    def add_event(self, timestamp: float, event: int, value: float = 0.0) -> None:
+        i = self.__event_index
+        self.__event_time[i] = timestamp
+        self.__event_code[i] = event
+        self.__event_value[i] = value
+
+        i += 1
+        self.__event_index = i if i < EVENT_SIZE else 0
+        if self.__event_count < EVENT_SIZE:
+            self.__event_count += 1
+
+    def dump(self, path: str) -> int:
+        """Writes results and events oldest first as csv, returns the number of rows"""
+        rows = []
+
+        for i in self.__ordered(self.__index, self.__count, self.size):
+            command = self.__command[i]
+            rows.append((self.__time[i], "result", self.__reading[i], self.__sample[i], self.__overshoot[i], self.__limit[i],
+                         "" if math.isnan(command) else command, self.__flags[i], self.__tokens[i], self.__elapsed[i], "", ""))
+
+        for i in self.__ordered(self.__event_index, self.__event_count, EVENT_SIZE):
+            rows.append((self.__event_time[i], "event", "", "", "", "", "", "", "", "", EVENT_NAMES[self.__event_code[i]], self.__event_value[i]))
+
+        rows.sort(key=lambda row: row[0])
+
+        with open(path, "w", newline="") as fs:
+            writer = csv.writer(fs)
+            writer.writerow(COLUMNS)
+            for row in rows:
+                writer.writerow((datetime.fromtimestamp(row[0]).isoformat(timespec="milliseconds"),) + row[1:])
+
+        return len(rows)
+
+    @staticmethod
+    def __ordered(index: int, count: int, size: int) -> range | list:
+        if count < size:
+            return range(count)
+        return list(range(index, size)) + list(range(index))
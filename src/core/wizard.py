@@ -9,6 +9,8 @@ import pathlib
 
 HOYMILES_MIN_POWER_PERCENT = float(0.03)
 HOYMILES_THROTTLE = int(10)
+HOYMILES_THROTTLE_MIN = int(5)
+HOYMILES_THROTTLE_MAX = int(30)
 HYSTERESIS_FACTOR = float(0.02)
 
 
@@ -67,6 +69,7 @@ class ConfigWizard:
         command_type = self.__prompt_command_type()
         command_throttle = self.__prompt_command_throttle(preset)
         command_hysteresis = self.__prompt_command_hysteresis(command_max_power)
+        command_adaptive_throttle = self.__prompt_command_adaptive_throttle(preset, command_hysteresis)
         config_command = appconfig.CommandConfig(
             target=command_target,
             min_power=command_min_power,
@@ -75,7 +78,8 @@ class ConfigWizard:
             throttle=command_throttle,
             hysteresis=command_hysteresis,
             retransmit=0,
-            default_limit=command_max_power
+            default_limit=command_max_power,
+            adaptive_throttle=command_adaptive_throttle
         )
 
         reading_smoothing = self.__prompt_reading_smoothing(interval)
@@ -232,6 +236,13 @@ class ConfigWizard:
         prompt = "Core: What is the required waiting period (in seconds) before a new power limit can be sent after a power limit has been sent?\n"
         return self.__prompt_input(prompt, self.__vali_req_pos_int)
 
+    def __prompt_command_adaptive_throttle(self, preset: ConfigWizardPresetType, hysteresis: float) -> appconfig.AdaptiveThrottleConfig:
+        # Hoymiles response times vary with radio conditions: learn the throttle, start with the known safe value
+        if preset == ConfigWizardPresetType.HOYMILES_OPENDTU:
+            return appconfig.AdaptiveThrottleConfig(True, HOYMILES_THROTTLE_MIN, HOYMILES_THROTTLE_MAX, max(hysteresis, 10.0))
+
+        return appconfig.AdaptiveThrottleConfig(False)
+
     def __prompt_command_hysteresis(self, max_power: int) -> float:
         return float(math.ceil(max_power*HYSTERESIS_FACTOR))
 
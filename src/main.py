@@ -4,6 +4,8 @@ import argparse
 from core.agent import ExportControlAgent
 from core.appconfig import AppConfig
 from core.wizard import ConfigWizard
+from core.logsetup import SUBSYSTEMS, parse_levels, setup_logging
+import core.profiling as profiling
 import sys
 
 MIN_PYTHON = (3, 10)
@@ -17,11 +19,24 @@ argparser.add_argument("config", type=str, help="path to config file")
 argparser.add_argument("-v", "--verbose", help="enables detailed logging", action="store_true")
 argparser.add_argument("--mqttdiag", help="enables extra mqtt diagnostics", action="store_true")
 argparser.add_argument("--wizard", help="interactive prompt for creating a config", action="store_true")
+argparser.add_argument("--reload", help="applies changes to config file and customize.py while running", action="store_true")
+argparser.add_argument("--log-queue", help="writes log output on a background thread, a slow stdout does not stall the application", action="store_true")
+argparser.add_argument("--log-json", help="writes log output as one json object per line", action="store_true")
+argparser.add_argument("--profile", help="measures the time spent in message dispatch, customize.py, limit calculation and telemetry. Reported every 5 minutes and on exit", action="store_true")
+argparser.add_argument("--profile-window", help="with --profile: runs cProfile for the first SECONDS and writes a pstats file", type=int, default=0, metavar="SECONDS")
+argparser.add_argument("--profile-output", help="pstats file of --profile-window", type=str, default="sec.pstats")
+argparser.add_argument("--log-level", help=f"level of a subsystem as <subsystem>=<level>, can be repeated. Subsystems: {', '.join(SUBSYSTEMS)}", action="append", metavar="SUBSYSTEM=LEVEL")
 args = argparser.parse_args()
 
 config_path = pathlib.Path(args.config).resolve()
 loglvl = logging.DEBUG if args.verbose else logging.INFO
-logging.basicConfig(stream=sys.stdout, level=loglvl, format="%(asctime)s | %(levelname).3s | %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+
+try:
+    loglevels = parse_levels(args.log_level)
+except ValueError as ex:
+    sys.exit(str(ex))
+
+setup_logging(loglvl, args.log_queue, args.log_json, loglevels)
 
 if args.wizard:
     wizard = ConfigWizard(str(config_path))
@@ -36,5 +51,11 @@ try:
 except Exception as ex:
     sys.exit(f"Failed to load config: '{ex.args}'")
 
-agent = ExportControlAgent(appconfig, args.mqttdiag)
+# Before the agent is created: stages are bound on setup
+if args.profile:
+    profiler = profiling.enable()
+    if args.profile_window > 0:
+        profiler.start_cprofile(args.profile_window, args.profile_output)
+
+agent = ExportControlAgent(appconfig, args.mqttdiag, str(config_path) if args.reload else None)
 agent.run()
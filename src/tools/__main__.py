@@ -0,0 +1,34 @@
+import argparse
+import logging
+import sys
+import tools.predictbench as predictbench
+import tools.limitbench as limitbench
+import tools.tune as tune
+import tools.historyquery as historyquery
+import tools.backtest as backtest
+import tools.logbench as logbench
+import tools.wirebench as wirebench
+import tools.ingestbench as ingestbench
+import tools.loadtest as loadtest
+import tools.microbench as microbench
+
+MIN_PYTHON = (3, 10)
+if sys.version_info < MIN_PYTHON:
+    sys.exit("Python %s.%s or later is required.\n" % MIN_PYTHON)
+
+argparser = argparse.ArgumentParser(prog="SolarExportControl Tools", description="Offline tools to evaluate and tune the limit calculation. Run from the 'src' directory: python -m tools <command>")
+subparsers = argparser.add_subparsers(required=True, metavar="command")
+predictbench.add_parser(subparsers)
+limitbench.add_parser(subparsers)
+tune.add_parser(subparsers)
+historyquery.add_parser(subparsers)
+backtest.add_parser(subparsers)
+logbench.add_parser(subparsers)
+wirebench.add_parser(subparsers)
+ingestbench.add_parser(subparsers)
+loadtest.add_parser(subparsers)
+microbench.add_parser(subparsers)
+
+args = argparser.parse_args()
+logging.basicConfig(stream=sys.stdout, level=logging.WARNING, format="%(asctime)s | %(levelname).3s | %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+args.func(args)
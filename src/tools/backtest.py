@@ -0,0 +1,47 @@
+import argparse
+import time
+import core.appconfig as appconfig
+from core.limit import LimitCalculator
+from core.recording import read_recording
+from tools.simulate import parse_timestamp
+
+
+def add_parser(subparsers) -> None:
+    parser = subparsers.add_parser("backtest", help="replays a recording open loop through LimitCalculator.add_readings, commands do not act back on the readings")
+    parser.add_argument("config", type=str, help="path to config file")
+    parser.add_argument("recording", type=str, help="recording directory or chunk file (recording.path)")
+    parser.add_argument("--start", type=str, default=None, help="ISO 8601 date or unix timestamp")
+    parser.add_argument("--end", type=str, default=None, help="ISO 8601 date or unix timestamp")
+    parser.set_defaults(func=run)
+
+
+def run(args: argparse.Namespace) -> None:
+    config = appconfig.AppConfig.from_json_file(args.config)
+    start = None if args.start is None else parse_timestamp(args.start)
+    end = None if args.end is None else parse_timestamp(args.end)
+
+    calc = LimitCalculator(config)
+    readings = 0
+    first = last = 0.0
+    calc_start = time.perf_counter()
+
+    # Chunk by chunk: add_readings continues where the previous chunk ended
+    for timestamps, values in read_recording(args.recording, start, end):
+        if not readings:
+            first = float(timestamps[0])
+        last = float(timestamps[-1])
+        readings += len(calc.add_readings(timestamps, values))
+
+    calc_elapsed = time.perf_counter() - calc_start
+
+    if not readings:
+        print("No readings in range")
+        return
+
+    hours = max((last - first) / 3600, 1 / 3600)
+    commands = calc.stats_decrease.commands + calc.stats_increase.commands
+
+    print(f"Readings: {readings}, hours: {hours:.2f}, calculation: {calc_elapsed:.3f}s")
+    print(f"Commands: {commands}, per hour: {commands / hours:.1f}")
+    print(f"Decrease -> {calc.stats_decrease}")
+    print(f"Increase -> {calc.stats_increase}")
@@ -0,0 +1,30 @@
+import argparse
+import csv
+import sys
+import time
+from datetime import datetime
+from core.history import COLUMNS_DOWNSAMPLED, COLUMNS_RAW, query
+from tools.simulate import parse_timestamp
+
+
+def add_parser(subparsers) -> None:
+    parser = subparsers.add_parser("history", help="prints a time range of the history database as csv")
+    parser.add_argument("database", type=str, help="path to the history database (history.path)")
+    parser.add_argument("--start", type=str, default=None, help="ISO 8601 date or unix timestamp, defaults to 24 hours before --end")
+    parser.add_argument("--end", type=str, default=None, help="ISO 8601 date or unix timestamp, defaults to now")
+    parser.add_argument("--downsampled", action="store_true", help="query the downsampled averages instead of the raw readings")
+    parser.add_argument("--unix", action="store_true", help="print unix timestamps instead of ISO 8601 dates")
+    parser.set_defaults(func=run)
+
+
+def run(args: argparse.Namespace) -> None:
+    end = time.time() if args.end is None else parse_timestamp(args.end)
+    start = end - 86400 if args.start is None else parse_timestamp(args.start)
+    rows = query(args.database, start, end, args.downsampled)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(COLUMNS_DOWNSAMPLED if args.downsampled else COLUMNS_RAW)
+
+    for row in rows:
+        ts = row[0] if args.unix else datetime.fromtimestamp(row[0]).isoformat(timespec="milliseconds")
+        writer.writerow((ts,) + row[1:])
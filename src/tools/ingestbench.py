@@ -0,0 +1,108 @@
+import argparse
+import copy
+import json
+import logging
+import random
+import threading
+import time
+import config.customize as customize
+import core.appconfig as appconfig
+from core.helper import AppMqttHelper
+from core.ingest import IngestPolicy
+from core.limit import LimitCalculator
+from tools.standin import BrokerStandIn
+
+SYNC_TOPIC = "sec/bench/sync"
+CONNECT_TIMEOUT = 5
+SECONDS_PER_HOUR = 3600
+
+
+def add_parser(subparsers) -> None:
+    parser = subparsers.add_parser("ingest-bench", help="measures the cpu time per hour of the reading path with each ingest policy")
+    parser.add_argument("config", type=str, help="path to config file")
+    parser.add_argument("--rate", type=float, default=10, help="readings per second of the simulated meter")
+    parser.add_argument("--readings", type=int, default=6000, help="readings per policy")
+    parser.add_argument("--interval", type=float, default=1.0, help="interval of the 'latest' policy in seconds")
+    parser.add_argument("--decimate", type=int, default=10, help="n of the 'decimate' policy")
+    parser.set_defaults(func=run)
+
+
+def measure(config: appconfig.AppConfig, payloads: list[bytes], rate: float, policy: str) -> tuple[float, int, int]:
+    """Cpu seconds (including the network thread) and the processed and folded readings"""
+    standin = BrokerStandIn()
+    standin.start()
+
+    config = copy.deepcopy(config)
+    config.mqtt.host = "127.0.0.1"
+    config.mqtt.port = standin.port
+    config.mqtt.auth = None
+    config.mqtt.failover = []
+
+    helper = AppMqttHelper(config)
+    connected = threading.Event()
+    helper.on_connect(lambda session_present: connected.set(), None)
+    helper.connect()
+    helper.client.loop_start()
+
+    try:
+        if not connected.wait(CONNECT_TIMEOUT):
+            raise RuntimeError("ingest-bench: No connection to the broker stand-in")
+
+        calc = LimitCalculator(config)
+        ingest = IngestPolicy(config.ingest) if policy != "all" else None
+        min_power, max_power = config.command.min_power, config.command.max_power
+        start = time.process_time()
+
+        # Same steps as the reading callback of the agent
+        for i, payload in enumerate(payloads):
+            now = i / rate
+            value = customize.parse_power_payload(payload, min_power, max_power)
+            if ingest is not None and not calc.is_urgent(value) and not ingest.due(now):
+                calc.observe_reading(value, now)
+                continue
+
+            result = calc.add_reading(value, now)
+            helper.publish_meta_teles(result.reading, result.sample, result.overshoot, result.limit)
+            helper.publish_meta_tele_tokens(result.tokens)
+            if result.command is not None:
+                helper.publish_command(f"{result.command:.2f}")
+
+        # Publishing ends once the stand-in acknowledged this one
+        helper.client.publish(SYNC_TOPIC, "1", 1).wait_for_publish(CONNECT_TIMEOUT)
+        elapsed = time.process_time() - start
+
+        # Urgent readings bypass the policy
+        folded = ingest.folded if ingest is not None else 0
+        return elapsed, len(payloads) - folded, folded
+    finally:
+        helper.client.disconnect()
+        helper.client.loop_stop()
+        standin.stop()
+
+
+def run(args: argparse.Namespace) -> None:
+    logging.getLogger("sec.mqtt").setLevel(logging.ERROR)
+    config = appconfig.AppConfig.from_json_file(args.config)
+
+    # Every telemetry topic, like a dashboard that shows all of them
+    for name in vars(config.meta.telemetry):
+        setattr(config.meta.telemetry, name, True)
+    if not config.mqtt.topics.write_command:
+        config.mqtt.topics.write_command = "inverter/cmd/limit"
+    config.ingest.interval = args.interval
+    config.ingest.decimate = args.decimate
+
+    # Household load around zero export with noise, tasmota payloads as parsed by customize.py
+    rnd = random.Random(42)
+    payloads = [json.dumps({"Time": "2022-10-20T20:58:13", "em": {"power_total": round(rnd.gauss(150, 120), 2)}}).encode()
+                for _ in range(args.readings)]
+
+    hours = args.readings / args.rate / SECONDS_PER_HOUR
+    print(f"Rate: {args.rate:g} readings/s, readings: {args.readings} ({hours * 60:.1f} min of input)")
+    print(f"{'Policy':<12} | {'Processed':>9} | {'Folded':>7} | {'CPU s/h':>8} | {'CPU %':>6}")
+
+    for name, policy in (("all", "all"), (f"latest {args.interval:g}s", "latest"), (f"decimate {args.decimate}", "decimate")):
+        config.ingest.policy = policy
+        cpu, processed, folded = measure(config, payloads, args.rate, policy)
+        per_hour = cpu / hours
+        print(f"{name:<12} | {processed:>9} | {folded:>7} | {per_hour:>8.2f} | {per_hour / SECONDS_PER_HOUR * 100:>5.2f}%")
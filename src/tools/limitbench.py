@@ -0,0 +1,48 @@
+import argparse
+import copy
+import random
+import time
+import core.appconfig as appconfig
+from core.limit import LimitCalculator
+
+
+def add_parser(subparsers) -> None:
+    parser = subparsers.add_parser("limit-bench", help="measures LimitCalculator.add_reading and add_readings throughput")
+    parser.add_argument("config", type=str, help="path to config file")
+    parser.add_argument("--readings", type=int, default=200000, help="readings per run")
+    parser.add_argument("--runs", type=int, default=5, help="runs per smoothing setting, the best run is reported")
+    parser.set_defaults(func=run)
+
+
+def measure(config: appconfig.AppConfig, readings: int, runs: int, batch: bool = False) -> float:
+    rnd = random.Random(42)
+    values = [rnd.uniform(-800, 1500) for _ in range(readings)]
+    timestamps = [float(i) for i in range(readings)]
+    best = 0.0
+
+    for _ in range(runs):
+        calc = LimitCalculator(config)
+        start = time.perf_counter()
+        if batch:
+            calc.add_readings(timestamps, values)
+        else:
+            for t, v in zip(timestamps, values):
+                calc.add_reading(v, t)
+        elapsed = time.perf_counter() - start
+        best = max(best, readings / elapsed)
+
+    return best
+
+
+def run(args: argparse.Namespace) -> None:
+    config = appconfig.AppConfig.from_json_file(args.config)
+    print(f"{'Smoothing':<12} | {'Readings/s':>12} | {'Batch/s':>12}")
+
+    for smoothing, size in ((appconfig.PowerReadingSmoothingType.NONE, 0), (appconfig.PowerReadingSmoothingType.AVG, 4), (appconfig.PowerReadingSmoothingType.AVG, 16)):
+        cfg = copy.deepcopy(config)
+        cfg.reading.smoothing = smoothing
+        cfg.reading.smoothingSampleSize = size
+        cfg.reading.smoothingSampleSizeDecrease = size
+        cfg.reading.smoothingSampleSizeIncrease = size
+        name = "none" if smoothing == appconfig.PowerReadingSmoothingType.NONE else f"avg {size}"
+        print(f"{name:<12} | {measure(cfg, args.readings, args.runs):>12.0f} | {measure(cfg, args.readings, args.runs, True):>12.0f}")
@@ -0,0 +1,201 @@
+import argparse
+import copy
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+import core.appconfig as appconfig
+from paho.mqtt import client as mqtt
+from core.agent import ExportControlAgent
+from tools.standin import BrokerStandIn
+
+PATTERNS = ("steady", "burst", "ramp")
+# The agent subscribes the power reading after its setup mode (10s)
+SUBSCRIBE_TIMEOUT = 30
+DRAIN_TIMEOUT = 5
+MEMORY_SAMPLE_INTERVAL = 1.0
+SECONDS_PER_HOUR = 3600
+
+
+def add_parser(subparsers) -> None:
+    parser = subparsers.add_parser("load-test", help="runs the agent against a local broker stand-in and a meter load generator")
+    parser.add_argument("config", type=str, help="path to config file")
+    parser.add_argument("--rate", type=float, default=10, help="readings per second (peak rate with 'ramp')")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of load")
+    parser.add_argument("--pattern", type=str, choices=PATTERNS, default="steady",
+                        help="steady: evenly spaced, burst: --burst readings back to back, ramp: rate rises from 0 to --rate")
+    parser.add_argument("--burst", type=int, default=10, help="readings per burst with --pattern burst")
+    parser.set_defaults(func=run)
+
+
+def schedule(pattern: str, rate: float, duration: float, burst: int) -> list[float]:
+    """Send times in seconds after the start"""
+    count = int(rate * duration)
+    if pattern == "burst":
+        return [(i // burst) * burst / rate for i in range(count)]
+    if pattern == "ramp":
+        # The rate rises linearly: i readings are sent by sqrt(2 * duration * i / rate)
+        return [math.sqrt(2 * duration * i / rate) for i in range(count // 2)]
+    return [i / rate for i in range(count)]
+
+
+def rss_bytes() -> int | None:
+    """Resident memory of this process, None if unknown (not on linux)"""
+    try:
+        with open("/proc/self/statm", "r") as fs:
+            return int(fs.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def percentile(values: list[float], p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class LoadGenerator:
+    """Publishes tasmota payloads on the power reading topic once the agent subscribed, then stops the agent"""
+
+    def __init__(self, standin: BrokerStandIn, agent: ExportControlAgent, topic: str, command_topic: str, times: list[float]) -> None:
+        self.standin: BrokerStandIn = standin
+        self.agent: ExportControlAgent = agent
+        self.topic: str = topic
+        self.command_topic: str = command_topic
+        self.times: list[float] = times
+        # Time, resident memory and the arrival records of the stand-in (8 bytes each) at that time
+        self.memory: list[tuple[float, int, int]] = []
+        self.error: Exception | None = None
+        self.__thread = threading.Thread(target=self.__run, name="loadgen", daemon=True)
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def __run(self) -> None:
+        client = mqtt.Client(client_id="sec-loadgen")
+        try:
+            client.connect("127.0.0.1", self.standin.port)
+            client.loop_start()
+            self.__wait(lambda: self.standin.has_subscriber(self.topic), SUBSCRIBE_TIMEOUT, "The agent did not subscribe the power reading")
+            self.standin.reset_counters()
+            self.__publish(client)
+            self.__wait(lambda: len(self.standin.arrivals[self.command_topic]) >= len(self.standin.arrivals[self.topic]), DRAIN_TIMEOUT, None)
+            self.__sample_memory(time.perf_counter())
+        except Exception as ex:
+            self.error = ex
+        finally:
+            client.disconnect()
+            client.loop_stop()
+            self.agent.stop()
+
+    def __publish(self, client: mqtt.Client) -> None:
+        rnd = random.Random(42)
+        start = time.perf_counter()
+        next_sample = start
+
+        for t in self.times:
+            now = time.perf_counter()
+            if now >= next_sample:
+                self.__sample_memory(now)
+                next_sample = now + MEMORY_SAMPLE_INTERVAL
+
+            delay = start + t - now
+            if delay > 0:
+                time.sleep(delay)
+
+            payload = json.dumps({"Time": time.strftime("%Y-%m-%dT%H:%M:%S"), "em": {"power_total": round(rnd.gauss(150, 120), 2)}})
+            client.publish(self.topic, payload, 0)
+
+    def __sample_memory(self, now: float) -> None:
+        rss = rss_bytes()
+        if rss is not None:
+            records = sum(len(times) for times in self.standin.arrivals.values())
+            self.memory.append((now, rss, records))
+
+    @staticmethod
+    def __wait(condition, timeout: float, error: str | None) -> None:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                if error is not None:
+                    raise RuntimeError(f"load-test: {error}")
+                return
+            time.sleep(0.05)
+
+
+def prepare(config: appconfig.AppConfig, port: int) -> appconfig.AppConfig:
+    """Each reading yields one command: command i answers reading i, which gives the latency of each reading"""
+    config = copy.deepcopy(config)
+    config.mqtt.host = "127.0.0.1"
+    config.mqtt.port = port
+    config.mqtt.auth = None
+    config.mqtt.failover = []
+    config.mqtt.session_expiry = 0
+    if not config.mqtt.topics.write_command:
+        config.mqtt.topics.write_command = "inverter/cmd/limit"
+
+    command = config.command
+    command.retransmit = 0
+    command.confirm_timeout = 0
+    command.adaptive_throttle.enabled = False
+    for direction in (command.decrease, command.increase):
+        direction.throttle = 0
+        direction.hysteresis = 0
+
+    config.reading.keepSubscribed = False
+    config.ingest.policy = "all"
+    config.redundancy.enabled = False
+    # No files: history and recordings of a load test are of no use
+    config.history.enabled = False
+    config.recording.enabled = False
+    return config
+
+
+def run(args: argparse.Namespace) -> None:
+    # The agent stops with a disconnect
+    logging.getLogger("sec.mqtt").setLevel(logging.ERROR)
+    standin = BrokerStandIn()
+    standin.start()
+
+    config = prepare(appconfig.AppConfig.from_json_file(args.config), standin.port)
+    topic = config.mqtt.topics.read_power
+    command_topic = config.mqtt.topics.write_command
+    standin.watch(topic)
+    standin.watch(command_topic)
+
+    times = schedule(args.pattern, args.rate, args.duration, args.burst)
+    print(f"Pattern: {args.pattern}, rate: {args.rate:g}/s, duration: {args.duration:g}s, readings: {len(times)}")
+    print("Waiting for the setup mode of the agent ...")
+
+    agent = ExportControlAgent(config)
+    generator = LoadGenerator(standin, agent, topic, command_topic, times)
+    generator.start()
+    try:
+        agent.run()
+    finally:
+        standin.stop()
+
+    if generator.error is not None:
+        raise generator.error
+
+    readings = standin.arrivals[topic]
+    commands = standin.arrivals[command_topic]
+    latencies = sorted(c - r for r, c in zip(readings, commands))
+    if not latencies:
+        print("No commands received")
+        return
+
+    span = commands[-1] - readings[0]
+    print(f"{'Readings':>9} | {'Commands':>9} | {'Msgs/s':>8} | {'p50 ms':>8} | {'p99 ms':>8} | {'max ms':>8}")
+    print(f"{len(readings):>9} | {len(commands):>9} | {len(commands) / span:>8.1f} | {percentile(latencies, 0.5) * 1e3:>8.2f} | "
+          f"{percentile(latencies, 0.99) * 1e3:>8.2f} | {latencies[-1] * 1e3:>8.2f}")
+
+    if len(generator.memory) >= 2:
+        # Growth after the first tenth of the run without the arrival records of the measurement itself
+        (t0, m0, r0), (t1, m1, r1) = generator.memory[len(generator.memory) // 10], generator.memory[-1]
+        growth = m1 - m0 - (r1 - r0) * 8
+        print(f"Memory: {m0 / 2**20:.1f} MiB -> {m1 / 2**20:.1f} MiB, growth without measurement: {growth / 2**10:+.0f} KiB "
+              f"({growth / 2**10 / max(t1 - t0, 1e-9) * SECONDS_PER_HOUR:+.0f} KiB/h), peak: {max(m for _, m, _ in generator.memory) / 2**20:.1f} MiB")
+    else:
+        print("Memory: not available on this platform")
@@ -0,0 +1,82 @@
+import argparse
+import io
+import logging
+import queue
+import random
+import statistics
+import time
+import core.appconfig as appconfig
+from logging.handlers import QueueListener
+from core.limit import LimitCalculator
+from core.logsetup import LOG_DATEFMT, LOG_FORMAT, QUEUE_SIZE, DroppingQueueHandler, JsonFormatter
+
+
+class SlowStream(io.StringIO):
+    """Sink that blocks like a congested pipe or docker log driver"""
+
+    def __init__(self, delay: float) -> None:
+        super().__init__()
+        self.delay: float = delay
+
+    def write(self, s: str) -> int:
+        time.sleep(self.delay)
+        return len(s)
+
+
+def add_parser(subparsers) -> None:
+    parser = subparsers.add_parser("log-bench", help="measures the reading callback latency with a slow log sink, direct and queued")
+    parser.add_argument("config", type=str, help="path to config file")
+    parser.add_argument("--sink-delay", type=float, default=5.0, help="milliseconds the sink blocks per log line")
+    parser.add_argument("--messages", type=int, default=500, help="callbacks per mode, each logs one line")
+    parser.add_argument("--json", action="store_true", help="use the json formatter")
+    parser.set_defaults(func=run)
+
+
+def measure(config: appconfig.AppConfig, messages: int, sink_delay: float, use_queue: bool, use_json: bool) -> list[float]:
+    handler = logging.StreamHandler(SlowStream(sink_delay))
+    handler.setFormatter(JsonFormatter() if use_json else logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
+
+    logger = logging.getLogger("sec.bench")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.handlers.clear()
+
+    listener: QueueListener | None = None
+    if use_queue:
+        q: queue.Queue = queue.Queue(QUEUE_SIZE)
+        logger.addHandler(DroppingQueueHandler(q))
+        listener = QueueListener(q, handler)
+        listener.start()
+    else:
+        logger.addHandler(handler)
+
+    calc = LimitCalculator(config)
+    rnd = random.Random(42)
+    latencies: list[float] = []
+
+    # One callback: limit calculation and the log line of a published command
+    for i in range(messages):
+        start = time.perf_counter()
+        result = calc.add_reading(rnd.uniform(-800, 1500), float(i))
+        logger.info(f"Publish command: {result.limit:.2f}")
+        latencies.append(time.perf_counter() - start)
+
+    if listener is not None:
+        listener.stop()
+
+    logger.handlers.clear()
+    return latencies
+
+
+def run(args: argparse.Namespace) -> None:
+    config = appconfig.AppConfig.from_json_file(args.config)
+    delay = args.sink_delay / 1000
+
+    print(f"Sink delay: {args.sink_delay:.1f}ms per line, callbacks: {args.messages}")
+    print(f"{'Mode':<8} | {'p50 us':>10} | {'p99 us':>10} | {'max us':>10}")
+
+    for mode, use_queue in (("direct", False), ("queue", True)):
+        latencies = sorted(measure(config, args.messages, delay, use_queue, args.json))
+        p50 = statistics.median(latencies) * 1e6
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6
+        print(f"{mode:<8} | {p50:>10.1f} | {p99:>10.1f} | {latencies[-1] * 1e6:>10.1f}")
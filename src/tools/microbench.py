@@ -0,0 +1,218 @@
+import argparse
+import copy
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import timeit
+import config.customize as customize
+import core.appconfig as appconfig
+from paho.mqtt import client as mqtt
+from core.helper import ActionScheduler, AppMqttHelper
+from core.limit import LimitCalculator
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "microbench.json")
+REPEAT = 5
+# A real regression is slow again, a busy machine rarely twice
+RETRIES = 2
+WINDOW_SIZES = (1, 10, 60)
+SCHEDULER_ITEMS = (10, 100, 1000)
+
+# Payloads of the examples in docs/Customize.md and their edge cases
+PAYLOADS = {
+    "tasmota": b'{"Time": "2022-10-20T20:58:13", "em": {"power_total": 230.04 }}',
+    "tasmota int": b'{"Time": "2022-10-20T20:58:13", "em": {"power_total": 230 }}',
+    "tasmota no value": b'{"Time": "2022-10-20T20:58:13", "em": {}}',
+    "number": b"230.04",
+}
+
+
+def add_parser(subparsers) -> None:
+    parser = subparsers.add_parser("micro-bench", help="times the hot paths and compares them with a stored baseline")
+    parser.add_argument("config", type=str, help="path to config file")
+    parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE, help="results to compare with (default: tools/microbench.json)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline, 0.25 = 25%%")
+    parser.add_argument("--output", type=str, default=None, help="writes the results to this file")
+    parser.add_argument("--update-baseline", action="store_true", help="writes the results to --baseline instead of comparing")
+    parser.add_argument("--filter", type=str, default=None, help="only cases whose name contains this text")
+    parser.set_defaults(func=run)
+
+
+def measure(fn) -> float:
+    """Nanoseconds per call: best of REPEAT runs, each at least 0.2s long"""
+    timer = timeit.Timer(fn)
+    number = timer.autorange()[0]
+    return min(timer.repeat(REPEAT, number)) / number * 1e9
+
+
+class NullClient:
+    """Stands in for client.publish: messages go nowhere, the result is a sent message"""
+
+    def __init__(self) -> None:
+        self.info = mqtt.MQTTMessageInfo(0)
+        self.info.rc = mqtt.MQTT_ERR_SUCCESS
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None) -> mqtt.MQTTMessageInfo:
+        return self.info
+
+
+def parse_cases(config: appconfig.AppConfig) -> dict:
+    min_power, max_power = config.command.min_power, config.command.max_power
+    cases = {}
+
+    for name, payload in PAYLOADS.items():
+        try:
+            customize.parse_power_payload(payload, min_power, max_power)
+        except Exception as ex:
+            # customize.py is edited for one meter, the other payloads are skipped
+            print(f"Skipped parse_power_payload {name}: {ex.__class__.__name__}")
+            continue
+        cases[f"parse_power_payload {name}"] = lambda payload=payload: customize.parse_power_payload(payload, min_power, max_power)
+
+    return cases
+
+
+def limit_cases(config: appconfig.AppConfig) -> dict:
+    rnd = random.Random(42)
+    values = [round(rnd.gauss(150, 120), 2) for _ in range(4096)]
+    cases = {}
+
+    for smoothing in (appconfig.PowerReadingSmoothingType.NONE, appconfig.PowerReadingSmoothingType.AVG):
+        for size in WINDOW_SIZES if smoothing == appconfig.PowerReadingSmoothingType.AVG else (1,):
+            cfg = copy.deepcopy(config)
+            cfg.reading.smoothing = smoothing
+            cfg.reading.smoothingSampleSize = size
+            cfg.reading.smoothingSampleSizeDecrease = size
+            cfg.reading.smoothingSampleSizeIncrease = size
+            calc = LimitCalculator(cfg)
+            # One reading per second, the values repeat every 4096 readings
+            clock = iter(range(sys.maxsize))
+
+            def add(calc=calc, clock=clock) -> None:
+                i = next(clock)
+                calc.add_reading(values[i & 4095], float(i))
+
+            name = "none" if smoothing == appconfig.PowerReadingSmoothingType.NONE else f"avg {size}"
+            cases[f"add_reading {name}"] = add
+
+    return cases
+
+
+def meta_cases(config: appconfig.AppConfig) -> dict:
+    config = copy.deepcopy(config)
+    config.meta.discovery.enabled = True
+    for name in vars(config.meta.telemetry):
+        setattr(config.meta.telemetry, name, True)
+
+    helper = AppMqttHelper(config)
+    # Only publish is replaced: apply_config still needs the paho client
+    helper.client.publish = NullClient().publish
+
+    return {
+        "publish_meta_teles": lambda: helper.publish_meta_teles(-12.5, -10.25, 3.5, 640.0),
+        # Same prefix: topics and discovery payloads are built again, no reconnect
+        "discovery build": lambda: helper.apply_config(config),
+        "discovery publish": helper.publish_meta_ha_discovery,
+    }
+
+
+def scheduler_cases() -> dict:
+    cases = {}
+
+    for count in SCHEDULER_ITEMS:
+        idle = ActionScheduler()
+        due = ActionScheduler()
+        for i in range(count):
+            idle.schedule(3600 + i, print)
+            due.schedule(3600 + i, print)
+
+        item = (datetime.datetime.min, print)
+
+        def one_due(scheduler=due, item=item) -> None:
+            # One item is due: all items are scanned for the next time
+            scheduler.items.append(item)
+            scheduler.nextTime = item[0]
+            scheduler.get_due()
+
+        cases[f"get_due idle {count}"] = idle.get_due
+        cases[f"get_due one due {count}"] = one_due
+
+    return cases
+
+
+def slower(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    return [name for name, ns in results.items() if name in baseline and ns / baseline[name] - 1 > tolerance]
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Prints results and baseline, returns the names of the cases slower than the tolerance"""
+    regressions = []
+    print(f"{'Case':<38} | {'ns/op':>10} | {'Baseline':>10} | {'Change':>8} |")
+
+    for name, ns in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<38} | {ns:>10.1f} | {'-':>10} | {'-':>8} | new")
+            continue
+
+        change = ns / base - 1
+        status = ""
+        if change > tolerance:
+            status = "REGRESSION"
+            regressions.append(name)
+        print(f"{name:<38} | {ns:>10.1f} | {base:>10.1f} | {change:>+7.1%} | {status}")
+
+    return regressions
+
+
+def run(args: argparse.Namespace) -> None:
+    logging.getLogger("sec.mqtt").setLevel(logging.ERROR)
+    config = appconfig.AppConfig.from_json_file(args.config)
+
+    cases = {}
+    cases.update(parse_cases(config))
+    cases.update(limit_cases(config))
+    cases.update(meta_cases(config))
+    cases.update(scheduler_cases())
+    if args.filter:
+        cases = {name: fn for name, fn in cases.items() if args.filter in name}
+
+    results = {name: round(measure(fn), 1) for name, fn in cases.items()}
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "results": results,
+    }
+
+    baseline = {}
+    if not args.update_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r") as fs:
+            baseline = json.load(fs)
+        if baseline.get("python") != report["python"] or baseline.get("machine") != report["machine"]:
+            print(f"Baseline from python {baseline.get('python')} on {baseline.get('machine')}, "
+                  f"running python {report['python']} on {report['machine']}: the comparison is only a hint")
+
+    base_results = baseline.get("results", {})
+    for _ in range(RETRIES):
+        # A new baseline takes the best of all passes, a comparison measures the suspects again
+        names = list(cases) if args.update_baseline else slower(results, base_results, args.tolerance)
+        for name in names:
+            results[name] = min(results[name], round(measure(cases[name]), 1))
+
+    regressions = compare(results, base_results, args.tolerance)
+
+    for path in (args.output, args.baseline if args.update_baseline else None):
+        if path:
+            with open(path, "w") as fs:
+                json.dump(report, fs, indent=2)
+
+    if args.update_baseline:
+        print(f"Baseline written: {args.baseline}")
+    elif not baseline:
+        print(f"No baseline: {args.baseline}")
+    elif regressions:
+        sys.exit(f"{len(regressions)} case(s) more than {args.tolerance:.0%} slower than the baseline")
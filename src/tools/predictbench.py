@@ -0,0 +1,32 @@
+import argparse
+import copy
+import core.appconfig as appconfig
+from tools.simulate import PROFILES, simulate
+
+
+def add_parser(subparsers) -> None:
+    parser = subparsers.add_parser("predict-bench", help="compares trend prediction against the plain controller on load profiles")
+    parser.add_argument("config", type=str, help="path to config file")
+    parser.add_argument("--delay", type=float, default=6.0, help="simulated inverter actuation delay in seconds")
+    parser.add_argument("--horizon", type=float, default=None, help="prediction horizon in seconds, defaults to --delay")
+    parser.set_defaults(func=run)
+
+
+def run(args: argparse.Namespace) -> None:
+    config = appconfig.AppConfig.from_json_file(args.config)
+    horizon = args.delay if args.horizon is None else args.horizon
+
+    plain = copy.deepcopy(config)
+    plain.reading.predictionHorizon = 0.0
+
+    predicted = copy.deepcopy(config)
+    predicted.reading.predictionHorizon = horizon
+
+    print(f"Inverter delay: {args.delay:.1f}s, prediction horizon: {horizon:.1f}s")
+    print(f"{'Profile':<10} | {'Mode':<9} | {'Export Wh':>10} | {'Import Wh':>10} | {'Commands':>8}")
+
+    for name, factory in PROFILES.items():
+        profile = factory()
+        for mode, cfg in (("plain", plain), ("predicted", predicted)):
+            r = simulate(cfg, profile, args.delay)
+            print(f"{name:<10} | {mode:<9} | {r.export_wh:>10.2f} | {r.import_wh:>10.2f} | {r.commands:>8}")
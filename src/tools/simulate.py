@@ -0,0 +1,194 @@
+import csv
+import math
+import os
+from datetime import datetime
+import core.appconfig as appconfig
+import core.recording as recording
+from core.limit import LimitCalculator
+from typing import Callable, Iterable, List, Tuple
+
+# A profile is a list of (seconds, house load in watts, available solar power in watts)
+Profile = List[Tuple[float, float, float]]
+
+
+class SimulatedInverter:
+    """Inverter that applies a limit 'delay' seconds after the command and produces min(limit, solar)"""
+
+    def __init__(self, limit: float, delay: float) -> None:
+        self.delay: float = delay
+        self.limit: float = limit
+        self.__pending: List[Tuple[float, float]] = []
+
+    def command(self, t: float, limit: float) -> None:
+        self.__pending.append((t + self.delay, limit))
+
+    def output(self, t: float, solar: float) -> float:
+        while self.__pending and self.__pending[0][0] <= t:
+            self.limit = self.__pending.pop(0)[1]
+        return max(0.0, min(self.limit, solar))
+
+
+class SimulationResult:
+    def __init__(self) -> None:
+        self.export_wh: float = 0.0
+        self.import_wh: float = 0.0
+        self.commands: int = 0
+        self.readings: int = 0
+        self.duration: float = 0.0
+
+    def to_json(self) -> dict:
+        return {
+            "exportWh": round(self.export_wh, 3),
+            "importWh": round(self.import_wh, 3),
+            "commands": self.commands,
+            "readings": self.readings,
+            "hours": round(self.duration / 3600, 3)
+        }
+
+
+def simulate(config: appconfig.AppConfig, profile: Profile, delay: float) -> SimulationResult:
+    """Runs the LimitCalculator against a simulated inverter. Energy is integrated (trapezoidal)
+    from the grid power the meter would have reported."""
+    calc = LimitCalculator(config)
+    inverter = SimulatedInverter(config.command.max_power, delay)
+    result = SimulationResult()
+    last: Tuple[float, float] | None = None
+
+    for t, load, solar in profile:
+        grid = load - inverter.output(t, solar)
+        r = calc.add_reading(grid, now=t)
+        result.readings += 1
+
+        if r.command is not None:
+            inverter.command(t, r.limit)
+            result.commands += 1
+
+        if last is not None:
+            dt = t - last[0]
+            integrate_energy(result, last[1], grid, dt)
+            result.duration += dt
+
+        last = (t, grid)
+
+    return result
+
+
+def integrate_energy(result: SimulationResult, p0: float, p1: float, dt: float) -> None:
+    # Trapezoid split at the zero crossing so export and import do not cancel out
+    if p0 >= 0 and p1 >= 0:
+        result.import_wh += (p0 + p1) / 2 * dt / 3600
+    elif p0 <= 0 and p1 <= 0:
+        result.export_wh += -(p0 + p1) / 2 * dt / 3600
+    else:
+        tz = dt * abs(p0) / (abs(p0) + abs(p1))
+        part0 = p0 / 2 * tz / 3600
+        part1 = p1 / 2 * (dt - tz) / 3600
+        for part in (part0, part1):
+            if part >= 0:
+                result.import_wh += part
+            else:
+                result.export_wh -= part
+
+
+def profile_from_readings(readings: Iterable[Tuple[float, float]], solar: float) -> Profile:
+    """Recorded meter readings only contain the grid power: treat them as house load with constant solar power"""
+    return [(t, v, solar) for t, v in readings]
+
+
+def load_history(path: str, solar: float) -> Profile:
+    """Profile from a recording (directory or chunk file, see core.recording) or a csv file (see load_history_csv)"""
+    if os.path.isdir(path) or path.endswith(recording.CHUNK_SUFFIX):
+        profile: Profile = []
+        start: float | None = None
+        for timestamps, values in recording.read_recording(path):
+            if start is None:
+                start = float(timestamps[0])
+            profile.extend((float(t) - start, float(v), solar) for t, v in zip(timestamps, values))
+        if not profile:
+            raise ValueError(f"No readings in recording: '{path}'")
+        return profile
+
+    return load_history_csv(path, solar)
+
+
+def load_history_csv(path: str, solar: float) -> Profile:
+    """Reads recorded meter history as profile. Rows are 'timestamp,power[,inverter]' with the timestamp in seconds
+    or as ISO 8601 date. Recorded grid power contains the inverter output at that time: with the inverter column
+    the house load is restored, otherwise the grid power is treated as load. A header row is skipped"""
+    profile: Profile = []
+    start: float | None = None
+
+    with open(path, "r", newline="") as fs:
+        for row in csv.reader(fs):
+            if not row or row[0].startswith("#"):
+                continue
+
+            try:
+                t = parse_timestamp(row[0].strip())
+                grid = float(row[1])
+                inverter = float(row[2]) if len(row) > 2 and row[2].strip() else 0.0
+            except ValueError:
+                if not profile:
+                    continue
+                raise ValueError(f"Invalid history row: '{','.join(row)}'")
+
+            if start is None:
+                start = t
+
+            profile.append((t - start, grid + inverter, solar))
+
+    if not profile:
+        raise ValueError(f"No readings in history: '{path}'")
+
+    return profile
+
+
+def parse_timestamp(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def profile_kettle(interval: float = 2.0, base: float = 250.0, kettle: float = 2000.0, solar: float = 900.0, cycles: int = 5) -> Profile:
+    """Base load with a kettle switching on for 90s and off for 150s"""
+    profile: Profile = []
+    t = 0.0
+    for _ in range(cycles):
+        for duration, load in ((150.0, base), (90.0, base + kettle)):
+            end = t + duration
+            while t < end:
+                profile.append((t, load, solar))
+                t += interval
+    return profile
+
+
+def profile_ramp(interval: float = 2.0, base: float = 300.0, amplitude: float = 600.0, period: float = 240.0, solar: float = 1000.0, cycles: int = 5) -> Profile:
+    """Slow load ramps (washing machine heater, cooking) as a triangle wave"""
+    profile: Profile = []
+    t = 0.0
+    end = period * cycles
+    while t < end:
+        phase = (t % period) / period
+        tri = 1 - abs(2 * phase - 1)
+        profile.append((t, base + amplitude * tri, solar))
+        t += interval
+    return profile
+
+
+def profile_clouds(interval: float = 2.0, load: float = 350.0, solar: float = 1000.0, period: float = 180.0, cycles: int = 5) -> Profile:
+    """Constant load while passing clouds modulate the solar power"""
+    profile: Profile = []
+    t = 0.0
+    end = period * cycles
+    while t < end:
+        profile.append((t, load, solar * (0.55 + 0.45 * math.cos(2 * math.pi * t / period))))
+        t += interval
+    return profile
+
+
+PROFILES: dict[str, Callable[[], Profile]] = {
+    "kettle": profile_kettle,
+    "ramp": profile_ramp,
+    "clouds": profile_clouds
+}
@@ -0,0 +1,316 @@
+import socket
+import socketserver
+import threading
+import time
+from array import array
+from collections import Counter
+from paho.mqtt import client as mqtt
+
+# Packet types (upper nibble of the fixed header)
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+PROP_TOPIC_ALIAS = 0x23
+PROP_TOPIC_ALIAS_MAXIMUM = 0x22
+
+# MQTTv5 property ids by the size of their value, to skip the ones the stand-in does not use
+PROPS_BYTE = frozenset((0x01, 0x17, 0x19, 0x24, 0x25, 0x28, 0x29, 0x2A))
+PROPS_TWO_BYTE = frozenset((0x13, 0x21, 0x22, 0x23))
+PROPS_FOUR_BYTE = frozenset((0x02, 0x11, 0x18, 0x27))
+PROPS_VARINT = frozenset((0x0B,))
+PROPS_STRING = frozenset((0x03, 0x08, 0x09, 0x12, 0x15, 0x16, 0x1A, 0x1C, 0x1F))
+PROPS_STRING_PAIR = frozenset((0x26,))
+
+
+def encode_length(length: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        out.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(out)
+
+
+def decode_length(data: bytes, pos: int) -> tuple[int, int]:
+    """Variable byte integer at pos: value and position after it"""
+    length = 0
+    for shift in range(0, 28, 7):
+        byte = data[pos]
+        pos += 1
+        length |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+    return length, pos
+
+
+def read_topic_alias(data: bytes, pos: int) -> tuple[int, int]:
+    """Reads the MQTTv5 properties at pos: topic alias (0 if none) and position after the properties"""
+    length, pos = decode_length(data, pos)
+    end = pos + length
+    alias = 0
+
+    while pos < end:
+        prop = data[pos]
+        pos += 1
+        if prop == PROP_TOPIC_ALIAS:
+            alias = int.from_bytes(data[pos:pos + 2], "big")
+            pos += 2
+        elif prop in PROPS_BYTE:
+            pos += 1
+        elif prop in PROPS_TWO_BYTE:
+            pos += 2
+        elif prop in PROPS_FOUR_BYTE:
+            pos += 4
+        elif prop in PROPS_VARINT:
+            pos = decode_length(data, pos)[1]
+        elif prop in PROPS_STRING:
+            pos += 2 + int.from_bytes(data[pos:pos + 2], "big")
+        elif prop in PROPS_STRING_PAIR:
+            pos += 2 + int.from_bytes(data[pos:pos + 2], "big")
+            pos += 2 + int.from_bytes(data[pos:pos + 2], "big")
+        else:
+            raise IndexError(f"Unknown property: {prop}")
+
+    return alias, end
+
+
+def matches(topic_filter: str, topic: str) -> bool:
+    # topic_matches_sub builds a matcher per call, most filters have no wildcard
+    if "+" not in topic_filter and "#" not in topic_filter:
+        return topic_filter == topic
+    return mqtt.topic_matches_sub(topic_filter, topic)
+
+
+def packet(header: int, body: bytes) -> bytes:
+    return bytes([header]) + encode_length(len(body)) + body
+
+
+class Session:
+    """One connected client: its subscriptions and the topic aliases it sent"""
+
+    def __init__(self, conn: socket.socket) -> None:
+        self.conn: socket.socket = conn
+        self.version: int = 4
+        self.filters: set[str] = set()
+        self.aliases: dict[int, str] = {}
+        self.lock = threading.Lock()
+
+    def send(self, data: bytes) -> None:
+        # Forwarded messages are written by the threads of other clients
+        with self.lock:
+            self.conn.sendall(data)
+
+    def forward(self, topic: str, payload: bytes, retain: bool) -> None:
+        """Delivers with qos 0: subscribers send no acknowledgements"""
+        name = topic.encode()
+        body = len(name).to_bytes(2, "big") + name + (b"\x00" if self.version >= 5 else b"") + payload
+        self.send(packet(PUBLISH << 4 | (1 if retain else 0), body))
+
+
+class BrokerStandIn:
+    """Minimal MQTT 3.1.1 / 5 server for benchmarks and load tests: accepts every client, acknowledges every packet
+    and counts the bytes it receives. Messages are forwarded to matching subscribers with qos 0, retained messages
+    are kept. No sessions survive a disconnect, no last will, no wildcard checks of published topics"""
+
+    def __init__(self, port: int = 0, alias_max: int = 0) -> None:
+        self.alias_max: int = alias_max
+        self.packets: Counter = Counter()
+        self.bytes: Counter = Counter()
+        # Arrival times (perf_counter) of the messages on watched topics, 8 bytes each
+        self.arrivals: dict[str, array] = {}
+        self.__retained: dict[str, bytes] = {}
+        self.__lock = threading.Lock()
+        self.__sessions: dict[socket.socket, Session] = {}
+
+        standin = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self) -> None:
+                standin.serve(self.request)
+
+        class Server(socketserver.ThreadingTCPServer):
+            # A restarted stand-in can take over the port at once
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self.__server = Server(("127.0.0.1", port), Handler)
+        self.port: int = self.__server.server_address[1]
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="standin", daemon=True)
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def stop(self) -> None:
+        """Stops listening and drops all clients, like a crashed broker"""
+        self.__server.shutdown()
+        self.__server.server_close()
+        with self.__lock:
+            for conn in self.__sessions:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self.__sessions.clear()
+
+    def reset_counters(self) -> None:
+        with self.__lock:
+            self.packets.clear()
+            self.bytes.clear()
+            for times in self.arrivals.values():
+                del times[:]
+
+    def watch(self, topic: str) -> None:
+        """Records the arrival time of each message on topic in arrivals"""
+        with self.__lock:
+            self.arrivals.setdefault(topic, array("d"))
+
+    def has_subscriber(self, topic: str) -> bool:
+        with self.__lock:
+            return any(matches(f, topic) for s in self.__sessions.values() for f in s.filters)
+
+    def serve(self, conn: socket.socket) -> None:
+        # Like real brokers: small packets are sent at once instead of waiting for the ack of the previous one
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        session = Session(conn)
+        with self.__lock:
+            self.__sessions[conn] = session
+        try:
+            self.__serve(session)
+        except (OSError, IndexError):
+            # Connection dropped, IndexError: in the middle of a packet
+            pass
+        finally:
+            with self.__lock:
+                self.__sessions.pop(conn, None)
+
+    def __serve(self, session: Session) -> None:
+        fs = session.conn.makefile("rb")
+
+        while True:
+            first = fs.read(1)
+            if not first:
+                return
+
+            length, size_bytes = 0, 0
+            for shift in range(0, 28, 7):
+                byte = fs.read(1)[0]
+                size_bytes += 1
+                length |= (byte & 0x7F) << shift
+                if not byte & 0x80:
+                    break
+
+            body = fs.read(length)
+            kind = first[0] >> 4
+            with self.__lock:
+                self.packets[kind] += 1
+                self.bytes[kind] += 1 + size_bytes + length
+
+            if kind == CONNECT:
+                session.version = body[6]
+                session.send(self.__connack(session.version))
+            elif kind == PUBLISH:
+                self.__publish(session, first[0], body)
+            elif kind == PUBREL:
+                session.send(packet(PUBCOMP << 4, body[0:2]))
+            elif kind == SUBSCRIBE or kind == UNSUBSCRIBE:
+                self.__subscribe(session, kind, body)
+            elif kind == PINGREQ:
+                session.send(packet(PINGRESP << 4, b""))
+            elif kind == DISCONNECT:
+                return
+
+    def __publish(self, session: Session, header: int, body: bytes) -> None:
+        arrival = time.perf_counter()
+        qos = (header >> 1) & 3
+        retain = bool(header & 1)
+
+        topic_len = int.from_bytes(body[0:2], "big")
+        topic = body[2:2 + topic_len].decode()
+        pos = 2 + topic_len
+        pid = body[pos:pos + 2] if qos else b""
+        pos += len(pid)
+
+        if session.version >= 5:
+            alias, pos = read_topic_alias(body, pos)
+            if alias:
+                # First message of an alias: topic and alias, later ones: empty topic
+                if topic:
+                    session.aliases[alias] = topic
+                else:
+                    topic = session.aliases[alias]
+
+        if qos:
+            session.send(packet(PUBACK << 4 if qos == 1 else PUBREC << 4, pid))
+
+        payload = body[pos:]
+        with self.__lock:
+            times = self.arrivals.get(topic)
+            if times is not None:
+                times.append(arrival)
+            if retain:
+                if payload:
+                    self.__retained[topic] = payload
+                else:
+                    self.__retained.pop(topic, None)
+            targets = [s for s in self.__sessions.values() if any(matches(f, topic) for f in s.filters)]
+
+        for target in targets:
+            try:
+                target.forward(topic, payload, False)
+            except OSError:
+                # The subscriber is gone, its own thread cleans up
+                pass
+
+    def __subscribe(self, session: Session, kind: int, body: bytes) -> None:
+        pos = 2
+        if session.version >= 5:
+            pos = read_topic_alias(body, pos)[1]
+
+        # SUBSCRIBE filters are followed by an options byte
+        filters: list[str] = []
+        while pos < len(body):
+            size = int.from_bytes(body[pos:pos + 2], "big")
+            filters.append(body[pos + 2:pos + 2 + size].decode())
+            pos += 2 + size + (1 if kind == SUBSCRIBE else 0)
+
+        with self.__lock:
+            if kind == SUBSCRIBE:
+                session.filters.update(filters)
+                retained = [(t, p) for t, p in self.__retained.items() if any(matches(f, t) for f in filters)]
+            else:
+                session.filters.difference_update(filters)
+                retained = []
+
+        session.send(self.__suback(kind, session.version, body[0:2], len(filters)))
+        for topic, payload in retained:
+            session.forward(topic, payload, True)
+
+    def __connack(self, version: int) -> bytes:
+        if version < 5:
+            return packet(CONNACK << 4, b"\x00\x00")
+
+        props = b""
+        if self.alias_max:
+            props = bytes([PROP_TOPIC_ALIAS_MAXIMUM]) + self.alias_max.to_bytes(2, "big")
+        return packet(CONNACK << 4, b"\x00\x00" + encode_length(len(props)) + props)
+
+    @staticmethod
+    def __suback(kind: int, version: int, pid: bytes, filters: int) -> bytes:
+        # One granted qos 0 (or success) per topic filter
+        header = SUBACK << 4 if kind == SUBSCRIBE else UNSUBACK << 4
+        if version < 5:
+            return packet(header, pid + (b"\x00" * filters if kind == SUBSCRIBE else b""))
+        return packet(header, pid + b"\x00" + b"\x00" * filters)
@@ -0,0 +1,155 @@
+import argparse
+import copy
+import itertools
+import json
+import os
+import core.appconfig as appconfig
+from concurrent.futures import ProcessPoolExecutor
+from tools.simulate import Profile, SimulationResult, load_history, simulate
+from typing import Dict, List, Tuple
+
+# Parameters of the search space and where they live in config.json
+PARAMETERS: Dict[str, Tuple[str, type]] = {
+    "target": ("command", int),
+    "hysteresis": ("command", float),
+    "throttle": ("command", int),
+    "smoothingSampleSize": ("reading", int),
+    "offset": ("reading", float)
+}
+
+# Direction specific values would shadow the swept command values
+SHADOWED: Dict[str, List[str]] = {
+    "hysteresis": ["decrease", "increase"],
+    "throttle": ["decrease", "increase"],
+    "smoothingSampleSize": ["smoothingSampleSizeDecrease", "smoothingSampleSizeIncrease"]
+}
+
+Candidate = Dict[str, float]
+
+# Set once per worker process by the pool initializer, the profile is not pickled per candidate
+worker_state: dict = {}
+
+
+def add_parser(subparsers) -> None:
+    parser = subparsers.add_parser("tune", help="searches the best command and reading settings on recorded meter history")
+    parser.add_argument("config", type=str, help="path to config file, the base of all candidates")
+    parser.add_argument("history", type=str, help="recording directory or csv file with rows 'timestamp,power[,inverter]'")
+    parser.add_argument("space", type=str, help="json file with a list of values per parameter: " + ", ".join(PARAMETERS))
+    parser.add_argument("--solar", type=float, default=None, help="available solar power in watts, defaults to command.maxPower")
+    parser.add_argument("--delay", type=float, default=6.0, help="simulated inverter actuation delay in seconds")
+    parser.add_argument("--import-weight", type=float, default=0.1, help="score of one imported Wh, one exported Wh scores 1")
+    parser.add_argument("--command-weight", type=float, default=0.01, help="score of one command")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the cpu count")
+    parser.add_argument("--top", type=int, default=10, help="number of ranked candidates to print")
+    parser.add_argument("--output", type=str, default=None, help="write the best settings as config.json fragment to this file")
+    parser.set_defaults(func=run)
+
+
+def load_space(path: str) -> List[Candidate]:
+    with open(path, "r") as fs:
+        j_space = json.load(fs)
+
+    if type(j_space) is not dict or not j_space:
+        raise ValueError(f"Invalid search space: '{path}'")
+
+    names: List[str] = []
+    values: List[list] = []
+
+    for name, j_values in j_space.items():
+        if name not in PARAMETERS:
+            raise ValueError(f"Invalid search space parameter: '{name}'")
+
+        if type(j_values) is not list or not j_values:
+            raise ValueError(f"Invalid search space values of '{name}': '{j_values}'")
+
+        cast = PARAMETERS[name][1]
+        names.append(name)
+        values.append([cast(v) for v in j_values])
+
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def apply_candidate(base: dict, candidate: Candidate) -> dict:
+    j_config = copy.deepcopy(base)
+
+    for name, value in candidate.items():
+        segment = j_config[PARAMETERS[name][0]]
+        segment[name] = value
+
+        if name in SHADOWED:
+            for key in SHADOWED[name]:
+                shadow = segment.get(key)
+                if type(shadow) is dict:
+                    shadow.pop(name, None)
+                elif shadow is not None:
+                    segment[key] = None
+
+        # A sample size needs avg smoothing to take effect
+        if name == "smoothingSampleSize":
+            segment["smoothing"] = "avg"
+
+    return j_config
+
+
+def to_fragment(candidate: Candidate) -> dict:
+    fragment: dict = {}
+    for name, value in candidate.items():
+        segment = fragment.setdefault(PARAMETERS[name][0], {})
+        segment[name] = value
+        if name == "smoothingSampleSize":
+            segment["smoothing"] = "avg"
+    return fragment
+
+
+def score(result: SimulationResult, import_weight: float, command_weight: float) -> float:
+    return result.export_wh + import_weight * result.import_wh + command_weight * result.commands
+
+
+def init_worker(base: dict, profile: Profile, delay: float) -> None:
+    worker_state["base"] = base
+    worker_state["profile"] = profile
+    worker_state["delay"] = delay
+
+
+def evaluate(candidate: Candidate) -> SimulationResult:
+    config = appconfig.AppConfig.from_json(apply_candidate(worker_state["base"], candidate))
+    return simulate(config, worker_state["profile"], worker_state["delay"])
+
+
+def run(args: argparse.Namespace) -> None:
+    with open(args.config, "r") as fs:
+        base = json.load(fs)
+
+    config = appconfig.AppConfig.from_json(base)
+    solar = config.command.max_power if args.solar is None else args.solar
+    profile = load_history(args.history, solar)
+    candidates = load_space(args.space)
+
+    # Fail early on invalid candidates instead of inside the pool
+    for candidate in candidates:
+        appconfig.AppConfig.from_json(apply_candidate(base, candidate))
+
+    workers = args.workers if args.workers is not None else os.cpu_count() or 1
+    print(f"Readings: {len(profile)}, hours: {profile[-1][0] / 3600:.2f}, candidates: {len(candidates)}, workers: {workers}")
+
+    chunksize = max(1, len(candidates) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(base, profile, args.delay)) as pool:
+        results = list(pool.map(evaluate, candidates, chunksize=chunksize))
+
+    ranked = sorted(zip(candidates, results), key=lambda x: score(x[1], args.import_weight, args.command_weight))
+    names = list(candidates[0])
+
+    print(" | ".join([f"{'Rank':>4}"] + [f"{n:>10}" for n in names] + [f"{'Export Wh':>10}", f"{'Import Wh':>10}", f"{'Commands':>8}", f"{'Score':>10}"]))
+    for rank, (candidate, r) in enumerate(ranked[:args.top], 1):
+        seg = [f"{rank:>4}"] + [f"{candidate[n]:>10}" for n in names]
+        seg += [f"{r.export_wh:>10.2f}", f"{r.import_wh:>10.2f}", f"{r.commands:>8}", f"{score(r, args.import_weight, args.command_weight):>10.2f}"]
+        print(" | ".join(seg))
+
+    fragment = json.dumps(to_fragment(ranked[0][0]), indent=4)
+
+    if args.output is None:
+        print(fragment)
+    else:
+        with open(args.output, "w") as fs:
+            fs.write(fragment + "\n")
+        print(f"Best settings written to: {args.output}")
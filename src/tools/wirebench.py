@@ -0,0 +1,91 @@
+import argparse
+import copy
+import logging
+import random
+import threading
+import core.appconfig as appconfig
+from paho.mqtt import client as mqtt
+from core.helper import AppMqttHelper
+from tools.standin import PUBLISH, BrokerStandIn
+
+SYNC_TOPIC = "sec/bench/sync"
+CONNECT_TIMEOUT = 5
+
+# Name, protocol, topic alias maximum announced by the broker
+MODES = (
+    ("v3.1.1", mqtt.MQTTv311, 0),
+    ("v5", mqtt.MQTTv5, 0),
+    ("v5 alias", mqtt.MQTTv5, 10)
+)
+
+
+def add_parser(subparsers) -> None:
+    parser = subparsers.add_parser("wire-bench", help="measures the bytes on the wire of telemetry and commands against a local broker stand-in")
+    parser.add_argument("config", type=str, help="path to config file")
+    parser.add_argument("--readings", type=int, default=1000, help="readings to publish, each with its telemetry and a command")
+    parser.add_argument("--prefix", type=str, default=None, help="overrides meta.prefix")
+    parser.set_defaults(func=run)
+
+
+def measure(config: appconfig.AppConfig, readings: int, protocol: int, alias_max: int) -> tuple[int, int]:
+    """Bytes and count of the PUBLISH packets received by the stand-in"""
+    standin = BrokerStandIn(alias_max=alias_max)
+    standin.start()
+
+    config = copy.deepcopy(config)
+    config.mqtt.host = "127.0.0.1"
+    config.mqtt.port = standin.port
+    config.mqtt.protocol = protocol
+    config.mqtt.session_expiry = 0
+    config.mqtt.auth = None
+    config.command.qos = 0
+
+    helper = AppMqttHelper(config)
+    connected = threading.Event()
+    helper.on_connect(lambda session_present: connected.set(), None)
+    helper.connect()
+    helper.client.loop_start()
+
+    try:
+        if not connected.wait(CONNECT_TIMEOUT):
+            raise RuntimeError("wire-bench: No connection to the broker stand-in")
+
+        standin.reset_counters()
+        rnd = random.Random(42)
+        for _ in range(readings):
+            reading = rnd.uniform(-800, 1500)
+            limit = rnd.uniform(0, 100)
+            helper.publish_meta_teles(reading, reading, reading, limit)
+            helper.publish_command(f"{limit:.2f}")
+
+        # All earlier messages are received once the stand-in acknowledged this one
+        helper.client.publish(SYNC_TOPIC, "1", 1).wait_for_publish(CONNECT_TIMEOUT)
+        return standin.bytes[PUBLISH], standin.packets[PUBLISH] - 1
+    finally:
+        helper.client.disconnect()
+        helper.client.loop_stop()
+        standin.stop()
+
+
+def run(args: argparse.Namespace) -> None:
+    # Each mode ends with a disconnect
+    logging.getLogger("sec.mqtt").setLevel(logging.ERROR)
+    config = appconfig.AppConfig.from_json_file(args.config)
+    if args.prefix is not None:
+        config.meta.prefix = args.prefix
+
+    # Every telemetry topic, so the result does not depend on the telemetry settings of the config
+    for name in vars(config.meta.telemetry):
+        setattr(config.meta.telemetry, name, True)
+    if not config.mqtt.topics.write_command:
+        config.mqtt.topics.write_command = "inverter/cmd/limit"
+
+    print(f"Prefix: '{config.meta.prefix}', command topic: '{config.mqtt.topics.write_command}', readings: {args.readings}")
+    print(f"{'Mode':<10} | {'Messages':>9} | {'Bytes':>10} | {'Bytes/msg':>9} | {'Saved':>6}")
+
+    baseline = 0
+    for name, protocol, alias_max in MODES:
+        # The sync message is counted in the bytes, it is the same in every mode
+        size, count = measure(config, args.readings, protocol, alias_max)
+        baseline = baseline or size
+        print(f"{name:<10} | {count:>9} | {size:>10} | {size / max(count, 1):>9.1f} | {(1 - size / baseline) * 100:>5.1f}%")
@@ -0,0 +1,17 @@
+import json
+import os
+import pytest
+import core.appconfig as appconfig
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), "..", "src", "config", "config.json")
+
+
+@pytest.fixture
+def app_config() -> appconfig.AppConfig:
+    """The shipped config template with a broker and a meter topic"""
+    with open(TEMPLATE, "r", encoding="utf-8-sig") as fs:
+        jf = json.load(fs)
+
+    jf["mqtt"]["host"] = "localhost"
+    jf["mqtt"]["topics"]["readPower"] = "meter/power"
+    return appconfig.AppConfig.from_json(jf)
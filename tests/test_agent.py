@@ -0,0 +1,146 @@
+import copy
+import signal
+import socket
+import threading
+import time
+import pytest
+import core.agent
+import core.appconfig as appconfig
+from paho.mqtt import client as mqtt
+from core.agent import ExportControlAgent
+from tools.loadtest import LoadGenerator, prepare
+from tools.standin import BrokerStandIn
+
+
+@pytest.fixture
+def standin():
+    standin = BrokerStandIn()
+    standin.start()
+    yield standin
+    standin.stop()
+
+
+@pytest.fixture
+def signals():
+    # run() installs handlers for SIGTERM and SIGUSR1 that refer to the agent
+    names = [name for name in ("SIGTERM", "SIGUSR1") if hasattr(signal, name)]
+    saved = {getattr(signal, name): signal.getsignal(getattr(signal, name)) for name in names}
+    yield
+    for s, handler in saved.items():
+        signal.signal(s, handler)
+
+
+def closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.parametrize("primary_down", [False, True])
+def test_reading_produces_command(app_config, standin, signals, monkeypatch, primary_down):
+    monkeypatch.setattr(core.agent, "SETUP_MODE_DURATION", 1)
+    config = prepare(app_config, standin.port)
+    if primary_down:
+        # Nothing listens on mqtt.host at startup: the agent goes on with mqtt.failover
+        config.mqtt.port = closed_port()
+        config.mqtt.failover = [appconfig.MqttBrokerConfig("127.0.0.1", standin.port)]
+    topic = config.mqtt.topics.read_power
+    command_topic = config.mqtt.topics.write_command
+    standin.watch(topic)
+    standin.watch(command_topic)
+
+    # Receives the commands like the inverter would
+    payloads = []
+    received = threading.Event()
+    inverter = mqtt.Client(client_id="sec-test-inverter")
+    inverter.on_message = lambda client, userdata, msg: (payloads.append(msg.payload.decode()), received.set())
+    inverter.connect("127.0.0.1", standin.port)
+    inverter.subscribe(command_topic)
+    inverter.loop_start()
+
+    agent = ExportControlAgent(config)
+    generator = LoadGenerator(standin, agent, topic, command_topic, [0.0, 0.5, 1.0])
+    generator.start()
+    try:
+        agent.run()
+    finally:
+        inverter.loop_stop()
+        inverter.disconnect()
+
+    assert generator.error is None
+    assert len(standin.arrivals[topic]) == 3
+    # Unthrottled and without hysteresis: one command per reading. The template commands in percent of maxPower
+    assert len(standin.arrivals[command_topic]) == 3
+    assert received.is_set()
+    assert all(config.command.min_power <= float(p) * config.command.max_power / 100 <= config.command.max_power for p in payloads)
+
+
+def wait_for(condition, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def test_standby_takes_over_expired_lease(app_config, standin, monkeypatch):
+    monkeypatch.setattr(core.agent, "SETUP_MODE_DURATION", 1)
+    # Both agents run on worker threads, signal handlers only work on the main thread
+    monkeypatch.setattr(core.agent.signal, "signal", lambda signum, handler: None)
+
+    agents = {}
+    for instance_id in ("a", "b"):
+        config = prepare(copy.deepcopy(app_config), standin.port)
+        config.mqtt.client_id = f"sec-test-{instance_id}"
+        config.redundancy = appconfig.RedundancyConfig(True, instance_id, lease_interval=1, lease_timeout=3)
+        agents[instance_id] = ExportControlAgent(config)
+    a, b = agents["a"], agents["b"]
+
+    # Watches the lease like the instances do
+    leases = []
+    observer = mqtt.Client(client_id="sec-test-observer")
+    observer.on_message = lambda client, userdata, msg: leases.append((time.monotonic(), msg.payload.decode()))
+    observer.connect("127.0.0.1", standin.port)
+    observer.subscribe(a.helper.topic_meta_core_leader)
+    observer.loop_start()
+
+    threads = {name: threading.Thread(target=agent.run, daemon=True) for name, agent in agents.items()}
+    try:
+        threads["a"].start()
+        assert wait_for(lambda: ("a" in [p for _, p in leases]), 10), "a did not take the lease"
+        threads["b"].start()
+
+        # b stands by while a renews the lease and mirrors the commands of a
+        topic = a.config.mqtt.topics.read_power
+        assert wait_for(lambda: standin.has_subscriber(topic), 10)
+        time.sleep(2)
+        publish = mqtt.Client(client_id="sec-test-meter")
+        publish.connect("127.0.0.1", standin.port)
+        publish.publish(topic, '{"em": {"power_total": -350.0}}')
+        publish.disconnect()
+        assert wait_for(lambda: b.limitcalc.is_calibrated, 5), "b did not mirror the command of a"
+        # The telemetry carries the command in percent with two decimals
+        assert b.limitcalc.last_limit_value == pytest.approx(a.limitcalc.last_limit_value, abs=a.config.command.max_power * 0.00005)
+        assert "b" not in [p for _, p in leases]
+
+        # a is gone without a release: b claims once the lease expired
+        stopped = time.monotonic()
+        a.helper.stop()
+        threads["a"].join(5)
+        assert wait_for(lambda: ("b" in [p for _, p in leases]), 10), "b did not take over"
+        claimed = next(t for t, p in leases if p == "b")
+        # Renewed at most one lease interval before a stopped
+        assert claimed - stopped >= 3 - 1 - 0.5
+    finally:
+        for agent in agents.values():
+            agent.stop()
+        for thread in threads.values():
+            if thread.is_alive():
+                thread.join(5)
+        # A clean stop of the leader releases the lease
+        released = wait_for(lambda: leases[-1][1] == "-b", 5)
+        observer.loop_stop()
+        observer.disconnect()
+
+    assert released, leases
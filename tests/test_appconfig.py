@@ -0,0 +1,24 @@
+import pytest
+import core.appconfig as appconfig
+
+
+def test_power_sources_alike():
+    topics = appconfig.MqttTopicConfig.from_json({
+        "readPower": "meter/main",
+        "readPowerParser": "parse_main_payload",
+        "readPowerSign": -1,
+        "readPowerSources": [{"topic": "meter/heatpump", "sign": -1}]
+    })
+
+    assert [(s.topic, s.parser, s.sign) for s in topics.power_sources] == [
+        ("meter/main", "parse_main_payload", -1), ("meter/heatpump", "parse_power_payload", -1)]
+    assert topics.read_power_topics == ["meter/main", "meter/heatpump"]
+    # Round trip
+    again = appconfig.MqttTopicConfig.from_json(topics.to_json())
+    assert again.to_json() == topics.to_json()
+
+
+@pytest.mark.parametrize("key,value", [("readPowerParser", "not a name"), ("readPowerSign", 2)])
+def test_power_source_invalid(key, value):
+    with pytest.raises(ValueError):
+        appconfig.MqttTopicConfig.from_json({"readPower": "meter/main", key: value})
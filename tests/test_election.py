@@ -0,0 +1,88 @@
+from core.election import LeaseElection, RELEASE_PREFIX
+from core.limit import LimitCalculator
+
+TIMEOUT = 15
+
+
+def test_claim_without_holder():
+    e = LeaseElection("a", TIMEOUT)
+    assert e.should_claim(0)
+    e.claim()
+    assert (e.is_leader, e.holder) == (True, "a")
+    # The echo of the own claim changes nothing
+    assert not e.on_lease("a", False, 1)
+    assert e.is_leader and not e.should_claim(1)
+
+
+def test_standby_takes_over_once_expired():
+    standby = LeaseElection("b", TIMEOUT)
+    assert not standby.on_lease("a", True, 0)
+    assert standby.holder == "a" and not standby.should_claim(0)
+
+    # Renewed every lease interval
+    standby.on_lease("a", False, 5)
+    assert not standby.should_claim(5 + TIMEOUT - 1)
+    assert standby.should_claim(5 + TIMEOUT)
+
+    standby.claim()
+    assert (standby.is_leader, standby.holder) == (True, "b")
+
+
+def test_release_lets_the_standby_claim():
+    standby = LeaseElection("b", TIMEOUT)
+    standby.on_lease("a", True, 0)
+    assert not standby.on_lease(RELEASE_PREFIX + "a", False, 1)
+    assert standby.holder is None and standby.should_claim(1)
+
+    # A release of an earlier run replaced the lease of the leader: it publishes its lease again
+    leader = LeaseElection("a", TIMEOUT)
+    leader.claim()
+    assert leader.on_lease(RELEASE_PREFIX + "a", True, 1)
+    assert leader.is_leader
+
+
+def test_released_lease_is_not_claimed_again():
+    leader = LeaseElection("a", TIMEOUT)
+    leader.claim()
+    leader.release()
+    # The echo of the release while the connection is still up
+    assert not leader.on_lease(RELEASE_PREFIX + "a", False, 1)
+    assert not leader.is_leader and not leader.should_claim(1 + TIMEOUT)
+
+
+def test_same_time_claims_lower_id_keeps_the_lease():
+    a, b = LeaseElection("a", TIMEOUT), LeaseElection("b", TIMEOUT)
+    a.claim()
+    b.claim()
+
+    # Each one receives the claim of the other
+    assert a.on_lease("b", False, 1)
+    assert not b.on_lease("a", False, 1)
+    assert (a.is_leader, b.is_leader, b.holder) == (True, False, "a")
+
+
+def test_retained_own_lease_of_a_previous_connection():
+    e = LeaseElection("a", TIMEOUT)
+    e.on_lease("a", True, 0)
+    assert e.holder is None and e.should_claim(0)
+
+    e.claim()
+    e.reset()
+    assert (e.is_leader, e.holder) == (False, None)
+
+
+def test_mirror_command_follows_the_leader(app_config):
+    leader, standby = LimitCalculator(app_config), LimitCalculator(app_config)
+    readings = [(100.0, -300.0), (101.0, 250.0), (107.0, -80.0), (108.0, -500.0)]
+
+    for now, reading in readings:
+        standby.observe_reading(reading, now)
+        r = leader.add_reading(reading, now)
+        if r.command is not None:
+            standby.mirror_command(r.command, now)
+
+    assert standby.is_calibrated
+    assert (standby.last_limit_value, standby.last_command_time) == (leader.last_limit_value, leader.last_command_time)
+    # Same limit and bucket: a take over decides like the leader would
+    a, b = leader.add_reading(-200.0, 109.0), standby.add_reading(-200.0, 109.0)
+    assert (a.limit, a.command, a.flags, a.tokens) == (b.limit, b.command, b.flags, b.tokens)
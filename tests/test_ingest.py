@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+import core.appconfig as appconfig
+from core.ingest import IngestFilter, to_unix
+
+NOW = 1_700_000_000.0
+
+
+def ingest(**options) -> IngestFilter:
+    return IngestFilter(appconfig.IngestConfig.from_json({"enabled": True, **options}), "meter/power")
+
+
+def test_timestamp_duplicate_needs_same_payload():
+    f = ingest()
+    assert f.accept(b"230.5", NOW, NOW)
+    # Redelivered: same timestamp, same payload
+    assert not f.accept(b"230.5", NOW, NOW)
+    # A second reading within the same second of a one second timestamp
+    assert f.accept(b"231.0", NOW, NOW)
+    assert not f.accept(b"231.0", NOW, NOW)
+    # The same payload with a new timestamp is a new reading
+    assert f.accept(b"230.5", NOW + 1, NOW + 1)
+    assert (f.stats.accepted, f.stats.duplicate) == (3, 2)
+
+
+def test_hash_duplicate_only_when_redelivered():
+    f = ingest(dedupe="hash")
+    # A steady meter sends the same payload again
+    assert f.accept(b"0.0", None, NOW)
+    assert f.accept(b"0.0", None, NOW + 1)
+    # The retained reading sent again on subscribe
+    assert not f.accept(b"0.0", None, NOW + 2, redelivered=True)
+    assert f.accept(b"12.0", None, NOW + 3, redelivered=True)
+    assert (f.stats.accepted, f.stats.duplicate) == (3, 1)
+
+
+def test_out_of_order():
+    f = ingest()
+    assert f.accept(b"1", NOW, NOW)
+    assert not f.accept(b"2", NOW - 1, NOW)
+    assert f.stats.out_of_order == 1
+
+    f = ingest(rejectOutOfOrder=False)
+    assert f.accept(b"1", NOW, NOW)
+    assert f.accept(b"2", NOW - 1, NOW)
+    assert f.latest == NOW
+
+
+def test_too_old():
+    f = ingest(maxAge=30)
+    assert f.accept(b"1", NOW - 30, NOW)
+    assert not f.accept(b"2", NOW - 31, NOW)
+    assert f.stats.too_old == 1
+
+
+def test_without_timestamp():
+    f = ingest(maxAge=30)
+    assert f.accept(b"1", None, NOW)
+    assert f.accept(b"1", None, NOW)
+    assert (f.stats.accepted, f.stats.no_timestamp) == (2, 2)
+
+
+def test_to_unix_timezone():
+    local = datetime(2024, 7, 1, 12, 0, 0)
+    berlin = ZoneInfo("Europe/Berlin")
+    # Summer time in Berlin: two hours ahead of utc
+    assert to_unix(local, berlin) == datetime(2024, 7, 1, 10, 0, 0, tzinfo=timezone.utc).timestamp()
+    # An offset in the payload wins over the configured zone
+    aware = datetime(2024, 7, 1, 12, 0, 0, tzinfo=timezone(timedelta(hours=1)))
+    assert to_unix(aware, berlin) == aware.timestamp()
+    assert to_unix(local, None) == local.timestamp()
+    assert to_unix(NOW, berlin) == NOW
+    assert to_unix(None, berlin) is None
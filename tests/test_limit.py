@@ -0,0 +1,143 @@
+import math
+import random
+import pytest
+import core.appconfig as appconfig
+from core.limit import LimitCalculator
+
+AVG = appconfig.PowerReadingSmoothingType.AVG
+
+# name: (attribute path, value) pairs applied to the template
+CASES = {
+    "none": [],
+    "avg": [("reading.smoothing", AVG), ("reading.smoothingSampleSizeDecrease", 4), ("reading.smoothingSampleSizeIncrease", 4)],
+    "split windows": [("reading.smoothing", AVG), ("reading.smoothingSampleSizeDecrease", 2), ("reading.smoothingSampleSizeIncrease", 8)],
+    "hysteresis burst": [("command.decrease.hysteresis", 25.0), ("command.increase.hysteresis", 40.0), ("command.decrease.burst", 3)],
+    "urgent": [("command.urgent_threshold", 300.0), ("command.decrease.throttle", 10)],
+    "retransmit": [("command.retransmit", 7), ("command.increase.hysteresis", 1000.0), ("command.decrease.hysteresis", 1000.0)],
+    "absolute offset": [("command.type", appconfig.InverterCommandType.ABSOLUTE), ("command.min_power", 30.0), ("reading.offset", -50.0)],
+    "unthrottled": [("command.decrease.throttle", 0), ("command.increase.throttle", 0), ("command.decrease.hysteresis", 15.0)],
+    "prediction": [("reading.smoothing", AVG), ("reading.smoothingSampleSizeDecrease", 3), ("reading.smoothingSampleSizeIncrease", 6),
+                   ("reading.predictionHorizon", 4.0), ("reading.predictionSampleSize", 5)],
+}
+
+
+def configure(config: appconfig.AppConfig, changes: list) -> appconfig.AppConfig:
+    for path, value in changes:
+        *parents, name = path.split(".")
+        obj = config
+        for parent in parents:
+            obj = getattr(obj, parent)
+        setattr(obj, name, value)
+    return config
+
+
+def readings(count: int, seed: int) -> tuple:
+    rnd = random.Random(seed)
+    times, values = [], []
+    t = 100.0
+    for _ in range(count):
+        t += rnd.choice((0.5, 1.0, 1.0, 2.5))
+        times.append(t)
+        values.append(round(rnd.gauss(200, 450), 2))
+    return times, values
+
+
+def same(a: float, b: float) -> bool:
+    return a == b or (math.isnan(a) and math.isnan(b))
+
+
+@pytest.mark.parametrize("name", list(CASES))
+def test_add_readings_equals_add_reading(app_config, name):
+    config = configure(app_config, CASES[name])
+    times, values = readings(3000, seed=len(name))
+    scalar = LimitCalculator(config)
+    batch = LimitCalculator(config)
+
+    # The batch continues where the scalar readings ended and is split, once shorter than the window
+    head = 50
+    for t, v in zip(times[:head], values[:head]):
+        scalar.add_reading(v, t)
+        batch.add_reading(v, t)
+    expected = [scalar.add_reading(v, t) for t, v in zip(times[head:], values[head:])]
+    rows = []
+    for start, end in ((head, 1000), (1000, 1002), (1002, len(times))):
+        columns = batch.add_readings(times[start:end], values[start:end])
+        rows.extend((columns, i) for i in range(len(columns)))
+
+    assert len(rows) == len(expected)
+    for (columns, i), r in zip(rows, expected):
+        command = math.nan if r.command is None else r.command
+        actual = (columns.reading[i], columns.sample[i], columns.overshoot[i], columns.limit[i], columns.command[i],
+                  columns.flags[i], columns.tokens[i], columns.elapsed[i])
+        wanted = (r.reading, r.sample, r.overshoot, r.limit, command, r.flags, r.tokens, r.elapsed)
+        assert all(same(a, b) for a, b in zip(actual, wanted)), (columns.timestamps[i], actual, wanted)
+
+    assert (batch.last_limit_value, batch.last_command_time, batch.is_calibrated) == (scalar.last_limit_value, scalar.last_command_time, scalar.is_calibrated)
+    assert str(batch.stats_decrease) == str(scalar.stats_decrease)
+    assert str(batch.stats_increase) == str(scalar.stats_increase)
+
+    # Same window and buckets: the next reading decides alike
+    a, b = scalar.add_reading(-700.0, times[-1] + 1), batch.add_reading(-700.0, times[-1] + 1)
+    assert (a.sample, a.limit, a.command, a.flags, a.tokens) == (b.sample, b.limit, b.command, b.flags, b.tokens)
+
+
+def test_add_readings_empty(app_config):
+    calc = LimitCalculator(app_config)
+    assert len(calc.add_readings([], [])) == 0
+
+
+def test_add_readings_length_mismatch(app_config):
+    with pytest.raises(ValueError):
+        LimitCalculator(app_config).add_readings([1.0, 2.0], [100.0])
+
+
+def test_add_readings_without_numpy(app_config, monkeypatch):
+    pytest.importorskip("numpy")
+    config = configure(app_config, CASES["split windows"])
+    times, values = readings(500, seed=7)
+    expected = LimitCalculator(config).add_readings(times, values)
+
+    monkeypatch.setattr("core.limit.numpy", None)
+    batch = LimitCalculator(config).add_readings(times, values)
+
+    assert isinstance(batch.limit, list)
+    assert batch.limit == expected.limit.tolist()
+    assert batch.flags == expected.flags.tolist()
+    assert batch.tokens == expected.tokens.tolist()
+
+
+def test_set_response_time_scales_directions(app_config):
+    app_config.command.adaptive_throttle.enabled = True
+    app_config.command.decrease.throttle = 5
+    app_config.command.increase.throttle = 15
+    calc = LimitCalculator(app_config)
+
+    assert calc.set_response_time(4.0) == 4.0
+    assert (calc.bucket_decrease.rate, calc.bucket_increase.rate) == (1 / 4.0, 1 / 12.0)
+
+    # Bounded by adaptiveThrottle.min / max, the estimate survives a reload
+    calc.set_response_time(0.5)
+    calc.apply_config(app_config)
+    assert (calc.bucket_decrease.rate, calc.bucket_increase.rate) == (1 / 2, 1 / 6)
+
+    app_config.command.adaptive_throttle.enabled = False
+    calc.apply_config(app_config)
+    assert (calc.bucket_decrease.rate, calc.bucket_increase.rate) == (1 / 5, 1 / 15)
+
+
+@pytest.mark.parametrize("throttle", [5, 10, 15])
+def test_default_directions_share_throttle(app_config, throttle):
+    # No command.decrease / command.increase: one command per throttle interval, whatever the direction
+    app_config.command.throttle = throttle
+    app_config.command.decrease.throttle = app_config.command.increase.throttle = throttle
+    rnd = random.Random(throttle)
+    count = 36000
+    times = [float(t) for t in range(count)]
+    values = [round(rnd.gauss(0, 400), 2) for _ in range(count)]
+
+    batch = LimitCalculator(app_config).add_readings(times, values)
+    calc = LimitCalculator(app_config)
+    commanded = [t for t, v in zip(times, values) if calc.add_reading(v, t).command is not None]
+
+    assert commanded == times[::throttle]
+    assert [t for t, c in zip(batch.timestamps, batch.command) if not math.isnan(c)] == commanded
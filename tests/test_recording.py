@@ -0,0 +1,44 @@
+import pytest
+import core.recording as recording
+from core.recording import RecordingWriter, read_recording
+
+
+@pytest.fixture
+def chunks(tmp_path):
+    """25 readings one second apart in chunks of 10"""
+    writer = RecordingWriter(str(tmp_path), chunk_records=10, flush_records=5)
+    for i in range(25):
+        writer.append(1000.0 + i, float(i), 0)
+    writer.close()
+    return str(tmp_path)
+
+
+def collect(path: str, start=None, end=None) -> tuple:
+    timestamps, values = [], []
+    for t, v in read_recording(path, start, end):
+        timestamps.extend(float(x) for x in t)
+        values.extend(float(x) for x in v)
+    return timestamps, values
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_read_recording_range(chunks, monkeypatch, use_numpy):
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(recording, "numpy", None)
+
+    assert len(recording.list_chunks(chunks)) == 3
+    assert collect(chunks) == ([1000.0 + i for i in range(25)], [float(i) for i in range(25)])
+    # Start inclusive, end exclusive, across a chunk border
+    assert collect(chunks, 1008.0, 1013.0)[1] == [8.0, 9.0, 10.0, 11.0, 12.0]
+    assert collect(chunks, 1030.0) == ([], [])
+
+
+def test_read_recording_views(chunks):
+    numpy = pytest.importorskip("numpy")
+    pairs = list(read_recording(chunks, 1003.0, 1015.0))
+
+    # One pair per chunk, the columns share the memory of the mapped chunk
+    assert [len(t) for t, _ in pairs] == [7, 5]
+    assert all(isinstance(t, numpy.memmap) and not t.flags["OWNDATA"] for t, _ in pairs)